@@ -0,0 +1,90 @@
+""" A benchmark of the recall and query latency of the approximate FAISS index types against the exact flat index.
+
+    Run from the project root directory: python benchmarks/bench_ann_recall.py --vectors 100000
+    or on the vectors of the saved flat database: python benchmarks/bench_ann_recall.py --db vector_store/db_faiss
+"""
+
+import os
+import sys
+import time
+import argparse
+import faiss
+import numpy as np
+
+# Get the absolute path to the project root directory
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+src_path = os.path.abspath(os.path.join(project_root, "src"))
+sys.path.insert(0, src_path)
+
+from faiss_index import FAISS_INDEX, build_index, set_search_parameters
+from chunk_store import CHUNK_STORE_FILE_NAME, CHUNK_STORE
+
+def generate_vectors(num_vectors: int, dimension: int, num_clusters: int=200) -> np.ndarray:
+    """ A function to generate clustered random unit vectors which resemble text embeddings more than uniform noise does.
+    """
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((num_clusters, dimension)).astype(np.float32)
+    vectors = centers[rng.integers(num_clusters, size=num_vectors)] + 0.5 * rng.standard_normal((num_vectors, dimension)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+def load_db_vectors(db_path: str) -> np.ndarray:
+    """ A function to read the vectors of a saved database from the embeddings kept in its chunk store.
+    """
+    chunk_store = CHUNK_STORE(os.path.join(db_path, CHUNK_STORE_FILE_NAME))
+    return np.vstack([vectors for _, vectors in chunk_store.iter_embeddings()])
+
+def search(index, queries: np.ndarray, k: int):
+    """ A function to return the result ids and the mean latency per query in milliseconds.
+    """
+    start_time = time.perf_counter()
+    _, ids = index.search(queries, k)
+    return ids, (time.perf_counter() - start_time) * 1000 / len(queries)
+
+def recall_at_k(ids: np.ndarray, true_ids: np.ndarray) -> float:
+    """ A function to return the fraction of the exact nearest neighbours which were found.
+    """
+    return np.mean([len(set(found) & set(true)) / len(true) for found, true in zip(ids, true_ids)])
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark recall and latency of approximate FAISS indexes.")
+    parser.add_argument("--vectors", type=int, default=100000, help="Number of generated vectors")
+    parser.add_argument("--dimension", type=int, default=1536, help="Dimension of generated vectors")
+    parser.add_argument("--db", default=None, help="Benchmark the vectors of a saved database instead of generated ones")
+    parser.add_argument("--queries", type=int, default=1000, help="Number of queries")
+    parser.add_argument("--k", type=int, default=4, help="Number of neighbours per query")
+    parser.add_argument("--types", default="ivf_flat,ivf_pq,hnsw", help="Comma separated index types to compare")
+    args = parser.parse_args()
+
+    vectors = load_db_vectors(os.path.join(project_root, args.db)) if args.db else generate_vectors(args.vectors, args.dimension)
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.choice(len(vectors), args.queries, replace=False)]
+    queries = queries + 0.05 * rng.standard_normal(queries.shape).astype(np.float32)
+    print(f"{len(vectors)} vectors of dimension {vectors.shape[1]}, {args.queries} queries, k={args.k}")
+
+    flat_index = faiss.IndexFlatL2(vectors.shape[1])
+    flat_index.add(vectors)
+    true_ids, flat_latency = search(flat_index, queries, args.k)
+    print(f"{'flat':>9} {'':>14} recall 1.000  {flat_latency:.3f} ms/query  {flat_index.ntotal * vectors.shape[1] * 4 / 1024 / 1024:.0f} MB")
+
+    for index_type in args.types.split(","):
+        # Always build the approximate index, whatever the size of the corpus
+        index_config = dict(FAISS_INDEX, type=index_type, min_vectors=0)
+        start_time = time.perf_counter()
+        index = build_index(vectors, index_config)
+        index.add(vectors)
+        build_time = time.perf_counter() - start_time
+        index_size = len(faiss.serialize_index(index)) / 1024 / 1024
+        print(f"{index_type:>9} built in {build_time:.1f} s, {index_size:.0f} MB")
+
+        if index_type == "hnsw":
+            sweep = [("efSearch", value, {"ef_search": value}) for value in (16, 32, 64, 128, 256)]
+        else:
+            sweep = [("nprobe", value, {"nprobe": value}) for value in (1, 4, 16, 64, 256)]
+        for name, value, parameters in sweep:
+            set_search_parameters(index, index_config, **parameters)
+            ids, latency = search(index, queries, args.k)
+            print(f"{'':>9} {name + '=' + str(value):>14} recall {recall_at_k(ids, true_ids):.3f}  {latency:.3f} ms/query")
+
+if __name__ == "__main__":
+    main()
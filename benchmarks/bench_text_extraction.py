@@ -0,0 +1,87 @@
+""" A benchmark comparing the streaming transcript extraction with the previous string concatenation on a generated pdf.
+
+    Run from the project root directory: python benchmarks/bench_text_extraction.py --pages 500
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import PyPDF2
+
+# Get the absolute path to the project root directory
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+src_path = os.path.abspath(os.path.join(project_root, "src"))
+sys.path.insert(0, src_path)
+
+from text_extraction import extract_text
+
+def write_test_pdf(file_path: str, num_pages: int, lines_per_page: int=45):
+    """ A function to write a minimal text pdf with the given number of pages without any extra dependency.
+    """
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for page_num in range(num_pages):
+        lines = [f"({'Speaker %d' % (line % 4)}: minute {page_num} line {line} we agreed to follow up on ticket {page_num * 100 + line}.) Tj T*"
+                 for line in range(lines_per_page)]
+        stream = ("BT /F1 10 Tf 12 TL 40 800 Td " + " ".join(lines) + " ET").encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id)
+        page_ids.append(len(objects))
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids).encode()
+    objects[1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % num_pages
+
+    with open(file_path, "wb") as pdf_file:
+        pdf_file.write(b"%PDF-1.4\n")
+        offsets = []
+        for object_id, content in enumerate(objects, start=1):
+            offsets.append(pdf_file.tell())
+            pdf_file.write(b"%d 0 obj\n" % object_id + content + b"\nendobj\n")
+        xref_offset = pdf_file.tell()
+        pdf_file.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for offset in offsets:
+            pdf_file.write(b"%010d 00000 n \n" % offset)
+        pdf_file.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset))
+
+def concatenate_text(file_path: str) -> str:
+    """ The previous extraction which concatenated the text of every page to a growing string.
+    """
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        num_pages = len(pdf_reader.pages)
+        text = ""
+        for page_num in range(num_pages):
+            page = pdf_reader.pages[page_num]
+            text += page.extract_text()
+        return text
+
+def run_benchmark(function, file_path: str, repeat: int):
+    """ A function to return the best wall clock time of a number of runs and the extracted text.
+    """
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        text = function(file_path)
+        timings.append(time.perf_counter() - start_time)
+    return min(timings), text
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark transcript text extraction on a generated pdf.")
+    parser.add_argument("--pages", type=int, default=500, help="Number of pages of the generated pdf")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs, the best one is reported")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        file_path = os.path.join(temp_dir, "transcript.pdf")
+        write_test_pdf(file_path, args.pages)
+        print(f"Generated {args.pages} page pdf of {os.path.getsize(file_path) / 1024 / 1024:.2f} MB")
+
+        for name, function in (("concatenation", concatenate_text), ("streaming", extract_text)):
+            elapsed, text = run_benchmark(function, file_path, args.repeat)
+            print(f"{name:>13}: {elapsed:.3f} s, {args.pages / elapsed:.1f} pages/s, "
+                  f"{len(text) / elapsed / 1024 / 1024:.2f} MB/s of text")
+
+if __name__ == "__main__":
+    main()
@@ -5,19 +5,14 @@ import sys
 import time
 import json
 import csv
+import uuid
 import pandas as pd
 import streamlit as st
-import PyPDF2
-from docx import Document
-from azure.storage.blob import BlobServiceClient
 from pages.settings import (
     page_config,
     custom_css,
-    delete_folder_contents,
-    write_uploaded_files,
-    meeting_minutes
+    write_uploaded_files
 )
-import io
 import base64
 
 # Get the absolute path to the project root directory
@@ -38,10 +33,17 @@ FAISS_DB_DIR = config["FAISS_DB_DIR"]  # Load Vector database directory name
 # Loading prompt templates and GPT Utilities from src
 from prompts import prompt_doc_qa
 from db_utils import VECTOR_DB_UTILS
+from text_extraction import extract_text, SUPPORTED_EXTENSIONS as TRANSCRIPT_EXTENSIONS
+from gpt_utils import api_key_hash
+from job_queue import get_job_queue, job_dedup_key, remove_upload, JOB_POLL_INTERVAL, ACTIVE_STATUSES, SUCCEEDED
+from docx_utils import minutes_heading, minutes_to_docx
 
 # Initialize Vector database
 vector_db = VECTOR_DB_UTILS()
 
+# Background jobs run on the worker pool of the process, shared by every session
+job_queue = get_job_queue()
+
 # Path for the knowledge base documents
 kb_path = f"{project_root}/{KNOWLEDGE_BASE_DIR}"
 db_path = f"{project_root}/{FAISS_DB_DIR}"
@@ -56,30 +58,69 @@ if "db_exist" not in st.session_state:
     st.session_state.db_exist = False
     st.session_state.db_list = False
 
-connection_string = os.environ.get("CONNECTION_STRING")
-container_name = "meeting-minutes"
+if "jobs" not in st.session_state:
+    st.session_state.jobs = {}  # Job ids of this session mapped to whether their completion was already shown
+    st.session_state.minutes_job = None
+
+JOB_LABELS = {
+    "ingest_documents": "Building database",
+    "refresh_blobs": "Refreshing transcripts",
+    "delete_transcripts": "Deleting transcripts",
+    "meeting_minutes": "Generating Minutes of Meeting",
+}
 
-blob_service_client = BlobServiceClient.from_connection_string(connection_string)
-container_client = blob_service_client.get_container_client(container_name)
+def submit_job(kind, **params):
+    """ A function to queue a background job with the API key hash of the session and return its id.
+        Jobs with the same input as a queued or running job are merged into it.
+    """
+    params["key_hash"] = api_key_hash(st.session_state.gpt.api_key)
+    dedup_key = job_dedup_key(kind, params["key_hash"], params.get("file_path"), params.get("file_names"))
+    job_id = job_queue.submit(kind, params, dedup_key=dedup_key)
+    st.session_state.jobs.setdefault(job_id, False)
+    return job_id
 
 def process_documents(merge_with_exist: bool=True):
-    """ A streamlit function to convert the uploaded document files into chunks and store in vector db.
+    """ A streamlit function to queue the conversion of the uploaded document files into chunks stored in vector db.
     """
     try:
-        db, db_build_time = vector_db.run_db_build(input_type="documents", embeddings=st.session_state.gpt.embeddings, merge_with_existing_db=merge_with_exist)
-        if db is not None:
-           # st.info(f"Database build completed in {db_build_time:.4f} seconds")
-            st.session_state.db_exist = True
-            return st.session_state.db_exist
-        else:
-            st.session_state.db_exist = False
-            return st.session_state.db_exist
+        job_id = submit_job("ingest_documents", merge_with_existing_db=merge_with_exist)
+        st.toast('Database build has been queued!')
+        return job_id
 
     except Exception as e:
         error_msg = f"An error occurred while reading files: {e}"
         st.error(error_msg)
-        st.session_state.db_exist = False
-        return st.session_state.db_exist  
+
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def job_status():
+    """ A streamlit fragment to poll the database jobs of the session and show their progress and outcome.
+    """
+    jobs = [job for job in job_queue.get_jobs(list(st.session_state.jobs)) if job["kind"] != "meeting_minutes"]
+    finished_jobs = []
+    for job in jobs:
+        label = JOB_LABELS.get(job["kind"], job["kind"])
+        if job["status"] in ACTIVE_STATUSES:
+            st.progress(job["progress"], text=f"{label}... {job['message']}")
+            continue
+
+        if job["status"] == SUCCEEDED:
+            result = job["result"]
+            for blob_name, error in result.get("download_failures", []):
+                st.warning(f"Could not download '{blob_name}': {error}")
+            for file_name, error in result.get("failures", []):
+                st.warning(f"Could not process '{file_name}': {error}")
+            if result.get("db_exist") is not None:
+                st.session_state.db_exist = result["db_exist"]
+        else:
+            st.error(f"{label} failed: {job['error']}")
+
+        if not st.session_state.jobs[job["job_id"]]:
+            st.session_state.jobs[job["job_id"]] = True
+            finished_jobs.append(job)
+
+    if finished_jobs:
+        # Show the new transcripts of the database
+        st.rerun()
 
 def input_documents():
     """ A streamlit function to provide upload interface for documents and extract information from it.
@@ -98,9 +139,7 @@ def input_documents():
             if not upload_state:
                 st.error("Error while uploading files. Please check input files.")
             else:
-                with st.spinner("Building database..."):
-                    db_status = process_documents(True)
-                    st.session_state.db_list = True
+                process_documents(True)
                     
     return uploaded_files           
 
@@ -121,23 +160,26 @@ def query_form():
 
     if submit_query:
         start_time = time.time()
-        local_db = vector_db.load_local_db(embeddings=st.session_state.gpt.embeddings)
+        local_db = vector_db.get_cached_db(embeddings=st.session_state.gpt.embeddings)
         if local_db is not None:
             with st.spinner("Retrieving response ..."):
-                response = st.session_state.gpt.retrieval_qa(
+                response = st.session_state.gpt.stream_retrieval_qa(
                     query=input_query,
                     prompt=prompt_doc_qa(),
                     db=local_db,
                     return_source_documents=return_source_docs,
+                    index_generation=vector_db.get_generation(),
                 )
         else:
             st.error("Database does not exist. Please build the database first.")
-            
-        end_time = time.time()
         
     if response is not None:
-        response_completion = response["result"]
-        
+        # Render the answer progressively as the tokens arrive
+        with st.expander("", expanded=True):
+            response_completion = st.write_stream(response["stream"])
+
+        end_time = time.time()
+
         response_source_docs = []
         
         if return_source_docs:
@@ -151,9 +193,6 @@ def query_form():
                     }
                 )
 
-        with st.expander("", expanded=True):
-            st.markdown(response_completion)
-            
         if return_source_docs:
             st.markdown(
                 f"<p style='font-size: smaller; color: green;'>Source documents: {response_source_docs}</p>",
@@ -164,38 +203,20 @@ def query_form():
             f"<p style='font-size: smaller; color: green;'>Reponse time: {(end_time - start_time):.4f} seconds</p>",
             unsafe_allow_html=True,
         )
+        timings = response["timings"]
+        st.markdown(
+            f"<p style='font-size: smaller; color: green;'>Retrieval: {timings['retrieval']:.4f} seconds, "
+            f"Prompt assembly: {timings['prompt_assembly']:.4f} seconds, First token: {timings.get('first_token', 0.0):.4f} seconds, "
+            f"LLM: {timings['llm']:.4f} seconds</p>",
+            unsafe_allow_html=True,
+        )
         
 def copy_and_process_files(kb_path, processed_file):
+    """ A function to queue the download of the new transcripts from blob storage and a single database build for the whole batch.
+    """
     try:
-        if not os.path.exists(kb_path):
-            os.makedirs(kb_path)
-        
-        new_docx_files = []
-        
-        if not os.path.exists(processed_file):
-            open(processed_file, 'w').close()
-        
-        with open(processed_file, 'r') as file:
-            processed_files = file.read().splitlines()
-            
-        blobs_list = container_client.list_blobs()
-        
-        for blob in blobs_list:
-            if blob.name.lower().endswith(('.docx', '.pdf')):
-                if blob.name not in processed_files:
-                    new_docx_files.append(blob.name) 
-                    
-        for blob.name in new_docx_files:
-            blob_client = container_client.get_blob_client(blob)
-            destination_file_path = os.path.join(kb_path, blob.name)
-            with open(destination_file_path, "wb") as local_file:
-                download_stream = blob_client.download_blob()
-                local_file.write(download_stream.readall())
-            print(f"Copied '{blob.name}' to '{kb_path}'")          
-            with open(processed_file, 'a') as file:
-                file.write(blob.name + '\n')
-            process_documents(True)
-    
+        return submit_job("refresh_blobs", ledger_path=processed_file)
+
     except Exception as e:
         print(f"An error occurred: {e}")
 
@@ -261,43 +282,33 @@ def delete_rows_from_csv(csv_file, uploaded_files_txt):
     except Exception as e:
         print(f"An error occurred: {e}")
 
+def delete_transcripts_from_db(uploaded_files_txt):
+    """ A function to queue the deletion of the chunks of the uploaded transcripts from the vector database, so that answers no longer use them.
+        The deletion waits for a running database build, so it runs as a job instead of blocking the page.
+    """
+    try:
+        # Read filenames from uploaded_files.txt
+        with open(uploaded_files_txt, 'r') as file:
+            uploaded_files = [file.strip() for file in file.readlines() if file.strip()]
+
+        if uploaded_files:
+            return submit_job("delete_transcripts", file_names=uploaded_files)
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+
 def read_text(file_path):
-    if file_path.endswith('.docx'):
-        doc = Document(file_path)
-        text = ""
-        for paragraph in doc.paragraphs:
-            text += paragraph.text + "\n"
-        return text
-    elif file_path.endswith('.pdf'):
-        with open(file_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            num_pages = len(pdf_reader.pages)
-            text = ""
-            for page_num in range(num_pages):
-                page = pdf_reader.pages[page_num]  # Access pages as an attribute
-                text += page.extract_text()
-            return text
+    """ A function to extract the transcript text, streaming pages or paragraphs and joining them once.
+    """
+    if file_path.endswith(TRANSCRIPT_EXTENSIONS):
+        return extract_text(file_path)
     else:
         return "Unsupported file format"
 
 def generate_docx(minutes, filename):
-    doc = Document()
-    file_stream = io.BytesIO()
-
-    for key, value in minutes.items():
-        # Replace underscores with spaces and capitalize each word for the heading
-        heading = ' '.join(word.capitalize() for word in key.split('_'))
-        doc.add_heading(heading, level=1)
-        doc.add_paragraph(value)
-        # Add a line break between sections
-        doc.add_paragraph()
-
-    doc.save(file_stream)
-    file_stream.seek(0)
+    file_stream = minutes_to_docx(minutes)
 
     st.markdown(get_binary_file_downloader_html(file_stream, filename), unsafe_allow_html=True)
-    
-    delete_folder_contents(mm_uploads_path)
 
 # Function to create a download link
 def get_binary_file_downloader_html(bin_file, file_label='File'):
@@ -324,19 +335,46 @@ def upload_files():
         if submit_button:
             if uploaded_file is None:
                 st.warning("Please upload a file.")
+            elif not uploaded_file.name.endswith(TRANSCRIPT_EXTENSIONS):
+                st.warning("Unsupported file format")
             else:
-                with st.spinner("Please wait. Generating Minutes of Meeting..."):
-                    # Create the directory if it doesn't exist
-                    if not os.path.exists(mm_uploads_path):
-                        os.makedirs(mm_uploads_path)
-                    file_path = os.path.join(mm_uploads_path, uploaded_file.name)
-                    with open(file_path, "wb") as f:
-                        f.write(uploaded_file.read())
-                                           
-                    transcription = read_text(file_path)
-                    minutes = meeting_minutes(transcription)
-                    filename = os.path.basename(file_path)
-                    generate_docx(minutes, filename)
+                # Each upload gets its own directory, so that files of the same name from other sessions are not overwritten
+                upload_dir = os.path.join(mm_uploads_path, uuid.uuid4().hex)
+                os.makedirs(upload_dir, exist_ok=True)
+                file_path = os.path.join(upload_dir, os.path.basename(uploaded_file.name))
+                with open(file_path, "wb") as f:
+                    f.write(uploaded_file.read())
+
+                job_id = submit_job("meeting_minutes", file_path=file_path)
+                if job_queue.get(job_id)["params"]["file_path"] != file_path:
+                    # The same transcript is already queued, and that job removes its own upload
+                    remove_upload(file_path)
+                st.session_state.minutes_job = job_id
+
+    minutes_status()
+
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def minutes_status():
+    """ A streamlit fragment to poll the meeting minutes job of the session and show the sections as they are generated.
+    """
+    job = job_queue.get(st.session_state.minutes_job) if st.session_state.minutes_job else None
+    if job is None:
+        return
+
+    if job["status"] in ACTIVE_STATUSES:
+        st.progress(job["progress"], text=f"Please wait. Generating Minutes of Meeting... {job['message']}")
+        for key, value in (job["partial"] or {}).items():
+            st.subheader(minutes_heading(key))
+            st.write(value)
+    elif job["status"] == SUCCEEDED:
+        minutes = job["result"]
+        for key, value in minutes.items():
+            st.subheader(minutes_heading(key))
+            st.write(value)
+        filename = os.path.basename(job["params"]["file_path"])
+        generate_docx(minutes, filename)
+    else:
+        st.error(f"Could not generate the Minutes of Meeting: {job['error']}")
 
 def main_page():
     """Streamlit content for Admin page"""
@@ -375,8 +413,10 @@ def main_page():
         st.caption('_:blue[* **Refresh** - downloads and processess the transcripts available in azure blob storage]_')       
         if refresh_database:
             copy_and_process_files(kb_path, processed_files_path) 
-            st.toast('Database has been refreshed!')
+            st.toast('Database refresh has been queued!')
             time.sleep(.5)
+
+        job_status()
             
         # delete_database = st.button(label="Delete Transcripts", key="Delete", use_container_width=False)
         # if delete_database:
@@ -403,12 +443,14 @@ def main_page():
         # st.caption('_:red[* **Delete** - deletes only the uploaded transcripts]_') 
 
         if drop_database:
+            if os.path.exists(uploaded_files_path) and delete_transcripts_from_db(uploaded_files_path):
+                st.toast('Deletion of the uploaded transcripts has been queued!')
+
             if os.path.exists(processed_dir_path) and os.path.exists(uploaded_files_path):
                 delete_files_in_folder(processed_dir_path, uploaded_files_path)
 
             if os.path.exists(current_db_info_file_path) and os.path.exists(uploaded_files_path):
                 delete_rows_from_csv(current_db_info_file_path, uploaded_files_path)
-                st.toast('Uploaded transcripts has been deleted!')
                 time.sleep(.5) 
 
         st.session_state.db_list = os.path.exists(current_db_info_file_path)
@@ -9,7 +9,7 @@ project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
 src_path = os.path.abspath(os.path.join(project_root, "src"))
 sys.path.insert(0, src_path)
 
-from gpt_utils import GPT_UTILS
+from gpt_utils import get_gpt_utils
 
 title_logo = Image.open("assets/HAI7_logo_white.png")
 
@@ -42,9 +42,8 @@ def page_config():
     openai_api_key = os.environ.get("OPENAI_API_KEY")
     
     if openai_api_key:
-        #Validate the API Key
-            test_gpt = GPT_UTILS(api_key=openai_api_key)
-            if test_gpt.validate_key():
+        #Validate the API Key, the result is cached per key so reruns do not call the model again
+            if get_gpt_utils(api_key=openai_api_key).validate_key():
                 set_open_api_key(openai_api_key)
             else:
                 st.error("Invalid API key. Please re-configure with valid API key")
@@ -53,7 +52,7 @@ def page_config():
         st.warning("Please configure your OpenAI API key")
     else:
         #st.success("OpenAI API key is configured")
-        st.session_state.gpt = GPT_UTILS(
+        st.session_state.gpt = get_gpt_utils(
             api_key=st.session_state.get("OPENAI_API_KEY", "")
         )
 
@@ -154,15 +153,4 @@ def write_uploaded_files(uploaded_files, folder_path):
         st.error("Please add the files first.")
         upload_success = False
 
-    return upload_success
-
-def meeting_minutes(transcription):
-    abstract_summary = st.session_state.gpt.abstract_summary_extraction(transcription)
-    key_points = st.session_state.gpt.key_points_extraction(transcription)
-    action_items = st.session_state.gpt.action_item_extraction(transcription)
-    
-    return {
-        'abstract_summary': abstract_summary,
-        'key_points': key_points,
-        'action_items': action_items
-    }
\ No newline at end of file
+    return upload_success
\ No newline at end of file
@@ -0,0 +1,159 @@
+""" A load test of the API service which sends concurrent requests and reports the throughput and latency percentiles.
+
+    With --start-servers it starts the mock OpenAI API and the service itself, so that nothing calls OpenAI:
+        python scripts/load_test.py --start-servers --endpoint query --concurrency 32 --requests 1000
+    Otherwise it targets a running service:
+        python scripts/load_test.py --url http://localhost:8000 --endpoint minutes --concurrency 16 --duration 30
+
+    /query needs a built database, which can be built against the mock API with POST /ingest.
+    Queries are numbered so that the completion and embedding caches do not answer them, unless --repeat is given.
+"""
+
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import contextlib
+import aiohttp
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+QUESTIONS = [
+    "What were the main decisions of the meeting",
+    "Who is responsible for the budget review",
+    "Summarise the discussion about the release schedule",
+    "Which action items are due next week",
+    "What risks were raised about the migration",
+]
+
+TRANSCRIPT = " ".join(
+    f"Speaker {index % 3 + 1}: We discussed item {index} and agreed that the team will follow up before the next meeting."
+    for index in range(40)
+)
+
+def request_payload(endpoint: str, index: int, repeat: bool) -> dict:
+    """ A function to return the JSON body of the index-th request to an endpoint.
+    """
+    if endpoint == "query":
+        question = random.choice(QUESTIONS)
+        return {"query": question if repeat else f"{question} (request {index})?"}
+    return {"text": TRANSCRIPT if repeat else f"Meeting {index}. {TRANSCRIPT}"}
+
+async def worker(session, url: str, endpoint: str, counter, deadline: float, total_requests: int, repeat: bool, results: list):
+    while time.perf_counter() < deadline:
+        index = next(counter)
+        if total_requests and index >= total_requests:
+            return
+        start_time = time.perf_counter()
+        try:
+            async with session.post(f"{url}/{endpoint}", json=request_payload(endpoint, index, repeat)) as response:
+                await response.read()
+                status = response.status
+        except aiohttp.ClientError as e:
+            status = type(e).__name__
+        results.append((status, time.perf_counter() - start_time))
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+async def run_load_test(args) -> list:
+    results = []
+    counter = iter(range(sys.maxsize))
+    deadline = time.perf_counter() + (args.duration if args.duration else float("inf"))
+    total_requests = 0 if args.duration else args.requests
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        await asyncio.gather(*(
+            worker(session, args.url, args.endpoint, counter, deadline, total_requests, args.repeat, results)
+            for _ in range(args.concurrency)
+        ))
+    return results
+
+def wait_until_ready(url: str, timeout: float):
+    """ A function to wait until a started server answers, raising an error if it does not in time.
+    """
+    async def poll():
+        deadline = time.perf_counter() + timeout
+        async with aiohttp.ClientSession() as session:
+            while time.perf_counter() < deadline:
+                try:
+                    async with session.get(url) as response:
+                        if response.status == 200:
+                            return
+                except aiohttp.ClientError:
+                    pass
+                await asyncio.sleep(0.2)
+        raise RuntimeError(f"{url} did not start within {timeout} seconds")
+    asyncio.run(poll())
+
+@contextlib.contextmanager
+def local_servers(args):
+    """ A context manager starting the mock OpenAI API and the service pointed to it, and stopping both on exit.
+        The service caches completions and embeddings in a temporary folder, so mock answers never reach the real caches.
+    """
+    processes = []
+    cache_dir = tempfile.TemporaryDirectory(prefix="load-test-cache-")
+    try:
+        processes.append(subprocess.Popen([sys.executable, os.path.join(project_root, "scripts", "mock_openai_server.py"),
+                                           "--port", str(args.mock_port)]))
+        wait_until_ready(f"http://127.0.0.1:{args.mock_port}/v1/models", timeout=30)
+
+        environment = dict(os.environ,
+                           OPENAI_API_BASE=f"http://127.0.0.1:{args.mock_port}/v1",
+                           OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY", "sk-mock"),
+                           CACHE_DIR=cache_dir.name)
+        processes.append(subprocess.Popen([sys.executable, "-m", "uvicorn", "api_service:app",
+                                           "--app-dir", os.path.join(project_root, "src"),
+                                           "--port", str(args.service_port), "--log-level", "warning"],
+                                          env=environment, cwd=project_root))
+        wait_until_ready(f"{args.url}/health", timeout=120)
+        yield
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            process.wait()
+        cache_dir.cleanup()
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the API service.")
+    parser.add_argument("--url", default=None, help="Base URL of a running service, by default the one started with --start-servers")
+    parser.add_argument("--endpoint", choices=["query", "minutes"], default="query")
+    parser.add_argument("--concurrency", type=int, default=32, help="Number of requests in flight")
+    parser.add_argument("--requests", type=int, default=500, help="Number of requests to send")
+    parser.add_argument("--duration", type=float, default=None, help="Seconds to send requests for, instead of a number of requests")
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds before a request is counted as failed")
+    parser.add_argument("--repeat", action="store_true", help="Send the same few requests, so that the caches answer most of them")
+    parser.add_argument("--start-servers", action="store_true", help="Start the mock OpenAI API and the service locally")
+    parser.add_argument("--mock-port", type=int, default=8010)
+    parser.add_argument("--service-port", type=int, default=8000)
+    args = parser.parse_args()
+    args.url = (args.url or f"http://127.0.0.1:{args.service_port}").rstrip("/")
+
+    with local_servers(args) if args.start_servers else contextlib.nullcontext():
+        start_time = time.perf_counter()
+        results = asyncio.run(run_load_test(args))
+        elapsed = time.perf_counter() - start_time
+
+    latencies = [latency for status, latency in results if status == 200]
+    failures = {}
+    for status, _ in results:
+        if status != 200:
+            failures[status] = failures.get(status, 0) + 1
+
+    print(f"Sent {len(results)} requests to /{args.endpoint} in {elapsed:.1f} seconds with {args.concurrency} in flight")
+    print(f"Throughput: {len(latencies) / elapsed:.1f} successful requests per second")
+    if latencies:
+        print(f"Latency: p50 {percentile(latencies, 0.5):.3f}s, p95 {percentile(latencies, 0.95):.3f}s, "
+              f"p99 {percentile(latencies, 0.99):.3f}s, max {max(latencies):.3f}s")
+    if failures:
+        print(f"Failures: {failures}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+""" A local mock of the OpenAI API used to try streaming and load test the app without calling OpenAI.
+
+    It serves /v1/chat/completions (with and without streaming, and function calls), /v1/embeddings and /v1/models with simulated latency.
+    Run from the project root directory: python scripts/mock_openai_server.py --port 8010
+    and point the app to it, with the caches in a temporary folder:
+        OPENAI_API_BASE=http://localhost:8010/v1 OPENAI_API_KEY=sk-mock CACHE_DIR=/tmp/mock-cache streamlit run frontend/main.py
+"""
+
+import json
+import time
+import uuid
+import hashlib
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EMBEDDING_DIMENSIONS = 1536
+
+def mock_embedding(text: str) -> list:
+    """ A function to return a deterministic unit vector for a text, so that equal texts get equal embeddings.
+    """
+    seed = hashlib.sha256(text.encode("utf-8")).digest()
+    values = [(seed[index % len(seed)] + index) % 251 / 250 - 0.5 for index in range(EMBEDDING_DIMENSIONS)]
+    norm = sum(value * value for value in values) ** 0.5
+    return [value / norm for value in values]
+
+def mock_answer(messages: list, num_tokens: int) -> list:
+    """ A function to return the tokens of a canned answer which echoes the start of the last message.
+    """
+    last_message = (messages[-1].get("content") or "") if messages else ""
+    words = ["Mock", "answer", "for:"] + last_message.split()[:20]
+    words += ["lorem"] * max(0, num_tokens - len(words))
+    return [f"{word} " for word in words[:num_tokens]]
+
+def mock_arguments(schema: dict, words: list):
+    """ A function to return a value matching a JSON schema of function parameters, built from the words of an answer.
+    """
+    if schema.get("type") == "object":
+        return {name: mock_arguments(property_schema, words) for name, property_schema in schema.get("properties", {}).items()}
+    if schema.get("type") == "array":
+        return [mock_arguments(schema.get("items", {}), words[index:]) for index in range(3)]
+    if schema.get("type") in ("integer", "number"):
+        return len(words)
+    if schema.get("type") == "boolean":
+        return True
+    return " ".join(words[:12]).strip()
+
+def mock_function_call(request: dict, tokens: list):
+    """ A function to return the name and the JSON arguments of the function a request asks for, or None to answer with text.
+    """
+    functions = request.get("functions") or []
+    function_call = request.get("function_call", "auto")
+    if not functions or function_call == "none":
+        return None
+    function = functions[0]
+    if isinstance(function_call, dict):
+        function = next((item for item in functions if item["name"] == function_call.get("name")), function)
+    return function["name"], json.dumps(mock_arguments(function.get("parameters", {}), [token.strip() for token in tokens]))
+
+class MOCK_OPENAI_HANDLER(BaseHTTPRequestHandler):
+    """ A request handler implementing the subset of the OpenAI API used by the app.
+    """
+
+    protocol_version = "HTTP/1.1"
+    first_token_latency = 0.3
+    token_latency = 0.02
+    answer_tokens = 60
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload: dict, status: int=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json({"object": "list", "data": [{"id": "mock", "object": "model"}]})
+        else:
+            self._send_json({"error": {"message": "Not found"}}, status=404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+
+        if self.path.endswith("/embeddings"):
+            inputs = request.get("input", [])
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            # langchain may send token ids instead of text
+            inputs = [json.dumps(item) if not isinstance(item, str) else item for item in inputs]
+            time.sleep(self.first_token_latency / 3)
+            self._send_json({
+                "object": "list",
+                "model": request.get("model"),
+                "data": [{"object": "embedding", "index": index, "embedding": mock_embedding(text)} for index, text in enumerate(inputs)],
+                "usage": {"prompt_tokens": 0, "total_tokens": 0},
+            })
+        elif self.path.endswith("/chat/completions"):
+            self._chat_completion(request)
+        else:
+            self._send_json({"error": {"message": "Not found"}}, status=404)
+
+    def _chat_completion(self, request: dict):
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        model = request.get("model", "mock")
+        num_tokens = min(request.get("max_tokens") or self.answer_tokens, self.answer_tokens)
+        tokens = mock_answer(request.get("messages", []), num_tokens)
+        function_call = mock_function_call(request, tokens)
+        if function_call is not None:
+            # The arguments are sent in pieces of about a token, like a streamed function call
+            name, arguments = function_call
+            pieces = [arguments[index:index + 4] for index in range(0, len(arguments), 4)]
+            message = {"role": "assistant", "content": None, "function_call": {"name": name, "arguments": arguments}}
+            deltas = [{"role": "assistant", "content": None, "function_call": {"name": name, "arguments": ""}}]
+            deltas += [{"function_call": {"arguments": piece}} for piece in pieces]
+            finish_reason = "function_call"
+        else:
+            pieces = tokens
+            message = {"role": "assistant", "content": "".join(tokens)}
+            deltas = [{"role": "assistant"}] + [{"content": token} for token in tokens]
+            finish_reason = "stop"
+        usage = {"prompt_tokens": 0, "completion_tokens": len(pieces), "total_tokens": len(pieces)}
+        time.sleep(self.first_token_latency)
+
+        if not request.get("stream"):
+            time.sleep(self.token_latency * len(pieces))
+            self._send_json({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        for index, delta in enumerate(deltas):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason if index == len(deltas) - 1 else None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(self.token_latency)
+        if (request.get("stream_options") or {}).get("include_usage"):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [],
+                "usage": usage,
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local mock of the OpenAI API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8010)
+    parser.add_argument("--first-token-latency", type=float, default=MOCK_OPENAI_HANDLER.first_token_latency,
+                        help="Seconds before the first token of a completion")
+    parser.add_argument("--token-latency", type=float, default=MOCK_OPENAI_HANDLER.token_latency,
+                        help="Seconds between two streamed tokens")
+    parser.add_argument("--answer-tokens", type=int, default=MOCK_OPENAI_HANDLER.answer_tokens,
+                        help="Maximum number of tokens of a completion")
+    args = parser.parse_args()
+
+    MOCK_OPENAI_HANDLER.first_token_latency = args.first_token_latency
+    MOCK_OPENAI_HANDLER.token_latency = args.token_latency
+    MOCK_OPENAI_HANDLER.answer_tokens = args.answer_tokens
+
+    server = ThreadingHTTPServer((args.host, args.port), MOCK_OPENAI_HANDLER)
+    print(f"Mock OpenAI API listening on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
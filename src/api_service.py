@@ -0,0 +1,262 @@
+""" An ASGI service to query the knowledge base, generate meeting minutes and queue ingestion over HTTP.
+    The process keeps one warm vector store and one GPT client, with its connection pool, shared by concurrent requests.
+    Blocking GPT and FAISS calls run on a thread pool of API_SERVICE_THREADS threads, so the event loop only parses requests.
+
+    Run from the project root directory:
+        OPENAI_API_KEY=sk-... uvicorn api_service:app --app-dir src --host 0.0.0.0 --port 8000
+
+    Endpoints:
+        GET  /health           the index generation and whether the database exists
+        POST /query            {"query": "...", "k": 6, "search_type": "mmr", "return_source_documents": false, "stream": false}
+        POST /minutes          {"text": "..."} or a multipart "file" (.pdf/.docx), with ?format=docx for a Word document
+        POST /ingest           multipart "files" saved to the knowledge base, or {"merge_with_existing_db": true}, queues a build
+                               A file whose name is already waiting in the knowledge base is rejected with 409
+        GET  /jobs/{job_id}    the state of a queued build
+"""
+
+import os
+import sys
+import json
+import uuid
+import tempfile
+import contextlib
+import anyio
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+# Get the absolute path to the project root directory
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(project_root, "src"))
+
+from prompts import prompt_doc_qa
+from gpt_utils import get_gpt_utils, api_key_hash
+from async_gpt_utils import close_async_gpt_utils
+from db_utils import VECTOR_DB_UTILS, knowledge_base_path
+from text_extraction import extract_text, SUPPORTED_EXTENSIONS
+from job_queue import get_job_queue, job_dedup_key
+from docx_utils import minutes_to_docx
+
+# Load the config.json file
+with open(f"{project_root}/config/config.json", "r") as config_file:
+    config = json.load(config_file)
+
+API_SERVICE_THREADS = config["API_SERVICE_THREADS"]  # Load number of threads running blocking GPT and FAISS calls
+
+DOCX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+SEARCH_TYPES = ("mmr", "similarity")
+
+class API_SERVICE:
+    """ A class holding the warm clients of the process, created once when the service starts.
+    """
+
+    def __init__(self, api_key: str) -> None:
+        self.gpt = get_gpt_utils(api_key)
+        self.key_hash = api_key_hash(api_key)
+        self.vector_db = VECTOR_DB_UTILS()
+        self.job_queue = get_job_queue()
+
+    def get_db(self):
+        """ A method to return the shared vector store, which is reloaded only after the saved index changes.
+        """
+        return self.vector_db.get_cached_db(embeddings=self.gpt.embeddings)
+
+def error_response(message: str, status_code: int) -> JSONResponse:
+    return JSONResponse({"error": message}, status_code=status_code)
+
+async def read_json(request) -> dict:
+    """ A function to return the JSON object of a request body, or an empty dictionary if the body is empty.
+    """
+    body = await request.body()
+    if not body:
+        return {}
+    payload = json.loads(body)
+    if not isinstance(payload, dict):
+        raise ValueError("The request body must be a JSON object")
+    return payload
+
+async def save_upload(upload, folder_path: str) -> str:
+    """ A function to write an uploaded transcript to a folder and return its path.
+        Raises FileExistsError if a file of the same name is already in the folder.
+    """
+    file_name = os.path.basename(upload.filename or "")
+    if not file_name.lower().endswith(SUPPORTED_EXTENSIONS):
+        raise ValueError(f"Unsupported file format of '{file_name}', expected {', '.join(SUPPORTED_EXTENSIONS)}")
+    os.makedirs(folder_path, exist_ok=True)
+    file_path = os.path.join(folder_path, file_name)
+    content = await upload.read()
+    await run_in_threadpool(_write_file, file_path, content)
+    return file_path
+
+def _write_file(file_path: str, content: bytes):
+    temp_path = f"{file_path}.{uuid.uuid4().hex}.tmp"
+    with open(temp_path, "wb") as output_file:
+        output_file.write(content)
+    try:
+        # Linking fails if the name exists, so a concurrent upload of the same name never overwrites a pending file
+        os.link(temp_path, file_path)
+    finally:
+        os.remove(temp_path)
+
+async def health(request):
+    service = request.app.state.service
+    db_exist = await run_in_threadpool(service.get_db) is not None
+    generation = await run_in_threadpool(service.vector_db.get_generation)
+    return JSONResponse({"status": "ok", "db_exist": db_exist, "index_generation": generation})
+
+async def query(request):
+    """ An endpoint to answer a question from the knowledge base, as JSON or as a stream of plain text tokens.
+    """
+    service = request.app.state.service
+    try:
+        payload = await read_json(request)
+    except ValueError as e:
+        return error_response(f"Invalid request body: {e}", 400)
+
+    input_query = payload.get("query")
+    k = payload.get("k", 6)
+    search_type = payload.get("search_type", "mmr")
+    return_source_docs = bool(payload.get("return_source_documents", False))
+    if not isinstance(input_query, str) or not input_query.strip():
+        return error_response("Please provide the question under the 'query' key.", 400)
+    if not isinstance(k, int) or k < 1:
+        return error_response("'k' must be a positive integer.", 400)
+    if search_type not in SEARCH_TYPES:
+        return error_response(f"'search_type' must be one of {', '.join(SEARCH_TYPES)}.", 400)
+
+    local_db = await run_in_threadpool(service.get_db)
+    if local_db is None:
+        return error_response("Database does not exist. Please build the database first.", 503)
+    index_generation = await run_in_threadpool(service.vector_db.get_generation)
+
+    qa_kwargs = dict(query=input_query,
+                     prompt=prompt_doc_qa(),
+                     db=local_db,
+                     return_source_documents=return_source_docs,
+                     index_generation=index_generation,
+                     k=k,
+                     search_type=search_type)
+
+    if payload.get("stream"):
+        response = await run_in_threadpool(service.gpt.stream_retrieval_qa, **qa_kwargs)
+        if response is None:
+            return error_response("Error retrieving response.", 502)
+        # The token generator is iterated on the thread pool by the streaming response
+        return StreamingResponse(response["stream"], media_type="text/plain; charset=utf-8")
+
+    response = await run_in_threadpool(service.gpt.retrieval_qa, **qa_kwargs)
+    if response is None:
+        return error_response("Error retrieving response.", 502)
+
+    result = {
+        "query": response["query"],
+        "result": response["result"],
+        "model": response["model"],
+        "timings": response["timings"],
+        "index_generation": qa_kwargs["index_generation"],
+    }
+    if return_source_docs:
+        result["source_documents"] = [
+            {"source": document.metadata["source"], "content": document.page_content}
+            for document in response["source_documents"]
+        ]
+    return JSONResponse(result)
+
+async def minutes(request):
+    """ An endpoint to generate the meeting minutes of a transcript given as text or as an uploaded file.
+    """
+    service = request.app.state.service
+    try:
+        if request.headers.get("content-type", "").startswith("multipart/form-data"):
+            async with request.form() as form:
+                upload = form.get("file")
+                if upload is None or isinstance(upload, str):
+                    return error_response("Please upload the transcript under the 'file' field.", 400)
+                with tempfile.TemporaryDirectory() as temp_dir:
+                    file_path = await save_upload(upload, temp_dir)
+                    transcription = await run_in_threadpool(extract_text, file_path)
+        else:
+            transcription = (await read_json(request)).get("text")
+    except ValueError as e:
+        return error_response(str(e), 400)
+
+    if not isinstance(transcription, str) or not transcription.strip():
+        return error_response("The transcript has no text.", 400)
+
+    try:
+        meeting_minutes = await run_in_threadpool(service.gpt.generate_meeting_minutes, transcription)
+    except Exception as e:
+        print(f"Error generating the meeting minutes: {e}")
+        return error_response("Error generating the meeting minutes.", 502)
+
+    if request.query_params.get("format") == "docx":
+        document = await run_in_threadpool(minutes_to_docx, meeting_minutes)
+        return Response(document.getvalue(), media_type=DOCX_MEDIA_TYPE,
+                        headers={"Content-Disposition": 'attachment; filename="meeting_minutes.docx"'})
+    return JSONResponse(meeting_minutes)
+
+async def ingest(request):
+    """ An endpoint to save uploaded transcripts to the knowledge base and queue a database build, returning its job id.
+        The build reads the knowledge base folder by file name, so a name which is still waiting there is rejected.
+        None of the files of a rejected request are kept.
+    """
+    service = request.app.state.service
+    merge_with_existing_db = True
+    uploaded = []
+    try:
+        if request.headers.get("content-type", "").startswith("multipart/form-data"):
+            async with request.form() as form:
+                for upload in form.getlist("files"):
+                    if not isinstance(upload, str):
+                        uploaded.append(os.path.basename(await save_upload(upload, knowledge_base_path)))
+        else:
+            merge_with_existing_db = bool((await read_json(request)).get("merge_with_existing_db", True))
+    except (FileExistsError, ValueError) as e:
+        for file_name in uploaded:
+            await run_in_threadpool(os.remove, os.path.join(knowledge_base_path, file_name))
+        if isinstance(e, FileExistsError):
+            file_name = os.path.basename(e.filename2 or e.filename)
+            return error_response(f"'{file_name}' is already waiting to be ingested, please retry once its build is done.", 409)
+        return error_response(str(e), 400)
+
+    params = {"key_hash": service.key_hash, "merge_with_existing_db": merge_with_existing_db}
+    dedup_key = await run_in_threadpool(job_dedup_key, "ingest_documents", service.key_hash)
+    job_id = await run_in_threadpool(service.job_queue.submit, "ingest_documents", params, dedup_key)
+    return JSONResponse({"job_id": job_id, "uploaded": uploaded}, status_code=202)
+
+async def job_status(request):
+    service = request.app.state.service
+    job = await run_in_threadpool(service.job_queue.get, request.path_params["job_id"])
+    if job is None:
+        return error_response("Unknown job id.", 404)
+    job.pop("params", None)
+    return JSONResponse(job)
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    api_key = os.environ.get("OPENAI_API_KEY")
+    if not api_key:
+        raise RuntimeError("Please set the OPENAI_API_KEY environment variable")
+
+    # Concurrent requests wait on the OpenAI API, so the thread pool is larger than the number of cores
+    anyio.to_thread.current_default_thread_limiter().total_tokens = API_SERVICE_THREADS
+    service = await run_in_threadpool(API_SERVICE, api_key)
+    # Load the index and build the QA prompt before the first request
+    await run_in_threadpool(service.get_db)
+    prompt_doc_qa()
+    app.state.service = service
+    yield
+    # Close the pooled OpenAI connections of the process
+    await run_in_threadpool(close_async_gpt_utils)
+
+app = Starlette(
+    routes=[
+        Route("/health", health, methods=["GET"]),
+        Route("/query", query, methods=["POST"]),
+        Route("/minutes", minutes, methods=["POST"]),
+        Route("/ingest", ingest, methods=["POST"]),
+        Route("/jobs/{job_id}", job_status, methods=["GET"]),
+    ],
+    lifespan=lifespan,
+)
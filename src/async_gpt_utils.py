@@ -0,0 +1,233 @@
+""" A python file to call the OpenAI API asynchronously over a pooled HTTP session with rate limiting and retries.
+    The API key is sent with every request instead of being set globally on the openai module.
+    GPT_UTILS sends its chat completions and the embedding pipeline its embeddings through this client.
+"""
+
+import os
+import json
+import asyncio
+import threading
+import aiohttp
+from ingest_manifest import content_hash
+from rate_limiter import backoff_delay, shared_rate_limiter
+
+# Get the absolute path to the project root directory
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Load the config.json file
+with open(f"{project_root}/config/config.json", "r") as config_file:
+    config = json.load(config_file)
+
+OPENAI_MAX_RETRIES = config["OPENAI_MAX_RETRIES"]  # Load maximum number of retries of a failed request
+OPENAI_MAX_CONNECTIONS = config["OPENAI_MAX_CONNECTIONS"]  # Load maximum number of pooled connections to the API
+OPENAI_REQUEST_TIMEOUT = config["OPENAI_REQUEST_TIMEOUT"]  # Load timeout of a single request in seconds
+
+# Status codes worth retrying: rate limited, timeouts and server errors
+RETRY_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+# Characters per token used to estimate the tokens of a request for rate limiting
+CHARS_PER_TOKEN_ESTIMATE = 4
+
+class OPENAI_API_ERROR(Exception):
+    """ An error returned by the OpenAI API which was not solved by retrying.
+    """
+
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(f"{status}: {message}")
+        self.status = status
+        self.message = message
+
+def estimate_request_tokens(messages, max_tokens: int=None) -> int:
+    """ A function to estimate the prompt and completion tokens of a chat request without a tokenizer, used for rate limiting.
+    """
+    num_chars = sum(len(str(message.get("content") or "")) for message in messages)
+    return num_chars // CHARS_PER_TOKEN_ESTIMATE + (max_tokens or 0)
+
+def chat_payload(model, messages, temperature, max_tokens=None, functions=None, function_call=None) -> dict:
+    """ A function to return the body of a chat completion request.
+    """
+    payload = {"model": model, "messages": messages, "temperature": temperature}
+    if max_tokens is not None:
+        payload["max_tokens"] = max_tokens
+    if functions:
+        payload["functions"] = functions
+        payload["function_call"] = function_call or "auto"
+    return payload
+
+class ASYNC_GPT_UTILS:
+    """ A class to call the OpenAI API asynchronously with one pooled HTTP session per API key.
+        The client runs its own event loop in a background thread, so synchronous code such as streamlit
+        callbacks can use it with run() and submit().
+    """
+
+    def __init__(self, api_key: str, api_base: str=None, rate_limiter=None, max_retries: int=OPENAI_MAX_RETRIES,
+                 max_connections: int=OPENAI_MAX_CONNECTIONS, request_timeout: float=OPENAI_REQUEST_TIMEOUT) -> None:
+        self.api_key = api_key
+        self.api_base = (api_base or os.environ.get("OPENAI_API_BASE") or "https://api.openai.com/v1").rstrip("/")
+        self.rate_limiter = rate_limiter or shared_rate_limiter(content_hash(api_key))
+        self.max_retries = max_retries
+        self.max_connections = max_connections
+        self.request_timeout = request_timeout
+        self._session = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="async-gpt-utils", daemon=True)
+        self._thread.start()
+
+    def submit(self, coroutine):
+        """ A method to schedule a coroutine on the event loop of the client and return a concurrent future.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    def run(self, coroutine):
+        """ A method to run a coroutine on the event loop of the client and wait for its result.
+        """
+        return self.submit(coroutine).result()
+
+    def iterate(self, async_iterator):
+        """ A generator to iterate an asynchronous generator of the client from synchronous code, one item at a time.
+            The asynchronous generator is closed if the caller stops early, which releases its response.
+        """
+        try:
+            while True:
+                try:
+                    yield self.run(async_iterator.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            self.run(async_iterator.aclose())
+
+    def close(self):
+        """ A method to close the HTTP session and stop the event loop.
+        """
+        if self._session is not None:
+            self.run(self._session.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def _get_session(self):
+        # The session is created lazily inside the client's event loop, which it is bound to
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.request_timeout),
+                headers={"Authorization": f"Bearer {self.api_key}"},
+            )
+        return self._session
+
+    async def _post(self, path: str, payload: dict, estimated_tokens: int, stream: bool=False, max_retries: int=None):
+        """ A method to post a request once the rate limiter admits it, retrying with jittered exponential backoff.
+            Returns the json body, or the open response of a streamed request which the caller has to release.
+        """
+        max_retries = self.max_retries if max_retries is None else max_retries
+        session = self._get_session()
+        for attempt in range(max_retries + 1):
+            await self.rate_limiter.acquire_async(estimated_tokens)
+            try:
+                response = await session.post(f"{self.api_base}{path}", json=payload)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                if attempt == max_retries:
+                    raise
+                delay = backoff_delay(attempt)
+                print(f"Request to {path} failed: {error}. Retrying in {delay:.1f} seconds.")
+                await asyncio.sleep(delay)
+                continue
+
+            if response.status == 200:
+                if stream:
+                    return response
+                async with response:
+                    return await response.json(content_type=None)
+
+            async with response:
+                message = await response.text()
+            if response.status not in RETRY_STATUS_CODES or attempt == max_retries:
+                raise OPENAI_API_ERROR(response.status, message)
+
+            retry_after = response.headers.get("Retry-After")
+            delay = backoff_delay(attempt, retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None)
+            print(f"Request to {path} returned {response.status}. Retrying in {delay:.1f} seconds.")
+            await asyncio.sleep(delay)
+
+    def _charge_usage(self, usage: dict, estimated_tokens: int):
+        # The estimate reserved max_tokens in full, so the limiter is corrected to the tokens the API reports as used
+        if usage and "total_tokens" in usage:
+            reserved_tokens = min(estimated_tokens, self.rate_limiter.token_capacity)
+            self.rate_limiter.consume(usage["total_tokens"] - reserved_tokens)
+
+    async def chat_completion(self, model, messages, temperature=0.5, max_tokens=None, functions=None, function_call=None,
+                              estimated_tokens: int=None) -> dict:
+        """ A method to return a chat completion response dictionary.
+        """
+
+        if estimated_tokens is None:
+            estimated_tokens = estimate_request_tokens(messages, max_tokens)
+        payload = chat_payload(model, messages, temperature, max_tokens, functions, function_call)
+        response = await self._post("/chat/completions", payload, estimated_tokens)
+        self._charge_usage(response.get("usage"), estimated_tokens)
+        return response
+
+    async def stream_chat_completion(self, model, messages, temperature=0.5, max_tokens=None, functions=None, function_call=None,
+                                     estimated_tokens: int=None):
+        """ A method to yield the delta of every chunk of a chat completion as it is generated, with the content tokens
+            or the function call arguments.
+        """
+
+        if estimated_tokens is None:
+            estimated_tokens = estimate_request_tokens(messages, max_tokens)
+        payload = chat_payload(model, messages, temperature, max_tokens, functions, function_call)
+        # The last chunk then reports the usage of the whole completion
+        payload.update(stream=True, stream_options={"include_usage": True})
+
+        response = await self._post("/chat/completions", payload, estimated_tokens, stream=True)
+        async with response:
+            async for line in response.content:
+                line = line.decode("utf-8").strip()
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                self._charge_usage(chunk.get("usage"), estimated_tokens)
+                choices = chunk.get("choices") or [{}]
+                delta = choices[0].get("delta")
+                if delta:
+                    yield delta
+
+    async def embeddings(self, model, texts: list, estimated_tokens: int=None, retry: bool=True) -> list:
+        """ A method to return the embeddings of a batch of texts in the order of the texts.
+            Without retry, a rate limited request raises at once so that the caller can shrink its batches instead.
+        """
+
+        if estimated_tokens is None:
+            estimated_tokens = sum(len(text) for text in texts) // CHARS_PER_TOKEN_ESTIMATE
+        response = await self._post("/embeddings", {"model": model, "input": texts}, estimated_tokens,
+                                    max_retries=None if retry else 0)
+        return [item["embedding"] for item in sorted(response["data"], key=lambda item: item["index"])]
+
+_shared_clients = {}
+_shared_lock = threading.Lock()
+
+def close_async_gpt_utils():
+    """ A function to close the HTTP sessions of the shared clients when the process shuts down.
+    """
+
+    with _shared_lock:
+        clients = list(_shared_clients.values())
+        _shared_clients.clear()
+    for client in clients:
+        client.close()
+
+def get_async_gpt_utils(api_key: str) -> ASYNC_GPT_UTILS:
+    """ A function to return the process wide asynchronous client of an API key, so every session shares its connections.
+    """
+
+    key_hash = content_hash(api_key)
+    with _shared_lock:
+        client = _shared_clients.get(key_hash)
+        if client is None:
+            client = ASYNC_GPT_UTILS(api_key=api_key)
+            _shared_clients[key_hash] = client
+        return client
@@ -0,0 +1,185 @@
+""" A python file to synchronise the transcripts stored in an Azure Blob Storage container into the knowledge base folder.
+    New blobs are streamed to disk concurrently, ingested in a single pass and only then recorded in the processed files ledger.
+"""
+
+import os
+import json
+import hashlib
+import concurrent.futures
+from azure.core import MatchConditions
+from azure.storage.blob import BlobServiceClient
+
+# Get the absolute path to the project root directory
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Load the config.json file
+with open(f"{project_root}/config/config.json", "r") as config_file:
+    config = json.load(config_file)
+
+BLOB_CONTAINER_NAME = config["BLOB_CONTAINER_NAME"]  # Load name of the container holding the transcripts
+BLOB_DOWNLOAD_WORKERS = config["BLOB_DOWNLOAD_WORKERS"]  # Load maximum number of concurrent blob downloads
+BLOB_DOWNLOAD_CHUNK_MB = config["BLOB_DOWNLOAD_CHUNK_MB"]  # Load size of a single streamed download request in megabytes
+
+SUPPORTED_EXTENSIONS = ('.docx', '.pdf')
+
+def create_container_client(connection_string: str, container_name: str=BLOB_CONTAINER_NAME):
+    """ A function to create a container client which downloads blobs in chunks of BLOB_DOWNLOAD_CHUNK_MB megabytes.
+    """
+    chunk_size = BLOB_DOWNLOAD_CHUNK_MB * 1024 * 1024
+    blob_service_client = BlobServiceClient.from_connection_string(connection_string,
+                                                                    max_single_get_size=chunk_size,
+                                                                    max_chunk_get_size=chunk_size)
+    return blob_service_client.get_container_client(container_name)
+
+def file_md5(file_path: str, block_size: int=1024 * 1024) -> bytes:
+    """ A function to return the md5 digest of a file, reading it in blocks.
+    """
+    digest = hashlib.md5()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            digest.update(block)
+    return digest.digest()
+
+class BLOB_SYNC_UTILS:
+    """ A class to download new transcripts from a blob container and keep the ledger of processed blobs.
+        Each ledger line holds the blob name and, for blobs synced by this class, its ETag separated by a tab.
+    """
+
+    def __init__(self, container_client, kb_path: str, ledger_path: str, max_workers: int=BLOB_DOWNLOAD_WORKERS) -> None:
+        self.container_client = container_client
+        self.kb_path = kb_path
+        self.ledger_path = ledger_path
+        self.max_workers = max_workers
+
+    def read_ledger(self) -> dict:
+        """ A method to return the processed blobs as a dictionary of blob name to ETag, None for entries without an ETag.
+        """
+        ledger = {}
+        if not os.path.exists(self.ledger_path):
+            return ledger
+        with open(self.ledger_path, 'r') as file:
+            for line in file.read().splitlines():
+                if line:
+                    blob_name, _, etag = line.partition("\t")
+                    ledger[blob_name] = etag or None
+        return ledger
+
+    def commit_ledger(self, blobs: list):
+        """ A method to atomically add the given (blob name, ETag) pairs to the ledger, so that an interrupted sync never records half a batch.
+        """
+        ledger = self.read_ledger()
+        ledger.update(blobs)
+
+        temp_path = f"{self.ledger_path}.tmp"
+        with open(temp_path, 'w') as file:
+            file.writelines(f"{name}\t{etag}\n" if etag else f"{name}\n" for name, etag in ledger.items())
+        os.replace(temp_path, self.ledger_path)
+
+    def list_new_blobs(self) -> list:
+        """ A method to return the properties of the supported blobs which are not in the ledger or changed since they were processed.
+        """
+        ledger = self.read_ledger()
+        new_blobs = []
+        for blob in self.container_client.list_blobs():
+            if not blob.name.lower().endswith(SUPPORTED_EXTENSIONS):
+                continue
+            if blob.name not in ledger:
+                new_blobs.append(blob)
+            elif ledger[blob.name] is not None and ledger[blob.name] != blob.etag:
+                print(f"'{blob.name}' changed since it was processed.")
+                new_blobs.append(blob)
+        return new_blobs
+
+    def local_path(self, blob_name: str) -> str:
+        """ A method to return the knowledge base path of a blob, flattening virtual folders into the file name.
+        """
+        return os.path.join(self.kb_path, blob_name.replace("/", "_"))
+
+    def download_blob(self, blob) -> str:
+        """ A method to stream a blob into the knowledge base folder chunk by chunk and return the local path.
+            The download is skipped when the local file already has the blob's content MD5, and resumed from a partial
+            file left by an interrupted download of the same ETag. The blob is written to a temporary file first so
+            that ingestion never sees a partial file.
+        """
+        destination_file_path = self.local_path(blob.name)
+        content_md5 = blob.content_settings.content_md5 if blob.content_settings else None
+        if content_md5 and os.path.isfile(destination_file_path) and file_md5(destination_file_path) == bytes(content_md5):
+            print(f"'{blob.name}' is already downloaded.")
+            return destination_file_path
+
+        temp_path = f"{destination_file_path}.part"
+        etag_path = f"{temp_path}.etag"
+        offset = 0
+        if os.path.isfile(temp_path) and os.path.isfile(etag_path):
+            with open(etag_path, 'r') as etag_file:
+                if etag_file.read() == blob.etag:
+                    offset = os.path.getsize(temp_path)
+        with open(etag_path, 'w') as etag_file:
+            etag_file.write(blob.etag)
+
+        blob_client = self.container_client.get_blob_client(blob.name)
+        if offset < blob.size:
+            # Only download the blob version listed, so that a resumed file is never stitched from two versions
+            download_stream = blob_client.download_blob(offset=offset,
+                                                        max_concurrency=1,
+                                                        etag=blob.etag,
+                                                        match_condition=MatchConditions.IfNotModified)
+            with open(temp_path, "ab" if offset else "wb") as local_file:
+                for chunk in download_stream.chunks():
+                    local_file.write(chunk)
+        elif offset > blob.size:
+            raise ValueError(f"Partial download of '{blob.name}' is larger than the blob.")
+        elif not os.path.isfile(temp_path):
+            # Empty blob
+            open(temp_path, "wb").close()
+
+        if content_md5 and file_md5(temp_path) != bytes(content_md5):
+            os.remove(temp_path)
+            raise ValueError(f"Content MD5 of '{blob.name}' does not match the downloaded file.")
+
+        os.replace(temp_path, destination_file_path)
+        os.remove(etag_path)
+        print(f"Copied '{blob.name}' to '{self.kb_path}'")
+        return destination_file_path
+
+    def download_new_blobs(self, blobs: list=None):
+        """ A method to download the new blobs concurrently, returning the downloaded (name, ETag) pairs and the failed names with errors.
+        """
+        os.makedirs(self.kb_path, exist_ok=True)
+        if blobs is None:
+            blobs = self.list_new_blobs()
+
+        downloaded, failures = [], []
+        if not blobs:
+            return downloaded, failures
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.max_workers, len(blobs))) as executor:
+            futures = [executor.submit(self.download_blob, blob) for blob in blobs]
+            for blob, future in zip(blobs, futures):
+                try:
+                    future.result()
+                    downloaded.append((blob.name, blob.etag))
+                except Exception as e:
+                    failures.append((blob.name, str(e)))
+                    print(f"Failed to download '{blob.name}': {e}")
+
+        return downloaded, failures
+
+    def sync(self, ingest, delete=None) -> dict:
+        """ A method to download every new blob, run a single ingestion pass over the batch and commit the ledger once.
+            ingest is a callable running the ingestion of the knowledge base folder and returning True on success.
+            delete is a callable removing the chunks of knowledge base file names from the database, called for the
+            blobs which changed since they were processed, so that the database never holds two versions of a transcript.
+        """
+        processed = self.read_ledger()
+        downloaded, failures = self.download_new_blobs()
+        ingested = False
+        if downloaded:
+            changed = [os.path.basename(self.local_path(name)) for name, _ in downloaded if name in processed]
+            if changed and delete is not None:
+                delete(changed)
+            ingested = bool(ingest())
+            if ingested:
+                self.commit_ledger(downloaded)
+
+        return {"downloaded": [name for name, _ in downloaded], "failures": failures, "ingested": ingested}
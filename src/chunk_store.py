@@ -0,0 +1,267 @@
+""" A python file to keep the chunks of the vector database in SQLite instead of a pickled in memory docstore.
+    Every chunk is a row with its vector id, source file, ingestion time, text, metadata and embedding, so that
+    merges only append rows and searches only read the rows of their hits. Deleted chunks leave a tombstone with
+    their vector id, which searches exclude until the index is compacted.
+    The text of every chunk is also kept in an SQLite FTS5 table, a lexical index which is updated in the same
+    transaction as the chunks and ranks exact words such as names, ticket numbers and dates with BM25.
+"""
+
+import os
+import re
+import json
+import time
+import sqlite3
+import unicodedata
+from collections.abc import Mapping
+import numpy as np
+from langchain.docstore.base import Docstore
+from langchain.docstore.document import Document
+
+CHUNK_STORE_FILE_NAME = "chunks.sqlite"
+
+# SQLite limits the number of variables in a single statement
+SQLITE_BATCH_SIZE = 500
+
+# Words as split by the unicode61 tokenizer of FTS5, which separates on everything but letters and numbers
+LEXICAL_TERM_PATTERN = re.compile(r"[^\W_]+")
+
+def lexical_term(word: str) -> str:
+    """ A function to fold a word as the unicode61 tokenizer does, in lower case and without diacritics.
+    """
+    decomposed = unicodedata.normalize("NFKD", word.lower())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+def _batches(values: list, batch_size: int=SQLITE_BATCH_SIZE):
+    for start in range(0, len(values), batch_size):
+        yield values[start:start + batch_size]
+
+class INDEX_TO_DOCSTORE_ID(Mapping):
+    """ A class to map vector ids of the FAISS index to chunk ids, read from the chunk store on access.
+    """
+
+    def __init__(self, chunk_store) -> None:
+        self.chunk_store = chunk_store
+
+    def __getitem__(self, vector_id: int) -> str:
+        with self.chunk_store._connect() as connection:
+            row = connection.execute("SELECT doc_id FROM chunks WHERE vector_id = ?", (int(vector_id),)).fetchone()
+        if row is None:
+            raise KeyError(vector_id)
+        return row[0]
+
+    def __iter__(self):
+        with self.chunk_store._connect() as connection:
+            vector_ids = [row[0] for row in connection.execute("SELECT vector_id FROM chunks ORDER BY vector_id")]
+        return iter(vector_ids)
+
+    def __len__(self) -> int:
+        return self.chunk_store.count()
+
+class CHUNK_STORE(Docstore):
+    """ A class to store the chunks of a FAISS vector database in SQLite, indexed by vector id, source and ingestion time.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        # The default rollback journal keeps the whole store in one file, so a rebuilt store can be moved in place
+        with self._connect() as connection:
+            connection.execute(
+                """CREATE TABLE IF NOT EXISTS chunks (
+                    vector_id INTEGER PRIMARY KEY,
+                    doc_id TEXT NOT NULL UNIQUE,
+                    source TEXT,
+                    page_content TEXT NOT NULL,
+                    metadata TEXT NOT NULL,
+                    ingested_at REAL NOT NULL,
+                    embedding BLOB
+                )"""
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS idx_chunks_source ON chunks (source)")
+            connection.execute("CREATE INDEX IF NOT EXISTS idx_chunks_ingested_at ON chunks (ingested_at)")
+            connection.execute("CREATE TABLE IF NOT EXISTS tombstones (vector_id INTEGER PRIMARY KEY, deleted_at REAL NOT NULL)")
+            lexical_index_exists = connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chunks_fts'"
+            ).fetchone() is not None
+        if not lexical_index_exists:
+            self._create_lexical_index()
+        self.index_to_docstore_id = INDEX_TO_DOCSTORE_ID(self)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _create_lexical_index(self):
+        """ A method to create the lexical index of the chunks, filling it from the chunks of a store created before it existed.
+        """
+        with self._connect() as connection:
+            # Only one process fills the index of an existing store
+            connection.execute("BEGIN IMMEDIATE")
+            if connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chunks_fts'").fetchone() is None:
+                connection.execute("CREATE VIRTUAL TABLE chunks_fts USING fts5(page_content)")
+                connection.execute("CREATE VIRTUAL TABLE chunks_fts_vocab USING fts5vocab(chunks_fts, 'row')")
+                connection.execute("INSERT INTO chunks_fts (rowid, page_content) SELECT vector_id, page_content FROM chunks")
+
+    @classmethod
+    def create(cls, path: str, vector_ids: list, doc_ids: list, documents: list, embeddings: np.ndarray):
+        """ A method to write a new chunk store next to its final path and move it in place at once, replacing any previous one.
+        """
+        temp_path = f"{path}.tmp"
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+        chunk_store = cls(temp_path)
+        chunk_store.add_chunks(vector_ids, doc_ids, documents, embeddings)
+        os.replace(temp_path, path)
+        chunk_store.path = path
+        return chunk_store
+
+    def add_chunks(self, vector_ids: list, doc_ids: list, documents: list, embeddings: np.ndarray):
+        """ A method to append chunks with their vector ids and float32 embeddings in a single transaction.
+            Rows left behind by an interrupted append are replaced, since the index never referred to them.
+        """
+        ingested_at = time.time()
+        rows = [
+            (int(vector_id), doc_id, document.metadata.get("source"), document.page_content,
+             json.dumps(document.metadata), ingested_at, np.asarray(embedding, dtype=np.float32).tobytes())
+            for vector_id, doc_id, document, embedding in zip(vector_ids, doc_ids, documents, embeddings)
+        ]
+        with self._connect() as connection:
+            connection.executemany(
+                """INSERT OR REPLACE INTO chunks (vector_id, doc_id, source, page_content, metadata, ingested_at, embedding)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                rows,
+            )
+            self._delete_lexical(connection, [row[0] for row in rows])
+            connection.executemany("INSERT INTO chunks_fts (rowid, page_content) VALUES (?, ?)",
+                                   [(row[0], row[3]) for row in rows])
+
+    @staticmethod
+    def _delete_lexical(connection, vector_ids: list):
+        for batch in _batches(vector_ids):
+            placeholders = ",".join("?" * len(batch))
+            connection.execute(f"DELETE FROM chunks_fts WHERE rowid IN ({placeholders})", batch)
+
+    def count(self) -> int:
+        with self._connect() as connection:
+            return connection.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def get_documents(self, vector_ids: list) -> dict:
+        """ A method to return the documents of vector ids as a dictionary, reading only the requested rows.
+        """
+        documents = {}
+        with self._connect() as connection:
+            for batch in _batches([int(vector_id) for vector_id in vector_ids]):
+                placeholders = ",".join("?" * len(batch))
+                for vector_id, page_content, metadata in connection.execute(
+                    f"SELECT vector_id, page_content, metadata FROM chunks WHERE vector_id IN ({placeholders})", batch
+                ):
+                    documents[vector_id] = Document(page_content=page_content, metadata=json.loads(metadata))
+        return documents
+
+    def get_embeddings(self, vector_ids: list) -> dict:
+        """ A method to return the stored embeddings of vector ids as a dictionary of float32 arrays.
+        """
+        embeddings = {}
+        with self._connect() as connection:
+            for batch in _batches([int(vector_id) for vector_id in vector_ids]):
+                placeholders = ",".join("?" * len(batch))
+                for vector_id, embedding in connection.execute(
+                    f"SELECT vector_id, embedding FROM chunks WHERE vector_id IN ({placeholders}) AND embedding IS NOT NULL", batch
+                ):
+                    embeddings[vector_id] = np.frombuffer(embedding, dtype=np.float32)
+        return embeddings
+
+    def iter_embeddings(self, first_vector_id: int=0, end_vector_id: int=None, batch_size: int=10000):
+        """ A generator to yield the vector ids and embeddings of the chunks in a vector id range, a batch at a time.
+        """
+        last_vector_id = first_vector_id - 1
+        end_vector_id = end_vector_id if end_vector_id is not None else 2 ** 63 - 1
+        while True:
+            with self._connect() as connection:
+                rows = connection.execute(
+                    """SELECT vector_id, embedding FROM chunks WHERE vector_id > ? AND vector_id < ? AND embedding IS NOT NULL
+                       ORDER BY vector_id LIMIT ?""",
+                    (last_vector_id, end_vector_id, batch_size),
+                ).fetchall()
+            if not rows:
+                return
+            last_vector_id = rows[-1][0]
+            yield [row[0] for row in rows], np.vstack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+
+    def delete_chunks(self, doc_ids: list=(), sources: list=(), keep_doc_ids=frozenset()) -> list:
+        """ A method to delete the chunks with the given chunk ids or source files, except those in keep_doc_ids, in a single
+            transaction. The vector ids of the deleted chunks are recorded as tombstones and returned.
+        """
+        with self._connect() as connection:
+            rows = {}
+            for column, values in (("doc_id", list(doc_ids)), ("source", list(sources))):
+                for batch in _batches(values):
+                    placeholders = ",".join("?" * len(batch))
+                    rows.update(connection.execute(
+                        f"SELECT vector_id, doc_id FROM chunks WHERE {column} IN ({placeholders})", batch
+                    ).fetchall())
+
+            vector_ids = sorted(vector_id for vector_id, doc_id in rows.items() if doc_id not in keep_doc_ids)
+            deleted_at = time.time()
+            connection.executemany("INSERT OR REPLACE INTO tombstones (vector_id, deleted_at) VALUES (?, ?)",
+                                   [(vector_id, deleted_at) for vector_id in vector_ids])
+            for batch in _batches(vector_ids):
+                placeholders = ",".join("?" * len(batch))
+                connection.execute(f"DELETE FROM chunks WHERE vector_id IN ({placeholders})", batch)
+            self._delete_lexical(connection, vector_ids)
+        return vector_ids
+
+    def lexical_search(self, query: str, k: int, max_term_ratio: float=1.0) -> list:
+        """ A method to return the vector ids of the k chunks which best match the words of a query, ranked by BM25.
+            Words found in more than max_term_ratio of the chunks are left out, since they hardly change the ranking
+            but make the search read most of the index. If every word of the query is that common, the rarest is kept.
+        """
+        terms = list(dict.fromkeys(lexical_term(term) for term in LEXICAL_TERM_PATTERN.findall(query)))
+        if not terms or k < 1:
+            return []
+
+        with self._connect() as connection:
+            placeholders = ",".join("?" * len(terms))
+            # Words which are not in any chunk can not match, only those in the vocabulary are searched
+            document_counts = dict(connection.execute(
+                f"SELECT term, doc FROM chunks_fts_vocab WHERE term IN ({placeholders})", terms
+            ).fetchall())
+            if not document_counts:
+                return []
+            chunk_count = connection.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+            max_documents = max(1, max_term_ratio * chunk_count)
+            terms = [term for term in terms if term in document_counts and document_counts[term] <= max_documents]
+            if not terms:
+                terms = [min(document_counts, key=document_counts.get)]
+
+            match = " OR ".join(f'"{term}"' for term in terms)
+            rows = connection.execute(
+                "SELECT rowid FROM chunks_fts WHERE chunks_fts MATCH ? ORDER BY rank LIMIT ?", (match, int(k))
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def tombstones(self) -> np.ndarray:
+        """ A method to return the vector ids of the deleted chunks which may still be in the index.
+        """
+        with self._connect() as connection:
+            rows = connection.execute("SELECT vector_id FROM tombstones ORDER BY vector_id").fetchall()
+        return np.array([row[0] for row in rows], dtype=np.int64)
+
+    def clear_tombstones(self, vector_ids: list):
+        """ A method to forget the tombstones of vector ids which were removed from the index by a compaction.
+        """
+        with self._connect() as connection:
+            for batch in _batches([int(vector_id) for vector_id in vector_ids]):
+                placeholders = ",".join("?" * len(batch))
+                connection.execute(f"DELETE FROM tombstones WHERE vector_id IN ({placeholders})", batch)
+
+    def search(self, search: str):
+        """ A method to return the document of a chunk id, or a message if it is not stored as langchain's docstores do.
+        """
+        with self._connect() as connection:
+            row = connection.execute("SELECT page_content, metadata FROM chunks WHERE doc_id = ?", (search,)).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(page_content=row[0], metadata=json.loads(row[1]))
+
+    def delete(self, ids: list) -> None:
+        self.delete_chunks(doc_ids=ids)
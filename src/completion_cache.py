@@ -0,0 +1,137 @@
+""" A python file to cache chat completions on disk so that repeated minutes and QA requests do not call the model again.
+    Completions are stored in SQLite keyed by the hash of the API base, model, messages, sampling settings and index
+    generation, so that the answers of another endpoint such as the local mock server are never served by the real one.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+import openai
+from ingest_manifest import content_hash
+
+# Get the absolute path to the project root directory
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Load the config.json file
+with open(f"{project_root}/config/config.json", "r") as config_file:
+    config = json.load(config_file)
+
+CACHE_DIR = os.environ.get("CACHE_DIR", config["CACHE_DIR"])  # Load cache directory name, relative to the project root or absolute
+COMPLETION_CACHE_TTL = config["COMPLETION_CACHE_TTL"]  # Load seconds after which a cached completion expires
+COMPLETION_CACHE_MAX_ENTRIES = config["COMPLETION_CACHE_MAX_ENTRIES"]  # Load maximum number of cached completions
+COMPLETION_CACHE_NONDETERMINISTIC = config["COMPLETION_CACHE_NONDETERMINISTIC"]  # Load whether completions with temperature above 0 are cached
+
+completion_cache_path = os.path.join(project_root, CACHE_DIR, "completions.sqlite")
+
+def completion_cache_key(model: str, messages, temperature: float, max_tokens: int=None, functions=None, index_generation=None,
+                         function_call=None, api_base: str=None) -> str:
+    """ A function to return the cache key of a chat completion request, sent to api_base or the API base of the openai module.
+    """
+    request = {
+        "api_base": (api_base or openai.api_base).rstrip("/"),
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "functions": functions or None,
+        "function_call": function_call,
+        "index_generation": index_generation,
+    }
+    return content_hash(json.dumps(request, sort_keys=True))
+
+class COMPLETION_CACHE:
+    """ A class to store chat completion responses with a time to live and least recently used eviction.
+    """
+
+    def __init__(self, cache_path: str=completion_cache_path, ttl: int=COMPLETION_CACHE_TTL,
+                 max_entries: int=COMPLETION_CACHE_MAX_ENTRIES, cache_nondeterministic: bool=COMPLETION_CACHE_NONDETERMINISTIC) -> None:
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.cache_nondeterministic = cache_nondeterministic
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                """CREATE TABLE IF NOT EXISTS completions (
+                    cache_key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )"""
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS idx_completions_last_access ON completions (last_access)")
+
+    def _connect(self):
+        return sqlite3.connect(self.cache_path, timeout=30)
+
+    def is_cacheable(self, temperature: float) -> bool:
+        """ A method to decide if a completion may be cached, by default only deterministic completions are.
+        """
+        return self.cache_nondeterministic or not temperature
+
+    def get(self, cache_key: str):
+        """ A method to return the cached response dictionary of a key, or None if it is missing or expired.
+        """
+        now = time.time()
+        with self._connect() as connection:
+            row = connection.execute("SELECT response, created_at FROM completions WHERE cache_key = ?", (cache_key,)).fetchone()
+            if row is not None and now - row[1] > self.ttl:
+                connection.execute("DELETE FROM completions WHERE cache_key = ?", (cache_key,))
+                row = None
+            if row is not None:
+                connection.execute("UPDATE completions SET last_access = ? WHERE cache_key = ?", (now, cache_key))
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, cache_key: str, response: dict):
+        """ A method to store a response dictionary and evict the least recently used entries above the entry limit.
+        """
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO completions (cache_key, response, created_at, last_access) VALUES (?, ?, ?, ?)",
+                (cache_key, json.dumps(response), now, now),
+            )
+            connection.execute(
+                """DELETE FROM completions WHERE cache_key IN (
+                    SELECT cache_key FROM completions ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                )""",
+                (self.max_entries,),
+            )
+
+    def stats(self) -> dict:
+        """ A method to return the hit and miss counters along with the number of cached completions.
+        """
+        with self._connect() as connection:
+            entries = connection.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": entries,
+            }
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+def shared_completion_cache() -> COMPLETION_CACHE:
+    """ A function to return the process wide completion cache so that counters are shared by every client.
+    """
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = COMPLETION_CACHE()
+        return _shared_cache
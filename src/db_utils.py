@@ -1,5 +1,5 @@
 """ A python file to process text or documents into text chunks followed by embeddings to store in vector databases.
-    It also provides the utilitie to clear the persisted db.
+    It also provides the utilitie to clear the persisted db and to delete transcripts from it.
 """
 
 import os
@@ -7,11 +7,28 @@ import time
 import json
 import datetime
 import shutil
+import threading
+import contextlib
+import concurrent.futures
+import sqlite3
+import faiss
+import numpy as np
 import pandas as pd
 from langchain.vectorstores import FAISS
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.document_loaders import TextLoader, PDFMinerLoader, UnstructuredExcelLoader
-from langchain.document_loaders.word_document import UnstructuredWordDocumentLoader
+from langchain.document_loaders import TextLoader, UnstructuredExcelLoader
+from ingest_manifest import INGEST_MANIFEST, content_hash, file_hash
+from text_extraction import TRANSCRIPT_LOADER
+from langchain.docstore.document import Document
+from faiss_index import (FAISS_INDEX, SEGMENTS_FILE_NAME, TEMPLATE_FILE_NAME, build_index, load_index, read_index, read_segments,
+                         set_search_parameters, template_outdated, write_index, write_segment, write_segments)
+from faiss_store import FAISS_STORE
+from chunk_store import CHUNK_STORE_FILE_NAME, CHUNK_STORE
+
+try:
+    import fcntl
+except ImportError:  # Windows has no advisory file locks, writers are then only serialized within a process
+    fcntl = None
 
 # Get the absolute path to the project root directory
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
@@ -27,12 +44,65 @@ KNOWLEDGE_BASE_DIR = config[
 FAISS_DB_DIR = config["FAISS_DB_DIR"]  # Load Vector database directory name
 CHUNK_SIZE = config["CHUNK_SIZE"]  # Loading Text chunk size as integer variable
 CHUNK_OVERLAP = config["CHUNK_OVERLAP"]  # Loading Text chunk overlap as integer variable
+LOADER_WORKERS = config["LOADER_WORKERS"]  # Loading number of processes used to load documents
 
 knowledge_base_path = f"{project_root}/{KNOWLEDGE_BASE_DIR}"
 processed_dir_path = f"{project_root}/processed_documents"
 faiss_db_path = f"{project_root}/{FAISS_DB_DIR}"
 current_db_info_file_path = f"{project_root}/db_details.csv"
 
+GENERATION_FILE_NAME = "generation"
+WRITE_LOCK_FILE_NAME = "write.lock"
+
+# Files of databases saved as a single index with a pickled or SQLite docstore, migrated on their first load
+LEGACY_INDEX_FILE_NAME = "index.faiss"
+LEGACY_PICKLE_DOCSTORE_FILE_NAME = "index.pkl"
+LEGACY_SQLITE_DOCSTORE_FILE_NAME = "docstore.sqlite"
+
+LOADER_MAPPING = {
+    '.pdf': TRANSCRIPT_LOADER,
+    '.docx': TRANSCRIPT_LOADER,
+    '.txt': TextLoader,
+    '.xlsx': UnstructuredExcelLoader,
+}
+
+# Process wide cache of loaded vector databases shared by every streamlit session
+_db_cache = {}
+_db_cache_lock = threading.RLock()  # Reentrant since loading may migrate a legacy database, which drops the cache entry
+
+# Serializes the changes to the saved database of this process, so that a background compaction never races a merge.
+# The file lock taken by the outermost holder extends it to the other processes of the host, e.g. job workers and the CLI.
+_db_write_lock = threading.RLock()
+_db_write_lock_depth = 0
+
+@contextlib.contextmanager
+def db_write_lock(db_path: str):
+    """ A context manager to hold the single writer lock of a saved vector database, reentrant within a thread.
+    """
+    global _db_write_lock_depth
+    with _db_write_lock:
+        lock_file = None
+        if _db_write_lock_depth == 0 and fcntl is not None:
+            os.makedirs(db_path, exist_ok=True)
+            lock_file = open(os.path.join(db_path, WRITE_LOCK_FILE_NAME), "a")
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        _db_write_lock_depth += 1
+        try:
+            yield
+        finally:
+            _db_write_lock_depth -= 1
+            if lock_file is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+
+def load_file(file_path: str) -> list:
+    """ A function to extract the document contents of a single file, defined at module level so that it can run in a worker process.
+    """
+    ext = "." + file_path.rsplit(".", 1)[-1]
+    loader_class = LOADER_MAPPING[ext]  # get the defined loader class for the given file type
+    loader = loader_class(file_path)  # define the loader for the file
+    return loader.load()  # extract the document contents using loader
+
 class VECTOR_DB_UTILS:
     """ A class to define various utilities for vector databases.
     """
@@ -42,56 +112,92 @@ class VECTOR_DB_UTILS:
         self.db_path = faiss_db_path
         self.chunk_size = CHUNK_SIZE
         self.chunk_overlap = CHUNK_OVERLAP
+        self.loader_workers = LOADER_WORKERS
+        self.index_config = FAISS_INDEX
+        self.last_load_failures = []
 
-    def create_documents(self) -> list:
+    def create_documents(self, manifest: INGEST_MANIFEST=None, max_workers: int=None) -> list:
         """ A method to extract the document contents from the documents that exist in a folder and returns the list of documents.
+            Files whose content hash is already recorded in the manifest are moved to the processed folder without being loaded.
+            Files are loaded on a process pool of max_workers processes, documents keep the sorted file name order and files
+            which fail to load are left in the folder and reported in self.last_load_failures instead of aborting the batch.
         """
 
-        loader_mapping = {
-                '.pdf': PDFMinerLoader,
-                '.docx': UnstructuredWordDocumentLoader,
-                '.txt': TextLoader,
-                '.xlsx': UnstructuredExcelLoader,
-            }
-        
         # Check if documents folder exist and not empty
         if os.path.exists(self.knowledge_base_path) and os.listdir(self.knowledge_base_path):
             # Define empty documents list
             documents = []
             df = pd.DataFrame(columns=['Input_Type', 'File_Name', 'File_Type', 'Executed_Time'])
             os.makedirs(processed_dir_path, exist_ok=True)
-            # Iterate over files and extract the text from documents
-            for file_name in os.listdir(self.knowledge_base_path):
+            self.last_load_failures = []
+
+            # Select the files to load in a deterministic order
+            files_to_load = []
+            for file_name in sorted(os.listdir(self.knowledge_base_path)):
                 file_path = os.path.join(self.knowledge_base_path, file_name)
                 ext = "." + file_path.rsplit(".", 1)[-1]
-                
-                if ext in loader_mapping:
-                    loader_class = loader_mapping[ext]  # get the defined loader class for the given file type
-                    loader = loader_class(file_path)  # define the loader for the file
-                    document_contents = loader.load()  # extract the document contents using loader
-                    documents.extend(document_contents)  # Append the existing document list
-
-                    file_info = {
-                        'Input_Type': "Document",
-                        'File_Name': file_name,
-                        'File_Type': ext,  # Get the file extension
-                        'Executed_Time': datetime.datetime.now()     # Get the current time
-                    }
-                    print(file_info)
-                    temp_df = pd.DataFrame(file_info, index=[0])
-
-                    # Append the information to the DataFrame
-                    df = pd.concat([df, temp_df], ignore_index=True)
-
-                    # Move processed documents to processed folder
-                    shutil.move(file_path, os.path.join(processed_dir_path, os.path.basename(file_path)))   
-                else:
-                    raise ValueError(f"Unsupported file extension: {ext}")
-        
+
+                if ext not in LOADER_MAPPING:
+                    self.last_load_failures.append((file_name, f"Unsupported file extension: {ext}"))
+                    continue
+
+                file_digest = file_hash(file_path)
+                if manifest is not None and manifest.has_file(file_digest):
+                    print(f"Skipping '{file_name}', the same content already exists in the database.")
+                    shutil.move(file_path, os.path.join(processed_dir_path, os.path.basename(file_path)))
+                    continue
+                files_to_load.append((file_name, file_path, ext, file_digest))
+
+            # Extract the text from documents
+            max_workers = max_workers or self.loader_workers
+            file_paths = [file_path for _, file_path, _, _ in files_to_load]
+            if max_workers > 1 and len(files_to_load) > 1:
+                with concurrent.futures.ProcessPoolExecutor(max_workers=min(max_workers, len(files_to_load))) as executor:
+                    futures = [executor.submit(load_file, file_path) for file_path in file_paths]
+                    results = [self._load_result(future.result) for future in futures]
+            else:
+                results = [self._load_result(load_file, file_path) for file_path in file_paths]
+
+            for (file_name, file_path, ext, file_digest), (document_contents, error) in zip(files_to_load, results):
+                if error is not None:
+                    self.last_load_failures.append((file_name, error))
+                    continue
+
+                for document in document_contents:
+                    document.metadata["file_hash"] = file_digest
+                documents.extend(document_contents)  # Append the existing document list
+
+                file_info = {
+                    'Input_Type': "Document",
+                    'File_Name': file_name,
+                    'File_Type': ext,  # Get the file extension
+                    'Executed_Time': datetime.datetime.now()     # Get the current time
+                }
+                print(file_info)
+                temp_df = pd.DataFrame(file_info, index=[0])
+
+                # Append the information to the DataFrame
+                df = pd.concat([df, temp_df], ignore_index=True)
+
+                # Move processed documents to processed folder
+                shutil.move(file_path, os.path.join(processed_dir_path, os.path.basename(file_path)))
+
+            for file_name, error in self.last_load_failures:
+                print(f"Failed to load '{file_name}': {error}")
+
             return documents, df
         else:
             return None
 
+    @staticmethod
+    def _load_result(function, *args):
+        """ A method to call a loading function and return its result together with the error message, if any.
+        """
+        try:
+            return function(*args), None
+        except Exception as e:
+            return None, str(e)
+
     def process_documents(self, documents):
         """ A method to convert the extracted documents into chunks and return splitted data.
         """
@@ -107,74 +213,390 @@ class VECTOR_DB_UTILS:
         
         return text_chunks
 
-    def run_db_build(self, input_type, embeddings, page_content="", source_url= "", merge_with_existing_db: bool=False, **kwargs):
-        """ A method to build the vector db and store in the defined database path.
+    def filter_new_chunks(self, text_chunks, manifest: INGEST_MANIFEST):
+        """ A method to drop the text chunks whose content hash already exists in the manifest or earlier in the batch.
+            Returns the new chunks, their hashes to be used as docstore ids and the chunk hashes of every file.
         """
-        try:
-            start_time = time.time()
-            os.makedirs(self.db_path, exist_ok=True)
-
-            # Get extracted documents content
-            if input_type == "documents":
-                documents, doc_df = self.create_documents()
-
-            # Get the text chunks
-            if documents is not None:
-                processed_documents = self.process_documents(documents=documents)
-            else:
-                print("No document content is provided.")                
-
-            # Build vector db
-            new_db = FAISS.from_documents(documents=processed_documents, embedding=embeddings)
-
-            if merge_with_existing_db:
-                exist_db = self.load_local_db(embeddings)
-                # print(f"Exist_DB:{exist_db.docstore.__dict__}")
-                if exist_db is not None:
-                    print("Merging new db into existing. . .")
-                    exist_db.merge_from(new_db)
-                    # Save the new merged database
-                    exist_db.save_local(self.db_path)
-                    final_db = exist_db
-                    # print(f"Merged_DB:{final_db.docstore.__dict__}")
-                    if os.path.exists(current_db_info_file_path):
-                        exist_df = pd.read_csv(current_db_info_file_path)
-                    else:
-                        exist_df = pd.DataFrame(columns=['Input_Type', 'File_Name', 'File_Type', 'Executed_Time'])
-                    
-                    merge_df = pd.concat([exist_df, doc_df], ignore_index=True)
-                    merge_df.to_csv(current_db_info_file_path, index=False)
-                else:
-                    print("No db exists. . .")
-                    new_db.save_local(self.db_path)
-                    final_db = new_db
-                    # print(f"New_DB:{final_db.docstore.__dict__}")
-                    doc_df.to_csv(current_db_info_file_path, index=False)
-            else:
-                print("Overwriting existing database. . .")
-                new_db.save_local(self.db_path)
-                final_db = new_db
-                # print(f"New_DB:{final_db.docstore.__dict__}")
-                doc_df.to_csv(current_db_info_file_path, index=False)
+        new_chunks = []
+        new_chunk_ids = []
+        seen_chunk_ids = set()
+        file_chunks = {}
+        for chunk in text_chunks:
+            chunk_digest = content_hash(chunk.page_content)
+            file_digest = chunk.metadata.get("file_hash", "")
+            file_name = os.path.basename(chunk.metadata.get("source", ""))
+            file_chunks.setdefault(file_digest, (file_name, []))[1].append(chunk_digest)
 
-            # if merge_with_existing_db:
-            #     new_db.save_local(self.db_path)
-            # else:
-            #     new_db.save_local(self.db_path)
+            if manifest.has_chunk(chunk_digest) or chunk_digest in seen_chunk_ids:
+                continue
+            seen_chunk_ids.add(chunk_digest)
+            new_chunks.append(chunk)
+            new_chunk_ids.append(chunk_digest)
 
-            end_time = time.time()
+        return new_chunks, new_chunk_ids, file_chunks
 
-            return final_db, end_time-start_time
+    def run_db_build(self, input_type, embeddings, page_content="", source_url= "", merge_with_existing_db: bool=False, progress=None, **kwargs):
+        """ A method to build the vector db and store in the defined database path.
+            Only the chunks which are not yet recorded in the ingestion manifest are embedded and appended to the database.
+            The whole build holds the writer lock of the database, so that concurrent builds never embed the same files twice.
+            progress is an optional callable taking the completed fraction and a message of the current step.
+        """
+        try:
+            with db_write_lock(self.db_path):
+                return self._run_db_build(input_type, embeddings, merge_with_existing_db, progress or (lambda fraction, message: None))
         
         except Exception as e:
             error_msg = f"An error occurred while reading files: {e}"
             print(error_msg)
             return None, 0.00
 
-    def load_local_db(self, embeddings):
+    def _run_db_build(self, input_type, embeddings, merge_with_existing_db: bool, progress):
+        """ A method to run a build of the vector db while holding its writer lock.
+        """
+        start_time = time.time()
+        os.makedirs(self.db_path, exist_ok=True)
+
+        manifest = INGEST_MANIFEST(self.db_path)
+        exist_db = self.get_cached_db(embeddings) if merge_with_existing_db else None
+        if exist_db is None:
+            # Nothing is stored yet or the database is overwritten, so every file and chunk is new
+            manifest.reset()
+
+        # Get extracted documents content
+        progress(0.1, "Loading documents")
+        documents, doc_df = None, None
+        if input_type == "documents":
+            created_documents = self.create_documents(manifest=manifest)
+            if created_documents is not None:
+                documents, doc_df = created_documents
+
+        if not documents:
+            print("No new document content is provided.")
+            return exist_db, time.time() - start_time
+
+        # Get the text chunks and skip those which are already embedded
+        progress(0.4, "Splitting documents into chunks")
+        processed_documents = self.process_documents(documents=documents)
+        new_chunks, new_chunk_ids, file_chunks = self.filter_new_chunks(processed_documents, manifest)
+
+        progress(0.5, f"Embedding {len(new_chunks)} new chunks")
+        if not new_chunks:
+            print("All chunks already exist in the database. . .")
+            final_db = exist_db
+        elif exist_db is not None:
+            print(f"Appending {len(new_chunks)} new chunks into existing db. . .")
+            self.append_chunks(new_chunks, new_chunk_ids, embeddings)
+            final_db = self.get_cached_db(embeddings)
+        else:
+            print("Overwriting existing database. . .")
+            self.create_db(new_chunks, new_chunk_ids, embeddings)
+            final_db = self.get_cached_db(embeddings)
+
+        if final_db is None:
+            return None, 0.00
+
+        # Record the files and chunks only after the database is saved
+        for file_digest, (file_name, chunk_digests) in file_chunks.items():
+            manifest.add_file(file_digest, file_name, chunk_digests)
+        manifest.save()
+
+        if exist_db is not None and os.path.exists(current_db_info_file_path):
+            exist_df = pd.read_csv(current_db_info_file_path)
+            merge_df = pd.concat([exist_df, doc_df], ignore_index=True)
+            merge_df.to_csv(current_db_info_file_path, index=False)
+        else:
+            doc_df.to_csv(current_db_info_file_path, index=False)
+
+        end_time = time.time()
+
+        return final_db, end_time-start_time
+
+    def load_local_db(self, embeddings, mmap: bool=True):
         """ A simple method to load locally saved vector database.
+            The index segments are memory mapped read only and chunks are read from the chunk store only for the hits of a
+            search, so neither the load time nor the memory of the process grow with the corpus.
+        """
+        self._migrate_legacy_db(embeddings)
+        segments = read_segments(self.db_path)
+        if segments is None or not segments["segments"]:
+            return None
+
+        index = load_index(self.db_path, segments, mmap=mmap)
+        set_search_parameters(index, self.index_config)
+        chunk_store = CHUNK_STORE(os.path.join(self.db_path, CHUNK_STORE_FILE_NAME))
+        return FAISS_STORE(embeddings, index, chunk_store, self, tombstones=chunk_store.tombstones())
+
+    def _create_store(self, documents: list, doc_ids: list, vectors: np.ndarray, template):
+        """ A method to replace the saved database with a chunk store and a single index segment of the given chunks.
+        """
+        old_segments = read_segments(self.db_path)
+        vector_ids = np.arange(len(documents), dtype=np.int64)
+        CHUNK_STORE.create(os.path.join(self.db_path, CHUNK_STORE_FILE_NAME), vector_ids, doc_ids, documents, vectors)
+        write_index(template, os.path.join(self.db_path, TEMPLATE_FILE_NAME))
+
+        empty_segments = {"segments": [], "next_segment": old_segments["next_segment"] if old_segments else 0, "next_vector_id": 0}
+        segments = write_segment(self.db_path, empty_segments, template, vector_ids, vectors)
+        self._publish_segments(segments, obsolete_segments=old_segments["segments"] if old_segments else [])
+
+    def create_db(self, chunks: list, chunk_ids: list, embeddings):
+        """ A method to embed the chunks into a new database which replaces the saved one, with an index of the configured type.
+        """
+        vectors = np.array(embeddings.embed_documents([chunk.page_content for chunk in chunks]), dtype=np.float32)
+        template = build_index(vectors, self.index_config)
+        with db_write_lock(self.db_path):
+            self._create_store(chunks, chunk_ids, vectors, template)
+
+    def append_chunks(self, chunks: list, chunk_ids: list, embeddings):
+        """ A method to embed the chunks and append them to the saved database as rows of the chunk store and a new index segment.
+            Nothing saved before is rewritten, except when the number of segments exceeds max_segments and the segments
+            after the first are merged into one.
         """
-        if os.path.exists(self.db_path) and os.path.isfile(os.path.join(self.db_path, "index.faiss")):
-            return FAISS.load_local(self.db_path, embeddings)
+        self._migrate_legacy_db(embeddings)
+        vectors = embeddings.embed_documents([chunk.page_content for chunk in chunks])
+        self.append_vectors(chunks, chunk_ids, vectors)
+
+    def append_vectors(self, chunks: list, chunk_ids: list, vectors):
+        """ A method to append chunks which are already embedded to the saved database, taking the write lock.
+        """
+        with db_write_lock(self.db_path):
+            self._append_vectors(chunks, chunk_ids, np.array(vectors, dtype=np.float32))
+
+    def _append_vectors(self, chunks: list, chunk_ids: list, vectors: np.ndarray):
+        """ A method to append embedded chunks to the saved database, holding the write lock.
+        """
+        segments = read_segments(self.db_path)
+        vector_ids = np.arange(segments["next_vector_id"], segments["next_vector_id"] + len(chunks), dtype=np.int64)
+
+        # Chunks are written before the segment which refers to them is published
+        chunk_store = CHUNK_STORE(os.path.join(self.db_path, CHUNK_STORE_FILE_NAME))
+        chunk_store.add_chunks(vector_ids, chunk_ids, chunks, vectors)
+
+        template = read_index(os.path.join(self.db_path, TEMPLATE_FILE_NAME), mmap=False)
+        segments = write_segment(self.db_path, segments, template, vector_ids, vectors)
+
+        obsolete_segments = []
+        tombstones = None
+        if len(segments["segments"]) > self.index_config["max_segments"] and template_outdated(template, self.index_config, chunk_store.count()):
+            # The corpus outgrew the index type the template was trained for
+            obsolete_segments = segments["segments"]
+            tombstones = chunk_store.tombstones()
+            segments = self._rebuild_segments(segments, chunk_store)
+        elif len(segments["segments"]) > self.index_config["max_segments"]:
+            obsolete_segments = segments["segments"][1:]
+            print(f"Merging {len(obsolete_segments)} index segments. . .")
+            first_vector_id = obsolete_segments[0]["first_vector_id"]
+            batches = list(chunk_store.iter_embeddings(first_vector_id, segments["next_vector_id"]))
+            segments = dict(segments, segments=segments["segments"][:1])
+            if batches:
+                # Deleted chunks have no rows, so the merged segment leaves out their vectors
+                segments = write_segment(self.db_path, segments, template,
+                                         np.concatenate([batch_ids for batch_ids, _ in batches]),
+                                         np.vstack([batch_vectors for _, batch_vectors in batches]))
+
+        self._publish_segments(segments, obsolete_segments=obsolete_segments)
+        if tombstones is not None:
+            chunk_store.clear_tombstones(tombstones)
+
+    def _rebuild_segments(self, segments: dict, chunk_store) -> dict:
+        """ A method to train a new template index of the configured type on the embeddings of the chunk store, which
+            leave out the deleted chunks, and write them as a single segment. Returns the segment list for the caller to publish.
+        """
+        batches = list(chunk_store.iter_embeddings())
+        rebuilt_segments = dict(segments, segments=[])
+        if not batches:
+            return rebuilt_segments
+
+        vector_ids = np.concatenate([batch_ids for batch_ids, _ in batches])
+        vectors = np.vstack([batch_vectors for _, batch_vectors in batches])
+        template = build_index(vectors, self.index_config)
+        write_index(template, os.path.join(self.db_path, TEMPLATE_FILE_NAME))
+        return write_segment(self.db_path, rebuilt_segments, template, vector_ids, vectors)
+
+    def rebuild_index(self):
+        """ A method to train the index again on every live chunk and replace the segments with a single one, for example
+            after changing the index type in the config. Appends and compactions do it on their own once the corpus
+            outgrows the trained index.
+        """
+        with db_write_lock(self.db_path):
+            segments = read_segments(self.db_path)
+            if segments is None:
+                return
+            chunk_store = CHUNK_STORE(os.path.join(self.db_path, CHUNK_STORE_FILE_NAME))
+            tombstones = chunk_store.tombstones()
+            print(f"Rebuilding the vector database index from {chunk_store.count()} chunks. . .")
+            self._publish_segments(self._rebuild_segments(segments, chunk_store), obsolete_segments=segments["segments"])
+            chunk_store.clear_tombstones(tombstones)
+
+    def _publish_segments(self, segments: dict, obsolete_segments: list=()):
+        """ A method to publish a new segment list, remove the segment files it no longer uses and increase the generation.
+            Sessions load the database again memory mapped, instead of sharing the in memory copy of the build.
+        """
+        write_segments(self.db_path, segments)
+        used_files = {segment["file"] for segment in segments["segments"]}
+        for segment in obsolete_segments:
+            if segment["file"] not in used_files and os.path.exists(os.path.join(self.db_path, segment["file"])):
+                # Mapped readers keep the removed file open until they reload
+                os.remove(os.path.join(self.db_path, segment["file"]))
+
+        generation_path = os.path.join(self.db_path, GENERATION_FILE_NAME)
+        temp_path = f"{generation_path}.tmp"
+        with open(temp_path, "w") as generation_file:
+            generation_file.write(str(self.get_generation() + 1))
+        os.replace(temp_path, generation_path)
+
+        with _db_cache_lock:
+            _db_cache.pop(self.db_path, None)
+
+    def delete_files(self, file_names: list, embeddings) -> int:
+        """ A method to delete the chunks of transcripts from the vector database without embedding anything again.
+            The chunks are removed from the chunk store and their vector ids are left as tombstones, which searches exclude
+            until the index is compacted in the background once they exceed compaction_tombstone_ratio of the index.
+            Chunks which a remaining transcript shares are kept. Returns the number of deleted chunks.
+        """
+        self._migrate_legacy_db(embeddings)
+        with db_write_lock(self.db_path):
+            segments = read_segments(self.db_path)
+            if segments is None:
+                return 0
+
+            manifest = INGEST_MANIFEST(self.db_path)
+            chunk_digests = manifest.remove_files(file_names)
+            chunk_store = CHUNK_STORE(os.path.join(self.db_path, CHUNK_STORE_FILE_NAME))
+            vector_ids = chunk_store.delete_chunks(
+                doc_ids=list(chunk_digests),
+                sources=[os.path.join(self.knowledge_base_path, file_name) for file_name in file_names],
+                keep_doc_ids=manifest.chunks,
+            )
+            manifest.save()
+            if vector_ids:
+                # Publishing the unchanged segments increases the generation, so sessions reload with the new tombstones
+                self._publish_segments(segments)
+            print(f"Deleted {len(vector_ids)} chunks of {len(file_names)} transcripts from the database.")
+
+            tombstone_count = len(chunk_store.tombstones())
+            tombstone_ratio = tombstone_count / max(1, tombstone_count + chunk_store.count())
+
+        if tombstone_ratio > self.index_config["compaction_tombstone_ratio"]:
+            threading.Thread(target=self.compact_db, name="faiss-compaction", daemon=True).start()
+        return len(vector_ids)
+
+    def compact_db(self):
+        """ A method to rebuild the index segments without the vectors of deleted chunks, from the embeddings in the chunk store.
+            The trained template index is reused, so nothing is embedded or trained again.
+        """
+        try:
+            with db_write_lock(self.db_path):
+                segments = read_segments(self.db_path)
+                chunk_store = CHUNK_STORE(os.path.join(self.db_path, CHUNK_STORE_FILE_NAME))
+                tombstones = chunk_store.tombstones()
+                if segments is None or not len(tombstones):
+                    return
+
+                print(f"Compacting the vector database without {len(tombstones)} deleted chunks. . .")
+                template = read_index(os.path.join(self.db_path, TEMPLATE_FILE_NAME), mmap=False)
+                if template_outdated(template, self.index_config, chunk_store.count()):
+                    compacted_segments = self._rebuild_segments(segments, chunk_store)
+                else:
+                    batches = list(chunk_store.iter_embeddings())
+                    compacted_segments = dict(segments, segments=[])
+                    if batches:
+                        compacted_segments = write_segment(self.db_path, compacted_segments, template,
+                                                           np.concatenate([batch_ids for batch_ids, _ in batches]),
+                                                           np.vstack([batch_vectors for _, batch_vectors in batches]))
+
+                self._publish_segments(compacted_segments, obsolete_segments=segments["segments"])
+                chunk_store.clear_tombstones(tombstones)
+
+        except Exception as e:
+            print(f"An error occurred while compacting the database: {e}")
+
+    def _migrate_legacy_db(self, embeddings):
+        """ A method to convert a database saved as a single index.faiss with a pickled or SQLite docstore to a chunk store
+            and an index segment. Vectors are reconstructed from the index, or embedded again if the index can not do it.
+        """
+        legacy_index_path = os.path.join(self.db_path, LEGACY_INDEX_FILE_NAME)
+        if read_segments(self.db_path) is not None or not os.path.isfile(legacy_index_path):
+            return
+
+        with db_write_lock(self.db_path):
+            # Another writer may have migrated the database while this one waited for the lock
+            if read_segments(self.db_path) is None and os.path.isfile(legacy_index_path):
+                self._migrate_legacy_files(embeddings, legacy_index_path)
+
+    def _migrate_legacy_files(self, embeddings, legacy_index_path: str):
+        """ A method to convert the legacy files of the database while holding its writer lock.
+        """
+        pickle_docstore_path = os.path.join(self.db_path, LEGACY_PICKLE_DOCSTORE_FILE_NAME)
+        sqlite_docstore_path = os.path.join(self.db_path, LEGACY_SQLITE_DOCSTORE_FILE_NAME)
+        if os.path.isfile(sqlite_docstore_path):
+            with sqlite3.connect(sqlite_docstore_path) as connection:
+                rows = connection.execute("SELECT doc_id, page_content, metadata FROM documents ORDER BY vector_index").fetchall()
+            doc_ids = [row[0] for row in rows]
+            documents = [Document(page_content=row[1], metadata=json.loads(row[2])) for row in rows]
+            index = faiss.read_index(legacy_index_path)
+        elif os.path.isfile(pickle_docstore_path):
+            legacy_db = FAISS.load_local(self.db_path, embeddings)
+            doc_ids = [legacy_db.index_to_docstore_id[vector_index] for vector_index in range(legacy_db.index.ntotal)]
+            documents = [legacy_db.docstore.search(doc_id) for doc_id in doc_ids]
+            index = legacy_db.index
         else:
+            return
+
+        print(f"Migrating the vector database of {len(documents)} chunks to the chunk store. . .")
+        try:
+            vectors = index.reconstruct_n(0, index.ntotal)
+        except RuntimeError:
+            vectors = np.array(embeddings.embed_documents([document.page_content for document in documents]), dtype=np.float32)
+        template = faiss.clone_index(index)
+        template.reset()
+
+        self._create_store(documents, doc_ids, vectors, template)
+        for legacy_path in (legacy_index_path, pickle_docstore_path, sqlite_docstore_path):
+            if os.path.exists(legacy_path):
+                os.remove(legacy_path)
+
+    def tune_search(self, db, nprobe: int=None, ef_search: int=None):
+        """ A method to change the query time recall and latency trade off of an approximate index.
+            nprobe is the number of inverted lists visited by IVF indexes and ef_search the candidate list size of HNSW indexes.
+        """
+        set_search_parameters(db.index, self.index_config, nprobe=nprobe, ef_search=ef_search)
+
+    def get_generation(self) -> int:
+        """ A method to return the generation of the saved vector database, which is increased on every save.
+        """
+        generation_path = os.path.join(self.db_path, GENERATION_FILE_NAME)
+        try:
+            with open(generation_path, "r") as generation_file:
+                return int(generation_file.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _db_signature(self):
+        """ A method to return the generation and modification time of the saved segment list, or None if no index exists.
+        """
+        for file_name in (SEGMENTS_FILE_NAME, LEGACY_INDEX_FILE_NAME):
+            try:
+                return self.get_generation(), os.stat(os.path.join(self.db_path, file_name)).st_mtime_ns
+            except FileNotFoundError:
+                continue
+        return None
+
+    def get_cached_db(self, embeddings):
+        """ A method to return the vector database loaded once per process, reloading it only after the saved index changes.
+            Every session uses the same embedding model, so the store is shared regardless of the embeddings object passed.
+        """
+        # A legacy database is migrated before the cache lock is taken, since writers take the cache lock last
+        self._migrate_legacy_db(embeddings)
+        signature = self._db_signature()
+        if signature is None:
             return None
+
+        with _db_cache_lock:
+            cached = _db_cache.get(self.db_path)
+            if cached is not None and cached[0] == signature:
+                return cached[1]
+
+            db = self.load_local_db(embeddings)
+            if db is not None:
+                _db_cache[self.db_path] = (signature, db)
+            return db
@@ -0,0 +1,35 @@
+""" A python file to write meeting minutes as DOCX documents, shared by the Streamlit app and the batch command line.
+"""
+
+import io
+import os
+from docx import Document
+
+def minutes_heading(section: str) -> str:
+    """ A function to return the heading of a minutes section, e.g. Abstract Summary for abstract_summary.
+    """
+    return ' '.join(word.capitalize() for word in section.split('_'))
+
+def minutes_to_docx(minutes: dict) -> io.BytesIO:
+    """ A function to return a DOCX document with a heading and a paragraph for every section of the minutes, as a stream.
+    """
+    doc = Document()
+    file_stream = io.BytesIO()
+
+    for key, value in minutes.items():
+        doc.add_heading(minutes_heading(key), level=1)
+        doc.add_paragraph(value)
+        # Add a line break between sections
+        doc.add_paragraph()
+
+    doc.save(file_stream)
+    file_stream.seek(0)
+    return file_stream
+
+def write_minutes_docx(minutes: dict, file_path: str):
+    """ A function to write the DOCX document of the minutes next to its path and move it in place.
+    """
+    temp_path = f"{file_path}.tmp"
+    with open(temp_path, "wb") as file:
+        file.write(minutes_to_docx(minutes).getvalue())
+    os.replace(temp_path, file_path)
@@ -0,0 +1,208 @@
+""" A python file to cache text embeddings on disk so that rebuilding the vector database does not embed the same chunks again.
+    Embeddings are stored in SQLite as float32 blobs keyed by the embedding model and the hash of the text.
+    Embeddings of an API base other than OpenAI's, such as the local mock server, are stored under their own model key.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+from langchain.embeddings.base import Embeddings
+from ingest_manifest import content_hash
+
+# Get the absolute path to the project root directory
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Load the config.json file
+with open(f"{project_root}/config/config.json", "r") as config_file:
+    config = json.load(config_file)
+
+CACHE_DIR = os.environ.get("CACHE_DIR", config["CACHE_DIR"])  # Load cache directory name, relative to the project root or absolute
+EMBEDDING_CACHE_MAX_MB = config["EMBEDDING_CACHE_MAX_MB"]  # Load maximum size of the embedding cache in megabytes
+
+embedding_cache_path = os.path.join(project_root, CACHE_DIR, "embeddings.sqlite")
+
+OPENAI_API_BASE = "https://api.openai.com/v1"
+
+def embedding_cache_model(model: str, api_base: str) -> str:
+    """ A function to return the model key of cached embeddings, which names the API base unless it is OpenAI's.
+        Embeddings cached before the API base was part of the key were all made by OpenAI and keep their key.
+    """
+    api_base = api_base.rstrip("/")
+    return model if api_base == OPENAI_API_BASE else f"{model}@{api_base}"
+
+# SQLite limits the number of variables in a single statement
+SQLITE_BATCH_SIZE = 500
+
+# Query embeddings are only kept in memory, they are unlikely to repeat across restarts
+QUERY_CACHE_MAX_ENTRIES = 1024
+
+class EMBEDDING_CACHE:
+    """ A class to store and look up embeddings by (model, text hash) with size based LRU eviction.
+    """
+
+    def __init__(self, cache_path: str=embedding_cache_path, max_size_mb: int=EMBEDDING_CACHE_MAX_MB) -> None:
+        self.cache_path = cache_path
+        self.max_size_bytes = max_size_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                """CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL,
+                    PRIMARY KEY (model, text_hash)
+                )"""
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings (last_access)")
+
+    def _connect(self):
+        return sqlite3.connect(self.cache_path, timeout=30)
+
+    def get_many(self, model: str, text_hashes: list) -> dict:
+        """ A method to return the cached vectors of the given text hashes as a dictionary, missing hashes are left out.
+        """
+        vectors = {}
+        unique_hashes = list(dict.fromkeys(text_hashes))
+        with self._connect() as connection:
+            for start in range(0, len(unique_hashes), SQLITE_BATCH_SIZE):
+                batch = unique_hashes[start:start + SQLITE_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = connection.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch],
+                )
+                for text_hash, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    vectors[text_hash] = vector.tolist()
+
+            if vectors:
+                now = time.time()
+                connection.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE model = ? AND text_hash = ?",
+                    [(now, model, text_hash) for text_hash in vectors],
+                )
+
+        with self._lock:
+            self.hits += len(vectors)
+            self.misses += len(unique_hashes) - len(vectors)
+
+        return vectors
+
+    def put_many(self, model: str, items: dict):
+        """ A method to insert vectors keyed by text hash and evict the least recently used entries above the size limit.
+        """
+        if not items:
+            return
+        now = time.time()
+        rows = []
+        for text_hash, vector in items.items():
+            blob = array("f", vector).tobytes()
+            rows.append((model, text_hash, blob, len(blob), now))
+
+        with self._connect() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._evict(connection)
+
+    def _evict(self, connection):
+        """ A method to delete the least recently used entries until the cache fits into its size limit.
+        """
+        total_size = connection.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+        if total_size <= self.max_size_bytes:
+            return
+        # Evict down to 90% of the limit so that eviction does not run on every insert
+        excess = total_size - int(self.max_size_bytes * 0.9)
+        evicted_rows = []
+        for model, text_hash, size in connection.execute("SELECT model, text_hash, size FROM embeddings ORDER BY last_access"):
+            evicted_rows.append((model, text_hash))
+            excess -= size
+            if excess <= 0:
+                break
+        connection.executemany("DELETE FROM embeddings WHERE model = ? AND text_hash = ?", evicted_rows)
+        print(f"Evicted {len(evicted_rows)} embeddings from the cache.")
+
+    def stats(self) -> dict:
+        """ A method to return the hit and miss counters along with the current size of the cache.
+        """
+        with self._connect() as connection:
+            entries, total_size = connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM embeddings").fetchone()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": entries,
+                "size_mb": total_size / (1024 * 1024),
+            }
+
+class CACHED_EMBEDDINGS(Embeddings):
+    """ A class to wrap a langchain embeddings object and only send the texts which are not cached yet.
+        Documents are cached on disk, while queries are kept in a small in memory LRU so that they do not grow the disk cache.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: EMBEDDING_CACHE, model: str,
+                 query_cache_max_entries: int=QUERY_CACHE_MAX_ENTRIES) -> None:
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model = model
+        self.query_cache_max_entries = query_cache_max_entries
+        self._query_cache = OrderedDict()
+        self._query_cache_lock = threading.Lock()
+
+    def embed_documents(self, texts: list) -> list:
+        text_hashes = [content_hash(text) for text in texts]
+        vectors = self.cache.get_many(self.model, text_hashes)
+
+        # Embed every missing text only once even if it repeats in the batch
+        missing = {}
+        for text_hash, text in zip(text_hashes, texts):
+            if text_hash not in vectors and text_hash not in missing:
+                missing[text_hash] = text
+
+        if missing:
+            new_vectors = self.embeddings.embed_documents(list(missing.values()))
+            new_items = dict(zip(missing.keys(), new_vectors))
+            self.cache.put_many(self.model, new_items)
+            vectors.update(new_items)
+
+        return [vectors[text_hash] for text_hash in text_hashes]
+
+    def embed_query(self, text: str) -> list:
+        with self._query_cache_lock:
+            vector = self._query_cache.get(text)
+            if vector is not None:
+                self._query_cache.move_to_end(text)
+                return vector
+
+        vector = self.embeddings.embed_query(text)
+        with self._query_cache_lock:
+            self._query_cache[text] = vector
+            if len(self._query_cache) > self.query_cache_max_entries:
+                self._query_cache.popitem(last=False)
+        return vector
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+def shared_embedding_cache() -> EMBEDDING_CACHE:
+    """ A function to return the process wide embedding cache so that counters are shared by every client.
+    """
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = EMBEDDING_CACHE()
+        return _shared_cache
@@ -0,0 +1,168 @@
+""" A python file to embed large numbers of chunks with batched and concurrent requests to the OpenAI embeddings API.
+    Chunks are packed into batches by a token budget, sent concurrently under the rate limiter of the API key,
+    and the batch size is halved when the API answers 413 or 429 and grown again while requests succeed.
+"""
+
+import os
+import json
+import time
+import asyncio
+import threading
+from collections import deque
+import aiohttp
+from langchain.embeddings.base import Embeddings
+from async_gpt_utils import OPENAI_API_ERROR, RETRY_STATUS_CODES
+from rate_limiter import backoff_delay
+
+# Get the absolute path to the project root directory
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Load the config.json file
+with open(f"{project_root}/config/config.json", "r") as config_file:
+    config = json.load(config_file)
+
+EMBEDDING_MODEL = config["EMBEDDING_MODEL"]  # Load embedding model name
+EMBEDDING_BATCH_TOKENS = config["EMBEDDING_BATCH_TOKENS"]  # Load maximum number of tokens of a single embeddings request
+EMBEDDING_MAX_BATCH_SIZE = config["EMBEDDING_MAX_BATCH_SIZE"]  # Load maximum number of texts of a single embeddings request
+EMBEDDING_CONCURRENCY = config["EMBEDDING_CONCURRENCY"]  # Load maximum number of concurrent embeddings requests
+OPENAI_MAX_RETRIES = config["OPENAI_MAX_RETRIES"]  # Load maximum number of retries of a failed request
+
+# Status codes answered to batches which are too large for the request size or the rate limit
+SHRINK_STATUS_CODES = {413, 429}
+
+# Number of consecutive successful batches after which the batch size grows again
+REGROW_AFTER_BATCHES = 4
+
+# Characters per token used when no token counter is given, low so that batches rather stay below the budget
+CHARS_PER_TOKEN_ESTIMATE = 3
+
+class EMBEDDING_PIPELINE(Embeddings):
+    """ A class to embed documents with token budgeted batches sent concurrently through an ASYNC_GPT_UTILS client.
+    """
+
+    def __init__(self, client, model: str=EMBEDDING_MODEL, batch_tokens: int=EMBEDDING_BATCH_TOKENS,
+                 max_batch_size: int=EMBEDDING_MAX_BATCH_SIZE, concurrency: int=EMBEDDING_CONCURRENCY,
+                 max_retries: int=OPENAI_MAX_RETRIES, count_tokens=None) -> None:
+        self.client = client
+        self.model = model
+        self.batch_tokens = batch_tokens
+        self.max_batch_size = max_batch_size
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.count_tokens = count_tokens or (lambda text: len(text) // CHARS_PER_TOKEN_ESTIMATE + 1)
+        self.batch_size = max_batch_size
+        self.last_stats = {}
+        self._successes = 0
+        self._lock = threading.Lock()
+
+    def _next_batch(self, pending: deque, text_tokens: list) -> list:
+        """ A method to take the indexes of the next batch from the pending queue within the batch size and token budget.
+            A text above the budget is sent alone, the API rejects it only if it exceeds the input limit of the model.
+        """
+        batch, batch_tokens = [], 0
+        while pending and len(batch) < self.batch_size:
+            index = pending[0]
+            if batch and batch_tokens + text_tokens[index] > self.batch_tokens:
+                break
+            batch.append(pending.popleft())
+            batch_tokens += text_tokens[index]
+        return batch
+
+    def _shrink(self, failed_batch_size: int):
+        """ A method to halve the batch size below the size of a batch which was rejected.
+        """
+        with self._lock:
+            self.batch_size = max(1, min(self.batch_size, failed_batch_size // 2))
+            self._successes = 0
+
+    def _regrow(self):
+        """ A method to grow the batch size again after a number of consecutive successful batches.
+        """
+        with self._lock:
+            self._successes += 1
+            if self._successes >= REGROW_AFTER_BATCHES and self.batch_size < self.max_batch_size:
+                self.batch_size = min(self.max_batch_size, self.batch_size + max(1, self.batch_size // 4))
+                self._successes = 0
+
+    async def _embed_worker(self, texts: list, text_tokens: list, pending: deque, vectors: list, stats: dict):
+        """ A coroutine to embed batches from the pending queue until it is empty.
+            A rejected batch is split, its second half goes back to the front of the queue and the first half is retried.
+        """
+        while pending:
+            batch = self._next_batch(pending, text_tokens)
+            attempt = 0
+            while batch:
+                try:
+                    batch_vectors = await self.client.embeddings(
+                        self.model,
+                        [texts[index] for index in batch],
+                        estimated_tokens=sum(text_tokens[index] for index in batch),
+                        retry=False,
+                    )
+                except OPENAI_API_ERROR as error:
+                    if error.status in SHRINK_STATUS_CODES and (len(batch) > 1 or error.status == 429) and attempt < self.max_retries:
+                        self._shrink(len(batch))
+                        stats["throttled"] += 1
+                        if len(batch) > 1:
+                            pending.extendleft(reversed(batch[len(batch) // 2:]))
+                            batch = batch[:len(batch) // 2]
+                        if error.status == 429:
+                            attempt += 1
+                            await asyncio.sleep(backoff_delay(attempt))
+                        continue
+                    if error.status not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+                        raise
+                    attempt += 1
+                    await asyncio.sleep(backoff_delay(attempt))
+                    continue
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    if attempt >= self.max_retries:
+                        raise
+                    attempt += 1
+                    await asyncio.sleep(backoff_delay(attempt))
+                    continue
+
+                for index, vector in zip(batch, batch_vectors):
+                    vectors[index] = vector
+                stats["batches"] += 1
+                self._regrow()
+                batch = None
+
+    async def aembed_documents(self, texts: list) -> list:
+        """ A method to embed texts with concurrent batched requests and return the embeddings in the order of the texts.
+        """
+        if not texts:
+            return []
+
+        start_time = time.perf_counter()
+        text_tokens = [self.count_tokens(text) for text in texts]
+        pending = deque(range(len(texts)))
+        vectors = [None] * len(texts)
+        stats = {"batches": 0, "throttled": 0}
+
+        workers = [self._embed_worker(texts, text_tokens, pending, vectors, stats) for _ in range(self.concurrency)]
+        await asyncio.gather(*workers)
+
+        elapsed = time.perf_counter() - start_time
+        self.last_stats = {
+            "chunks": len(texts),
+            "tokens": sum(text_tokens),
+            "batches": stats["batches"],
+            "throttled": stats["throttled"],
+            "batch_size": self.batch_size,
+            "seconds": elapsed,
+            "chunks_per_second": len(texts) / elapsed if elapsed else 0.0,
+        }
+        print(f"Embedded {len(texts)} chunks in {stats['batches']} batches in {elapsed:.2f} seconds "
+              f"({self.last_stats['chunks_per_second']:.1f} chunks/sec, {stats['throttled']} throttled).")
+
+        return vectors
+
+    async def aembed_query(self, text: str) -> list:
+        return (await self.client.embeddings(self.model, [text], estimated_tokens=self.count_tokens(text)))[0]
+
+    def embed_documents(self, texts: list) -> list:
+        return self.client.run(self.aembed_documents(texts))
+
+    def embed_query(self, text: str) -> list:
+        return self.client.run(self.aembed_query(text))
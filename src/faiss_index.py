@@ -0,0 +1,189 @@
+""" A python file to build FAISS indexes of the type configured in config.json and to tune their search parameters.
+    Besides the exact flat index it supports the approximate IVF-Flat, IVF-PQ and HNSW indexes for large corpora.
+    The index of a vector database is saved as a list of segments, so that a merge only writes the segment of its new
+    vectors, and the segments are memory mapped and searched together when the database is loaded.
+"""
+
+import os
+import json
+import faiss
+import numpy as np
+
+# Get the absolute path to the project root directory
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Load the config.json file
+with open(f"{project_root}/config/config.json", "r") as config_file:
+    config = json.load(config_file)
+
+FAISS_INDEX = config["FAISS_INDEX"]  # Load type, build and search parameters of the FAISS index
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+# k-means in FAISS warns below 39 training points per centroid, so the number of lists is capped accordingly
+MIN_POINTS_PER_CENTROID = 39
+
+SEGMENTS_FILE_NAME = "segments.json"
+TEMPLATE_FILE_NAME = "template.faiss"
+
+# Memory map the index read only, so that every worker process shares its pages through the page cache.
+# Flat and HNSW storage is mapped with IO_FLAG_MMAP_IFC, which IVF indexes reject, and IVF lists with IO_FLAG_MMAP alone.
+MMAP_IO_FLAGS = (
+    faiss.IO_FLAG_MMAP | getattr(faiss, "IO_FLAG_MMAP_IFC", 0) | faiss.IO_FLAG_READ_ONLY,
+    faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY,
+)
+
+def index_factory_string(index_config: dict, num_vectors: int) -> str:
+    """ A function to return the FAISS index factory string of an index configuration for a number of vectors.
+        Corpora smaller than min_vectors use the flat index, which is exact and fast enough at that size.
+    """
+    index_type = index_config.get("type", "flat")
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown FAISS index type '{index_type}', expected one of {', '.join(INDEX_TYPES)}")
+
+    if index_type == "flat" or num_vectors < index_config.get("min_vectors", 0):
+        return "Flat"
+    if index_type == "hnsw":
+        return f"HNSW{index_config['hnsw_m']},Flat"
+
+    nlist = max(1, min(index_config["nlist"], num_vectors // MIN_POINTS_PER_CENTROID))
+    if index_type == "ivf_flat":
+        return f"IVF{nlist},Flat"
+    return f"IVF{nlist},PQ{index_config['pq_m']}x{index_config['pq_bits']}"
+
+def template_outdated(template, index_config: dict, num_vectors: int) -> bool:
+    """ A function to tell whether a template index trained for a smaller corpus should be trained again for num_vectors
+        vectors: a flat index once the corpus reaches min_vectors, or an IVF index with half the lists the corpus supports.
+    """
+    factory_string = index_factory_string(index_config, num_vectors)
+    template = faiss.downcast_index(template)
+    if isinstance(template, faiss.IndexFlat):
+        return factory_string != "Flat"
+    index_ivf = faiss.try_extract_index_ivf(template)
+    if index_ivf is not None and factory_string.startswith("IVF"):
+        nlist = int(factory_string[len("IVF"):].split(",")[0])
+        return index_ivf.nlist * 2 <= nlist
+    return False
+
+def _base_indexes(index) -> list:
+    """ A function to return the indexes searched by an index, looking through segment shards and id maps.
+    """
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexShards):
+        return [base for shard_num in range(index.count()) for base in _base_indexes(index.at(shard_num))]
+    if isinstance(index, faiss.IndexIDMap):
+        return _base_indexes(index.index)
+    return [index]
+
+def set_search_parameters(index, index_config: dict=FAISS_INDEX, nprobe: int=None, ef_search: int=None):
+    """ A function to set the query time parameters of an index, nprobe for IVF and efSearch for HNSW indexes.
+        The values default to the configured ones and are ignored by index types which do not have them.
+    """
+    parameter_space = faiss.ParameterSpace()
+    for base_index in _base_indexes(index):
+        if faiss.try_extract_index_ivf(base_index) is not None:
+            parameter_space.set_index_parameter(base_index, "nprobe", nprobe or index_config["nprobe"])
+        elif isinstance(base_index, faiss.IndexHNSW):
+            parameter_space.set_index_parameter(base_index, "efSearch", ef_search or index_config["ef_search"])
+
+def search_parameters(index, selector):
+    """ A function to return the search parameters which restrict a search to the ids accepted by the selector.
+        They carry the current nprobe or efSearch of the index, since parameters passed to a search replace those of the index.
+    """
+    base_index = _base_indexes(index)[0]
+    index_ivf = faiss.try_extract_index_ivf(base_index)
+    if index_ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=index_ivf.nprobe)
+    if isinstance(base_index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=base_index.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+def build_index(vectors: np.ndarray, index_config: dict=FAISS_INDEX):
+    """ A function to create an index of the configured type for the given vectors, trained on a sample of them when needed.
+        The vectors are not added, so that the caller can add them along with their documents.
+    """
+    num_vectors, dimension = vectors.shape
+    factory_string = index_factory_string(index_config, num_vectors)
+    index = faiss.index_factory(dimension, factory_string, faiss.METRIC_L2)
+
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efConstruction = index_config["ef_construction"]
+
+    if not index.is_trained:
+        sample_size = min(num_vectors, index_config["train_sample"])
+        sample = vectors
+        if sample_size < num_vectors:
+            sample = vectors[np.random.default_rng(0).choice(num_vectors, sample_size, replace=False)]
+        print(f"Training {factory_string} index on {sample_size} of {num_vectors} vectors. . .")
+        index.train(sample)
+
+    set_search_parameters(index, index_config)
+    return index
+
+def read_segments(db_path: str):
+    """ A function to return the segment list of a saved database, or None if it has none.
+    """
+    segments_path = os.path.join(db_path, SEGMENTS_FILE_NAME)
+    if os.path.isfile(segments_path):
+        with open(segments_path, "r") as segments_file:
+            return json.load(segments_file)
+    return None
+
+def write_segments(db_path: str, segments: dict):
+    """ A function to replace the segment list at once, which publishes the segments it refers to.
+    """
+    segments_path = os.path.join(db_path, SEGMENTS_FILE_NAME)
+    with open(f"{segments_path}.tmp", "w") as segments_file:
+        json.dump(segments, segments_file, indent=2)
+    os.replace(f"{segments_path}.tmp", segments_path)
+
+def read_index(index_path: str, mmap: bool=True):
+    """ A function to read an index, memory mapped read only if possible. A mapped index must never be added to.
+    """
+    if mmap:
+        for io_flags in MMAP_IO_FLAGS:
+            try:
+                return faiss.read_index(index_path, io_flags)
+            except RuntimeError as error:
+                mmap_error = error
+        print(f"Could not memory map the index, reading it into memory instead: {mmap_error}")
+    return faiss.read_index(index_path)
+
+def write_index(index, index_path: str):
+    """ A function to write an index next to its path and move it in place, since mapped readers keep the old file open.
+    """
+    faiss.write_index(index, f"{index_path}.tmp")
+    os.replace(f"{index_path}.tmp", index_path)
+
+def load_index(db_path: str, segments: dict, mmap: bool=True):
+    """ A function to load the segments of a database as one index, searching every segment for their vector ids.
+    """
+    segment_indexes = [read_index(os.path.join(db_path, segment["file"]), mmap=mmap) for segment in segments["segments"]]
+    if len(segment_indexes) == 1:
+        return segment_indexes[0]
+
+    index = faiss.IndexShards(segment_indexes[0].d, False, False)
+    for segment_index in segment_indexes:
+        # The python wrapper of add_shard keeps a reference to the shard, so it lives as long as the index
+        index.add_shard(segment_index)
+    return index
+
+def write_segment(db_path: str, segments: dict, template, vector_ids: np.ndarray, vectors: np.ndarray) -> dict:
+    """ A function to write the vectors as a new segment built from the trained empty template index.
+        Returns the segment list including the new segment, which the caller publishes with write_segments.
+    """
+    index = faiss.IndexIDMap2(faiss.clone_index(template))
+    index.add_with_ids(vectors, vector_ids.astype(np.int64))
+
+    segment_file = f"segment-{segments['next_segment']:06d}.faiss"
+    write_index(index, os.path.join(db_path, segment_file))
+    return {
+        "segments": segments["segments"] + [{
+            "file": segment_file,
+            "ntotal": int(index.ntotal),
+            "first_vector_id": int(vector_ids.min()),
+            "end_vector_id": int(vector_ids.max()) + 1,
+        }],
+        "next_segment": segments["next_segment"] + 1,
+        "next_vector_id": max(segments["next_vector_id"], int(vector_ids.max()) + 1),
+    }
@@ -0,0 +1,107 @@
+""" A python file to define the langchain FAISS vector store used for searches over the segmented index and chunk store.
+    Only the chunks of the returned hits are read from the chunk store, and max marginal relevance search reads the
+    embeddings of its candidates from the chunk store instead of reconstructing them from the index.
+    The vector ids of deleted chunks are excluded inside the FAISS search, so that they do not take the place of live hits.
+    The chunk store also answers BM25 searches over the words of the chunks, which hybrid_retriever fuses with vector hits.
+"""
+
+import operator
+import faiss
+import numpy as np
+from langchain.vectorstores import FAISS
+from langchain.vectorstores.utils import DistanceStrategy, maximal_marginal_relevance
+from langchain.docstore.document import Document
+from faiss_index import search_parameters
+from ingest_manifest import content_hash
+
+def _matches(document, filter: dict) -> bool:
+    return all(
+        document.metadata.get(key) in value if isinstance(value, list) else document.metadata.get(key) == value
+        for key, value in filter.items()
+    )
+
+class FAISS_STORE(FAISS):
+    """ A class to search a FAISS index whose vector ids are the vector ids of a CHUNK_STORE.
+        The mapped index is never modified, added texts are appended by the VECTOR_DB_UTILS of the saved database as a new
+        index segment, which the store returned by VECTOR_DB_UTILS.get_cached_db searches once it has reloaded.
+    """
+
+    def __init__(self, embeddings, index, chunk_store, db_utils, tombstones=()) -> None:
+        super().__init__(embeddings, index, chunk_store, chunk_store.index_to_docstore_id)
+        self.chunk_store = chunk_store
+        self.db_utils = db_utils
+        self.tombstones = np.asarray(tombstones, dtype=np.int64)
+        self.selector = None
+        if len(self.tombstones):
+            # The negated selector only points to the batch selector, so both are kept as long as the store
+            self.tombstone_selector = faiss.IDSelectorBatch(self.tombstones)
+            self.selector = faiss.IDSelectorNot(self.tombstone_selector)
+
+    def _search_ids(self, embedding, k: int):
+        """ A method to return the scores and vector ids of the nearest neighbours, without the missing results.
+        """
+        params = search_parameters(self.index, self.selector) if self.selector is not None else None
+        scores, vector_ids = self.index.search(np.array([embedding], dtype=np.float32), k, params=params)
+        hits = [(score, vector_id) for score, vector_id in zip(scores[0], vector_ids[0]) if vector_id != -1]
+        return [score for score, _ in hits], [int(vector_id) for _, vector_id in hits]
+
+    def similarity_search_with_score_by_vector(self, embedding, k: int=4, filter: dict=None, fetch_k: int=20, **kwargs):
+        scores, vector_ids = self._search_ids(embedding, k if filter is None else fetch_k)
+        documents = self.chunk_store.get_documents(vector_ids)
+
+        docs_and_scores = [
+            (documents[vector_id], score) for score, vector_id in zip(scores, vector_ids)
+            if vector_id in documents and (filter is None or _matches(documents[vector_id], filter))
+        ]
+
+        score_threshold = kwargs.get("score_threshold")
+        if score_threshold is not None:
+            compare = operator.ge if self.distance_strategy == DistanceStrategy.MAX_INNER_PRODUCT else operator.le
+            docs_and_scores = [(document, score) for document, score in docs_and_scores if compare(score, score_threshold)]
+        return docs_and_scores[:k]
+
+    def max_marginal_relevance_search_with_score_by_vector(self, embedding, *, k: int=4, fetch_k: int=20,
+                                                           lambda_mult: float=0.5, filter: dict=None):
+        scores, vector_ids = self._search_ids(embedding, fetch_k if filter is None else fetch_k * 2)
+        documents = self.chunk_store.get_documents(vector_ids)
+        embeddings = self.chunk_store.get_embeddings(vector_ids)
+
+        candidates = [
+            (score, vector_id) for score, vector_id in zip(scores, vector_ids)
+            if vector_id in documents and vector_id in embeddings and (filter is None or _matches(documents[vector_id], filter))
+        ]
+        if not candidates:
+            return []
+
+        mmr_selected = maximal_marginal_relevance(
+            np.array([embedding], dtype=np.float32),
+            [embeddings[vector_id] for _, vector_id in candidates],
+            k=k,
+            lambda_mult=lambda_mult,
+        )
+        return [(documents[candidates[i][1]], candidates[i][0]) for i in mmr_selected]
+
+    def lexical_search(self, query: str, k: int=4, max_term_ratio: float=1.0) -> list:
+        """ A method to return the documents of the k chunks which best match the words of the query in the lexical index.
+        """
+        vector_ids = self.chunk_store.lexical_search(query, k, max_term_ratio=max_term_ratio)
+        documents = self.chunk_store.get_documents(vector_ids)
+        return [documents[vector_id] for vector_id in vector_ids if vector_id in documents]
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        return self.add_embeddings(zip(texts, self.embeddings.embed_documents(texts)), metadatas=metadatas, ids=ids)
+
+    def add_embeddings(self, text_embeddings, metadatas=None, ids=None, **kwargs):
+        """ A method to append embedded texts to the saved database under its write lock and return their chunk ids,
+            which are the content hashes of the texts unless ids are given.
+        """
+        text_embeddings = list(text_embeddings)
+        if not text_embeddings:
+            return []
+        texts = [text for text, _ in text_embeddings]
+        metadatas = metadatas or [{} for _ in texts]
+        ids = list(ids) if ids else [content_hash(text) for text in texts]
+        documents = [Document(page_content=text, metadata=metadata) for text, metadata in zip(texts, metadatas)]
+        self.db_utils.append_vectors(documents, ids, [vector for _, vector in text_embeddings])
+        return ids
@@ -2,11 +2,24 @@
 
 import os
 import json
+import time
+import logging
+import hashlib
+import queue
+import functools
+import threading
+import concurrent.futures
 import openai  # Importing Open AI library
 import tiktoken  # Importing tiktoken library to calculate the number of tokens
-from langchain.embeddings import OpenAIEmbeddings
 from langchain.chat_models import ChatOpenAI
 from langchain.chains import RetrievalQA
+from embedding_cache import CACHED_EMBEDDINGS, embedding_cache_model, shared_embedding_cache
+from completion_cache import completion_cache_key, shared_completion_cache
+from prompts import (MINUTES_SECTION_PROMPTS, MINUTES_FUNCTION, minutes_section_prompt, minutes_reduce_prompt,
+                     combined_minutes_prompt, combined_minutes_reduce_prompt)
+from async_gpt_utils import get_async_gpt_utils
+from embedding_pipeline import EMBEDDING_MODEL, EMBEDDING_PIPELINE
+from hybrid_retriever import HYBRID_RETRIEVER
 
 # Get the absolute path to the project root directory
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
@@ -15,11 +28,188 @@ project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 with open(f"{project_root}/config/config.json", "r") as config_file:
     config = json.load(config_file)
 
+logger = logging.getLogger(__name__)
+
 # openai.api_key = os.environ["OPENAI_API_KEY"]  # Reading Open AI API Key from environment file
 default_model = config["DEFAULT_MODEL"]  # Default gpt model for use - gpt-3.5-turbo
 large_context_model = config[
     "LARGE_CONTEXT_MODEL"
 ]  # Large context gpt model for large amount of tokens - gpt-3.5-turbo-16k
+minutes_chunk_tokens = config["MINUTES_CHUNK_TOKENS"]  # Maximum tokens of a transcript chunk sent in a single minutes request
+minutes_max_workers = config["MINUTES_MAX_WORKERS"]  # Maximum number of concurrent minutes requests
+minutes_max_tokens = config["MINUTES_MAX_TOKENS"]  # Maximum completion tokens of a single minutes request
+minutes_combined_extraction = config["MINUTES_COMBINED_EXTRACTION"]  # Extract every minutes section from a transcript chunk in one request
+qa_temperature = config["QA_TEMPERATURE"]  # Sampling temperature of QA answers, 0 makes them deterministic and cacheable
+model_routing = config["MODEL_ROUTING"]  # Context window, output limit and relative cost and latency of each routable model
+hybrid_search = config["HYBRID_SEARCH"]  # Fuse BM25 lexical hits with vector hits, and the candidates and fusion settings
+
+key_validation_ttl = config["KEY_VALIDATION_TTL"]  # Seconds for which a successful key validation is reused
+token_estimate_threshold_chars = config["TOKEN_ESTIMATE_THRESHOLD_CHARS"]  # Strings longer than this are estimated instead of encoded
+openai_max_retries = config["OPENAI_MAX_RETRIES"]  # Maximum number of retries of a rate limited or failed request
+openai_request_timeout = config["OPENAI_REQUEST_TIMEOUT"]  # Timeout of a single request in seconds
+
+# Sections of the meeting minutes in the order they are presented
+MINUTES_SECTIONS = list(MINUTES_SECTION_PROMPTS)
+
+# Failed validations are retried sooner than successful ones are repeated
+INVALID_KEY_VALIDATION_TTL = 60
+
+# Process wide key validation results and clients, keyed by the hash of the API key
+_key_validations = {}
+_shared_clients = {}
+_shared_lock = threading.Lock()
+
+# Chat format overhead of every message and of the reply priming, see the OpenAI cookbook on counting tokens
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_NAME = 1
+TOKENS_PER_REPLY = 3
+
+# Characters per token used by the fast estimate, lower than the usual ~4 so that the estimate errs on the large side
+CHARS_PER_TOKEN_ESTIMATE = 3
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model: str):
+    """Returns the tiktoken encoding of a model, resolved once per model."""
+
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        print(f"Warning: model {model} not found. Using cl100k_base encoding.")  # Terminal Error message for debugging
+        return tiktoken.get_encoding("cl100k_base")
+
+def num_tokens_from_string(string: str, model: str=default_model, estimate: bool=None) -> int:
+    """Returns the number of tokens in a text string.
+
+    With estimate=None the count is estimated from the length only for strings longer than TOKEN_ESTIMATE_THRESHOLD_CHARS.
+    """
+
+    if estimate is None:
+        estimate = len(string) > token_estimate_threshold_chars
+    if estimate:
+        return -(-len(string) // CHARS_PER_TOKEN_ESTIMATE)
+    return len(get_encoding(model).encode(string, disallowed_special=()))
+
+def num_tokens_from_messages(messages, model: str=default_model, functions=None, estimate: bool=None) -> int:
+    """Returns the number of prompt tokens of chat messages, following the chat format overhead per message."""
+
+    if estimate is None:
+        total_chars = sum(len(str(value)) for message in messages for value in message.values())
+        estimate = total_chars > token_estimate_threshold_chars
+
+    num_tokens = TOKENS_PER_REPLY
+    for message in messages:
+        num_tokens += TOKENS_PER_MESSAGE
+        for key, value in message.items():
+            if value is None:
+                continue
+            if not isinstance(value, str):
+                # Function call arguments of assistant messages
+                value = json.dumps(value)
+            num_tokens += num_tokens_from_string(value, model=model, estimate=estimate)
+            if key == "name":
+                num_tokens += TOKENS_PER_NAME
+
+    if functions:
+        # Function definitions are injected into the system prompt in a format which is not documented, so the json is counted
+        num_tokens += num_tokens_from_string(json.dumps(functions), model=model, estimate=estimate)
+
+    return num_tokens
+
+def stream_in_background(token_stream):
+    """Returns a generator over a token stream which is consumed eagerly in a background thread."""
+
+    tokens = queue.Queue()
+    end_of_stream = object()
+
+    def consume():
+        try:
+            for token in token_stream:
+                tokens.put(token)
+        except Exception as error:
+            tokens.put(error)
+        tokens.put(end_of_stream)
+
+    threading.Thread(target=consume, daemon=True).start()
+
+    def generate():
+        while True:
+            token = tokens.get()
+            if token is end_of_stream:
+                return
+            if isinstance(token, Exception):
+                raise token
+            yield token
+
+    return generate()
+
+def format_action_item(action_item: dict) -> str:
+    """Returns an action item of the combined minutes extraction as a line of text with its owner and due date."""
+
+    details = [
+        f"{label}: {action_item[field].strip()}"
+        for field, label in (("owner", "Owner"), ("due_date", "Due"))
+        if (action_item.get(field) or "").strip()
+    ]
+    return f"- {action_item['task'].strip()}" + (f" ({', '.join(details)})" if details else "")
+
+def parse_minutes_arguments(arguments) -> dict:
+    """Returns the sections of the combined minutes extraction which match MINUTES_FUNCTION, formatted as text.
+
+    A section which is missing or does not match the schema is left out, so that it can be extracted again on its own.
+    """
+
+    try:
+        minutes = json.loads(arguments)
+    except (TypeError, ValueError):
+        return {}
+    if not isinstance(minutes, dict):
+        return {}
+
+    sections = {}
+    abstract_summary = minutes.get("abstract_summary")
+    if isinstance(abstract_summary, str) and abstract_summary.strip():
+        sections["abstract_summary"] = abstract_summary.strip()
+
+    key_points = minutes.get("key_points")
+    if isinstance(key_points, list) and key_points and all(isinstance(point, str) and point.strip() for point in key_points):
+        sections["key_points"] = "\n".join(f"- {point.strip()}" for point in key_points)
+
+    action_items = minutes.get("action_items")
+    if isinstance(action_items, list) and all(
+        isinstance(action_item, dict)
+        and isinstance(action_item.get("task"), str) and action_item["task"].strip()
+        and all(isinstance(action_item.get(field) or "", str) for field in ("owner", "due_date"))
+        for action_item in action_items
+    ):
+        sections["action_items"] = "\n".join(format_action_item(action_item) for action_item in action_items) or "No action items were mentioned."
+
+    return sections
+
+def format_minutes_text(minutes: dict) -> str:
+    """Returns the sections of meeting minutes as a single text, used as the input of a combined reduce request."""
+
+    return "\n\n".join(f"{section.replace('_', ' ').capitalize()}:\n{minutes[section]}" for section in MINUTES_SECTIONS)
+
+def api_key_hash(api_key: str) -> str:
+    """Returns the sha256 hash of an API key so that the key itself is never used as a cache key."""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+def get_gpt_utils(api_key: str):
+    """Returns the GPT_UTILS instance shared by every session of the process that uses the same API key."""
+
+    key_hash = api_key_hash(api_key)
+    with _shared_lock:
+        gpt = _shared_clients.get(key_hash)
+        if gpt is None:
+            gpt = GPT_UTILS(api_key=api_key)
+            _shared_clients[key_hash] = gpt
+        return gpt
+
+def get_shared_gpt_utils(key_hash: str):
+    """Returns the GPT_UTILS instance of the process for the hash of an API key, or None if no session has created it yet."""
+
+    with _shared_lock:
+        return _shared_clients.get(key_hash)
 
 class GPT_UTILS:
     """A class to define various utilities for GPT usage"""
@@ -28,178 +218,527 @@ class GPT_UTILS:
         self.api_key = api_key
         self.default_model = default_model
         self.large_context_model = large_context_model
-        self.embeddings = OpenAIEmbeddings(openai_api_key=self.api_key)
+        self.minutes_chunk_tokens = minutes_chunk_tokens
+        self.minutes_max_workers = minutes_max_workers
+        self.minutes_max_tokens = minutes_max_tokens
+        self.minutes_combined_extraction = minutes_combined_extraction
+        self.model_routing = model_routing
+        embedding_pipeline = EMBEDDING_PIPELINE(client=self.async_client,
+                                                count_tokens=functools.partial(num_tokens_from_string, model=EMBEDDING_MODEL))
+        self.embeddings = CACHED_EMBEDDINGS(embeddings=embedding_pipeline,
+                                            cache=shared_embedding_cache(),
+                                            model=embedding_cache_model(embedding_pipeline.model, self.async_client.api_base))
         self.langchain_llm = ChatOpenAI(openai_api_key=self.api_key,
                                         model=self.default_model,
-                                        temperature=0.5,
-                                        max_tokens=512)
+                                        temperature=qa_temperature,
+                                        max_tokens=512,
+                                        max_retries=openai_max_retries,
+                                        request_timeout=openai_request_timeout)
+        self.completion_cache = shared_completion_cache()
+        self._qa_chains = {}
+        self._qa_chains_lock = threading.Lock()
+
+    def validate_key(self, use_cache: bool=True) -> bool:
+        """A function to validate the Open AI API Key. Results are cached per key hash for KEY_VALIDATION_TTL seconds."""
+
+        key_hash = api_key_hash(self.api_key)
+        if use_cache:
+            with _shared_lock:
+                cached = _key_validations.get(key_hash)
+            if cached is not None and cached[1] > time.time():
+                return cached[0]
+
+        is_valid = self._validate_key()
+        ttl = key_validation_ttl if is_valid else min(key_validation_ttl, INVALID_KEY_VALIDATION_TTL)
+        with _shared_lock:
+            _key_validations[key_hash] = (is_valid, time.time() + ttl)
 
-    def validate_key(self) -> bool:
-        """A function to validate the Open AI API Key"""
+        return is_valid
+
+    def _validate_key(self) -> bool:
+        """A function to validate the Open AI API Key with a test completion"""
 
-        openai.api_key = self.api_key
         try:
-            response = openai.ChatCompletion.create(
+            # The client sends the key per request so that sessions with different keys never race
+            response = self.async_client.run(self.async_client.chat_completion(
                 model=self.default_model,  # loading default gpt model
                 messages=[
                     {"role": "system", "content": "Test Prompt"},
                     {"role": "user", "content": "Hello"},
                 ],  # A Test prompt to check if we can get response from Open AI
+                temperature=1,
                 max_tokens=5,  # Limit maximum output tokens to 5 to control the cost on each page reload
-            )
+            ))
 
-            if response:
-                return True
+            return bool(response)
         except Exception as error:
             print(f"Invalid Key: {error}")  # Terminal Error message for debugging
             return False
 
-    def num_tokens_from_string(self, string: str) -> int:
-        """Returns the number of tokens in a text string."""
+    def num_tokens_from_string(self, string: str, model: str=None, estimate: bool=None) -> int:
+        """Returns the number of tokens in a text string, estimated from its length for very large strings."""
 
-        try:
-            encoding = tiktoken.encoding_for_model(
-                self.default_model
-            )  # Loading the correct encoding for default model
-            num_tokens = len(
-                encoding.encode(string)
-            )  # Calculating the length of the tokens
-            return num_tokens
-        except KeyError:
-            print("Warning: model not found.")  # Terminal Error message for debugging
-            return None
-        
-    def select_model(self, messages, max_tokens):
-        """A function to decide the model choice between regular or large context."""
-        
-        num_tokens = self.num_tokens_from_string(
-            str(messages)
+        return num_tokens_from_string(string, model=model or self.default_model, estimate=estimate)
+
+    def num_tokens_from_messages(self, messages, model: str=None, functions=None, estimate: bool=None) -> int:
+        """Returns the number of prompt tokens of chat messages including the chat format overhead."""
+
+        return num_tokens_from_messages(messages, model=model or self.default_model, functions=functions, estimate=estimate)
+
+    def select_model(self, messages, max_tokens, functions=None):
+        """A function to route the request to the cheapest and fastest model of MODEL_ROUTING that fits it.
+
+        A model fits when the prompt and max_tokens fit into its context window and max_tokens into its output limit.
+        If no model fits, the model with the largest context window is returned.
+        """
+
+        num_tokens = self.num_tokens_from_messages(
+            messages, functions=functions
         )  # Get number of prompt tokens
 
         total_tokens = num_tokens + max_tokens
 
-        if total_tokens is not None and total_tokens < 3750:
-            model = (
-                self.default_model
-            )  # Select default model if prompt tokens are less than 3500
+        fitting_routes = [
+            route for route in self.model_routing
+            if total_tokens <= route["context_window"] and max_tokens <= route["max_output_tokens"]
+        ]
+        if fitting_routes:
+            route = min(fitting_routes, key=lambda route: (route["relative_cost"], route["relative_latency"]))
         else:
-            model = (
-                self.large_context_model
-            )  # Select large context model if prompt tokens are more than 3500
+            route = max(self.model_routing, key=lambda route: route["context_window"])
+
+        return route["model"]
+
+    @property
+    def async_client(self):
+        """The asynchronous client of the API key with its own pooled HTTP session, shared by every session of the process."""
+
+        return get_async_gpt_utils(self.api_key)
+
+    def _estimate_tokens(self, request: dict) -> int:
+        """Returns the prompt tokens of a chat request plus its max_tokens, reserved from the rate limits of the key."""
+
+        estimated_tokens = self.num_tokens_from_messages(request["messages"], model=request["model"], functions=request.get("functions"), estimate=True)
+        return estimated_tokens + (request.get("max_tokens") or 0)
+
+    def _create(self, request: dict):
+        """A function to send a chat completion request over the pooled connections of the key, within the rate limits of the key.
+
+        Rate limited, timed out and failed requests are retried with jittered exponential backoff by the asynchronous client,
+        which charges the tokens the API reports as used to the rate limiter.
+        """
+
+        response = self.async_client.run(self.async_client.chat_completion(estimated_tokens=self._estimate_tokens(request), **request))
+        return openai.util.convert_to_openai_object(response)
+
+    def _stream(self, request: dict):
+        """A generator to yield the deltas of a streamed chat completion request, sent like _create."""
+
+        return self.async_client.iterate(self.async_client.stream_chat_completion(estimated_tokens=self._estimate_tokens(request), **request))
+
+    def create_chat_completion(self, model, messages, temperature, max_tokens=None, functions=None, index_generation=None, function_call=None):
+        """A function to create a chat completion, answering repeated deterministic requests from the completion cache.
+
+        function_call defaults to "auto" when functions are given, or names the function the model has to call.
+        """
 
-        return model
+        cache_key = None
+        if self.completion_cache.is_cacheable(temperature):
+            cache_key = completion_cache_key(model, messages, temperature, max_tokens, functions, index_generation, function_call)
+            cached_response = self.completion_cache.get(cache_key)
+            if cached_response is not None:
+                return openai.util.convert_to_openai_object(cached_response)
+
+        request = {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens,
+                   "functions": functions, "function_call": function_call}
+        response = self._create(request)
+
+        if cache_key is not None:
+            self.completion_cache.put(cache_key, response.to_dict_recursive())
+
+        return response
+
+    def stream_chat_completion(self, model, messages, temperature, max_tokens=None, index_generation=None):
+        """A generator to yield the content of a chat completion as its tokens arrive.
+
+        A cached completion is yielded at once and a streamed cacheable completion is cached once it is complete.
+        """
+
+        cache_key = None
+        if self.completion_cache.is_cacheable(temperature):
+            cache_key = completion_cache_key(model, messages, temperature, max_tokens, None, index_generation)
+            cached_response = self.completion_cache.get(cache_key)
+            if cached_response is not None:
+                yield cached_response["choices"][0]["message"]["content"]
+                return
+
+        content = []
+        for delta in self._stream({"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens}):
+            token = delta.get("content")
+            if token:
+                content.append(token)
+                yield token
+
+        if cache_key is not None:
+            self.completion_cache.put(cache_key, {"choices": [{"message": {"role": "assistant", "content": "".join(content)}}]})
 
     def get_completion_from_messages(self, messages, functions=[], temperature=0.5, max_tokens=1750):
         """A function to get completion from provided messages using GPT models."""
         
-        openai.api_key = self.api_key
-        if len(functions) > 0:
-            response = openai.ChatCompletion.create(
-                model=self.select_model(messages=messages, max_tokens=max_tokens),
-                messages=messages,
-                functions=functions,
-                function_call="auto",
-                temperature=temperature,
-                max_tokens=max_tokens,
-            )
-        else:
-            response = openai.ChatCompletion.create(
-                model=self.select_model(messages=messages, max_tokens=max_tokens),
-                messages=messages,
-                temperature=temperature,
-                max_tokens=max_tokens,
-            )
-
-        return response
+        return self.create_chat_completion(
+            model=self.select_model(messages=messages, max_tokens=max_tokens, functions=functions),
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            functions=functions,
+        )
     
-    def retrieval_qa(self, query, prompt, db, return_source_documents: bool=True):
-        """A function to use retrivers from vectorstores and generate completions with GPT models. """
+    def get_qa_chain(self, prompt, db, index_generation=None, k: int=6, search_type: str="mmr"):
+        """A function to return the RetrievalQA chain for the given index generation, prompt and search settings, building it only once."""
+
+        chain_key = (index_generation if index_generation is not None else id(db), prompt.template, k, search_type)
+        with self._qa_chains_lock:
+            retriever_qa_chain = self._qa_chains.get(chain_key)
+            if retriever_qa_chain is None:
+                # Chains of older index generations are not used anymore
+                self._qa_chains = {key: chain for key, chain in self._qa_chains.items() if key[0] == chain_key[0]}
+                if hybrid_search["enabled"]:
+                    retriever = HYBRID_RETRIEVER(vectorstore=db,
+                                                 search_type=search_type,
+                                                 search_kwargs={'k': k},
+                                                 candidates=hybrid_search["candidates"],
+                                                 rrf_k=hybrid_search["rrf_k"],
+                                                 max_term_ratio=hybrid_search["max_term_ratio"])
+                else:
+                    retriever = db.as_retriever(search_type=search_type, search_kwargs={'k': k})
+                retriever_qa_chain = RetrievalQA.from_chain_type(llm=self.langchain_llm,
+                                                                retriever=retriever,
+                                                                chain_type="stuff",
+                                                                return_source_documents=True,
+                                                                chain_type_kwargs={"prompt": prompt})
+                self._qa_chains[chain_key] = retriever_qa_chain
+
+        return retriever_qa_chain
+
+    def _qa_completion(self, model, prompt_text, index_generation=None) -> str:
+        """A function to get the QA answer of an assembled prompt, answering repeated cacheable requests from the completion cache."""
+
+        response = self.create_chat_completion(model=model,
+                                               messages=[{"role": "user", "content": prompt_text}],
+                                               temperature=self.langchain_llm.temperature,
+                                               max_tokens=self.langchain_llm.max_tokens,
+                                               index_generation=index_generation)
+        return response.choices[0].message.content
+
+    def _prepare_qa(self, query, prompt, db, index_generation=None, k: int=6, search_type: str="mmr"):
+        """A function to retrieve the source documents, assemble the QA prompt and route it, timing both phases."""
+
+        retriever_qa_chain = self.get_qa_chain(prompt=prompt, db=db, index_generation=index_generation, k=k, search_type=search_type)
+        combine_documents_chain = retriever_qa_chain.combine_documents_chain
+        timings = {}
+
+        start_time = time.perf_counter()
+        source_documents = retriever_qa_chain.retriever.get_relevant_documents(query)
+        timings["retrieval"] = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        inputs = combine_documents_chain._get_inputs(source_documents, question=query)
+        prompt_text = combine_documents_chain.llm_chain.prompt.format(**inputs)
+
+        model = self.select_model(messages=[{"role": "user", "content": prompt_text}],
+                                  max_tokens=self.langchain_llm.max_tokens)
+        timings["prompt_assembly"] = time.perf_counter() - start_time
+
+        return source_documents, prompt_text, model, timings
+
+    def retrieval_qa(self, query, prompt, db, return_source_documents: bool=True, index_generation=None, k: int=6, search_type: str="mmr"):
+        """A function to use retrivers from vectorstores and generate completions with GPT models.
+
+        The result contains the time spent in retrieval, prompt assembly and the LLM call under the "timings" key.
+        """
 
         try:
-            retriever = db.as_retriever(search_type="mmr", search_kwargs={'k': 6})
-            retriever_qa_chain = RetrievalQA.from_chain_type(llm=self.langchain_llm,
-                                                            retriever=retriever,
-                                                            chain_type="stuff",
-                                                            return_source_documents=return_source_documents,
-                                                            chain_type_kwargs={"prompt": prompt})
-            result = retriever_qa_chain({'query': query})
+            source_documents, prompt_text, model, timings = self._prepare_qa(query, prompt, db, index_generation, k, search_type)
+
+            start_time = time.perf_counter()
+            answer = self._qa_completion(model, prompt_text, index_generation)
+            timings["llm"] = time.perf_counter() - start_time
+
+            result = {"query": query, "result": answer, "model": model, "timings": timings}
+            if return_source_documents:
+                result["source_documents"] = source_documents
 
             return result
         except Exception as e:
             print(f"Error retrieving response: {e}")
             return None
 
-    def abstract_summary_extraction(self, transcription):
-        openai.api_key = self.api_key
-        response = openai.ChatCompletion.create(
-            model=self.large_context_model,
+    def stream_retrieval_qa(self, query, prompt, db, return_source_documents: bool=True, index_generation=None, k: int=6, search_type: str="mmr"):
+        """A function to retrieve the context of a query and return the answer as a token generator under the "stream" key.
+
+        The "result" and the "first_token" and "llm" timings are filled in once the stream is consumed.
+        """
+
+        try:
+            source_documents, prompt_text, model, timings = self._prepare_qa(query, prompt, db, index_generation, k, search_type)
+        except Exception as e:
+            print(f"Error retrieving response: {e}")
+            return None
+
+        result = {"query": query, "result": None, "model": model, "timings": timings}
+        if return_source_documents:
+            result["source_documents"] = source_documents
+
+        def answer_stream():
+            start_time = time.perf_counter()
+            answer = []
+            for token in self.stream_chat_completion(model=model,
+                                                     messages=[{"role": "user", "content": prompt_text}],
+                                                     temperature=self.langchain_llm.temperature,
+                                                     max_tokens=self.langchain_llm.max_tokens,
+                                                     index_generation=index_generation):
+                if not answer:
+                    timings["first_token"] = time.perf_counter() - start_time
+                answer.append(token)
+                yield token
+            timings["llm"] = time.perf_counter() - start_time
+            result["result"] = "".join(answer)
+
+        result["stream"] = answer_stream()
+        return result
+
+    def split_transcript(self, transcription: str, chunk_tokens: int=None) -> list:
+        """A function to split the transcript into chunks of at most chunk_tokens tokens, keeping line boundaries where possible."""
+
+        chunk_tokens = chunk_tokens or self.minutes_chunk_tokens
+        encoding = get_encoding(self.large_context_model)
+
+        chunks = []
+        current_lines = []
+        current_tokens = 0
+        for line in transcription.splitlines(keepends=True):
+            line_tokens = encoding.encode(line)
+            # Hard split a single line which does not fit into one chunk
+            if len(line_tokens) > chunk_tokens:
+                if current_lines:
+                    chunks.append("".join(current_lines))
+                    current_lines, current_tokens = [], 0
+                for start in range(0, len(line_tokens), chunk_tokens):
+                    chunks.append(encoding.decode(line_tokens[start:start + chunk_tokens]))
+                continue
+
+            if current_tokens + len(line_tokens) > chunk_tokens:
+                chunks.append("".join(current_lines))
+                current_lines, current_tokens = [], 0
+            current_lines.append(line)
+            current_tokens += len(line_tokens)
+
+        if current_lines:
+            chunks.append("".join(current_lines))
+
+        return chunks
+
+    def _group_partial_results(self, partial_results: list, chunk_tokens: int, to_text=str) -> list:
+        """A function to pack partial results, sent as to_text of them, into groups that fit into a single reduce call."""
+
+        groups = []
+        current_group = []
+        current_tokens = 0
+        for partial_result in partial_results:
+            partial_tokens = self.num_tokens_from_string(to_text(partial_result), model=self.large_context_model)
+            # Always pair at least two results in a group so that every reduce level makes progress
+            if len(current_group) > 1 and current_tokens + partial_tokens > chunk_tokens:
+                groups.append(current_group)
+                current_group, current_tokens = [], 0
+            current_group.append(partial_result)
+            current_tokens += partial_tokens
+
+        if len(current_group) == 1 and groups:
+            groups[-1].append(current_group[0])
+        elif current_group:
+            groups.append(current_group)
+
+        return groups
+
+    def _minutes_completion(self, messages) -> str:
+        """A function to get the content of a deterministic completion used for meeting minutes."""
+
+        response = self.create_chat_completion(
+            model=self.select_model(messages=messages, max_tokens=self.minutes_max_tokens),
+            messages=messages,
             temperature=0,
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a highly skilled AI trained in language comprehension and summarization. I would like you to read the following text and summarize it into a concise abstract paragraph. Aim to retain the most important points, providing a coherent and readable summary that could help a person understand the main points of the discussion without needing to read the entire text. Please avoid unnecessary details or tangential points."
-                },
-                {
-                    "role": "user",
-                    "content": transcription
-                }
-            ]
+            max_tokens=self.minutes_max_tokens,
         )
-        # Access the 'choices' attribute of the ChatCompletion object
-        choice = response.choices[0]
-        
-        # Access the 'message' attribute of the choice object
-        message = choice.message
-        
-        # Access the 'content' attribute of the message object
-        return message.content
+        # Access the content of the message of the first choice
+        return response.choices[0].message.content
 
-    def key_points_extraction(self, transcription):
-        openai.api_key = self.api_key
-        response = openai.ChatCompletion.create(
-            model=self.large_context_model,
+    def extract_minutes_section(self, section: str, transcription: str) -> str:
+        """A function to extract a section of the meeting minutes from the transcript text."""
+
+        return self._minutes_completion(minutes_section_prompt(section, transcription))
+
+    def reduce_minutes_section(self, section: str, partial_results: list) -> str:
+        """A function to combine the partial results of a meeting minutes section into one."""
+
+        return self._minutes_completion(minutes_reduce_prompt(section, partial_results))
+
+    def _combined_minutes_completion(self, messages, fallback) -> dict:
+        """A function to get every section of the meeting minutes from a single deterministic function call.
+
+        The response is validated against MINUTES_FUNCTION and only the sections which fail are requested again
+        with fallback(section), one request per section.
+        """
+
+        functions = [MINUTES_FUNCTION]
+        response = self.create_chat_completion(
+            model=self.select_model(messages=messages, max_tokens=self.minutes_max_tokens, functions=functions),
+            messages=messages,
             temperature=0,
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a proficient AI with a specialty in distilling information into key points. Based on the following text, identify and list the main points that were discussed or brought up. These should be the most important ideas, findings, or topics that are crucial to the essence of the discussion. Your goal is to provide a list that someone could read to quickly understand what was talked about."
-                },
-                {
-                    "role": "user",
-                    "content": transcription
-                }
-            ]
+            max_tokens=self.minutes_max_tokens,
+            functions=functions,
+            function_call={"name": MINUTES_FUNCTION["name"]},
         )
-            # Access the 'choices' attribute of the ChatCompletion object
-        choice = response.choices[0]
-        
-        # Access the 'message' attribute of the choice object
-        message = choice.message
-        
-        # Access the 'content' attribute of the message object
-        return message.content
+        function_call = response.choices[0].message.get("function_call")
+        sections = parse_minutes_arguments(function_call.get("arguments") if function_call else None)
 
-    def action_item_extraction(self, transcription):
-        openai.api_key = self.api_key
-        response = openai.ChatCompletion.create(
-            model=self.large_context_model,
-            temperature=0,
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are an AI expert in analyzing conversations and extracting action items. Please review the text and identify any tasks, assignments, or actions that were agreed upon or mentioned as needing to be done. These could be tasks assigned to specific individuals, or general actions that the group has decided to take. Please list these action items clearly and concisely."
-                },
-                {
-                    "role": "user",
-                    "content": transcription
-                }
-            ]
+        failed_sections = [section for section in MINUTES_SECTIONS if section not in sections]
+        if failed_sections:
+            logger.warning("The combined minutes response has no valid %s, requesting them separately.", ", ".join(failed_sections))
+        for section in failed_sections:
+            sections[section] = fallback(section)
+
+        return {section: sections[section] for section in MINUTES_SECTIONS}
+
+    def extract_minutes(self, transcription: str) -> dict:
+        """A function to extract every section of the meeting minutes from the transcript text, reading the transcript once."""
+
+        return self._combined_minutes_completion(
+            combined_minutes_prompt(transcription),
+            fallback=lambda section: self.extract_minutes_section(section, transcription),
         )
-        # Access the 'choices' attribute of the ChatCompletion object
-        choice = response.choices[0]
-        
-        # Access the 'message' attribute of the choice object
-        message = choice.message
-        
-        # Access the 'content' attribute of the message object
-        return message.content
\ No newline at end of file
+
+    def reduce_minutes(self, partial_minutes: list) -> dict:
+        """A function to combine the meeting minutes of consecutive transcript chunks into one in a single request."""
+
+        return self._combined_minutes_completion(
+            combined_minutes_reduce_prompt([format_minutes_text(minutes) for minutes in partial_minutes]),
+            fallback=lambda section: self.reduce_minutes_section(section, [minutes[section] for minutes in partial_minutes]),
+        )
+
+    def _map_reduce_combined_minutes(self, chunks: list, chunk_tokens: int, max_workers: int=None, keep_final_reduce: bool=False) -> list:
+        """A function to extract the meeting minutes of every chunk concurrently, with one request per chunk, and reduce them level by level.
+
+        With keep_final_reduce the partial minutes are returned once they fit into a single reduce call.
+        """
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers or self.minutes_max_workers) as executor:
+            partial_minutes = list(executor.map(self.extract_minutes, chunks))
+
+            while len(partial_minutes) > 1:
+                groups = self._group_partial_results(partial_minutes, chunk_tokens, to_text=format_minutes_text)
+                if keep_final_reduce and len(groups) == 1:
+                    break
+                partial_minutes = list(executor.map(self.reduce_minutes, groups))
+
+        return partial_minutes
+
+    def _map_reduce_minutes(self, chunks: list, chunk_tokens: int, max_workers: int=None, keep_final_reduce: bool=False) -> dict:
+        """A function to extract every section from every chunk concurrently and reduce the partial results level by level.
+
+        With keep_final_reduce the last reduce of each section is left to the caller, so the partial results of a
+        section are returned once they fit into a single reduce call.
+        """
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers or self.minutes_max_workers) as executor:
+            # Map: extract every section from every chunk
+            futures = {
+                section: [executor.submit(self.extract_minutes_section, section, chunk) for chunk in chunks]
+                for section in MINUTES_SECTIONS
+            }
+            partial_results = {section: [future.result() for future in section_futures] for section, section_futures in futures.items()}
+
+            # Reduce: combine the partial results of all sections level by level
+            while True:
+                groups = {
+                    section: self._group_partial_results(results, chunk_tokens)
+                    for section, results in partial_results.items()
+                    if len(results) > 1
+                }
+                if keep_final_reduce:
+                    groups = {section: section_groups for section, section_groups in groups.items() if len(section_groups) > 1}
+                if not groups:
+                    break
+
+                futures = {
+                    section: [executor.submit(self.reduce_minutes_section, section, group) for group in section_groups]
+                    for section, section_groups in groups.items()
+                }
+                for section, section_futures in futures.items():
+                    partial_results[section] = [future.result() for future in section_futures]
+
+        return partial_results
+
+    def generate_meeting_minutes(self, transcription: str, max_workers: int=None, chunk_tokens: int=None) -> dict:
+        """A function to generate the meeting minutes with a map-reduce over token bounded transcript chunks.
+
+        Every (section, chunk) extraction runs concurrently on a bounded thread pool, after which the
+        partial results of each section are reduced level by level until a single result remains.
+        With combined extraction every chunk and every reduce is a single request for all sections.
+        """
+
+        chunk_tokens = chunk_tokens or self.minutes_chunk_tokens
+        chunks = self.split_transcript(transcription, chunk_tokens=chunk_tokens)
+        if not chunks:
+            chunks = [transcription]
+
+        if self.minutes_combined_extraction:
+            return self._map_reduce_combined_minutes(chunks, chunk_tokens, max_workers=max_workers)[0]
+
+        partial_results = self._map_reduce_minutes(chunks, chunk_tokens, max_workers=max_workers)
+
+        return {section: partial_results[section][0] for section in MINUTES_SECTIONS}
+
+    def stream_meeting_minutes(self, transcription: str, max_workers: int=None, chunk_tokens: int=None) -> dict:
+        """A function to generate the meeting minutes and return a token generator for every section.
+
+        The map and intermediate reduce calls run as in generate_meeting_minutes, only the final call of every
+        section is streamed. The final calls of all sections start at once in background threads, so a section
+        keeps generating while an earlier one is being consumed.
+
+        With combined extraction the chunks of a longer transcript are read once by combined requests. A transcript
+        of a single chunk is streamed with one request per section all the same, since the sections of a single
+        function call would only be complete once the whole call is.
+        """
+
+        chunk_tokens = chunk_tokens or self.minutes_chunk_tokens
+        chunks = self.split_transcript(transcription, chunk_tokens=chunk_tokens)
+        if self.minutes_combined_extraction and len(chunks) > 1:
+            partial_minutes = self._map_reduce_combined_minutes(chunks, chunk_tokens, max_workers=max_workers, keep_final_reduce=True)
+            final_messages = {
+                section: minutes_reduce_prompt(section, [minutes[section] for minutes in partial_minutes])
+                for section in MINUTES_SECTIONS
+            }
+        elif len(chunks) <= 1:
+            final_messages = {section: minutes_section_prompt(section, transcription) for section in MINUTES_SECTIONS}
+        else:
+            partial_results = self._map_reduce_minutes(chunks, chunk_tokens, max_workers=max_workers, keep_final_reduce=True)
+            final_messages = {section: minutes_reduce_prompt(section, partial_results[section]) for section in MINUTES_SECTIONS}
+
+        return {
+            section: stream_in_background(self.stream_chat_completion(
+                model=self.select_model(messages=messages, max_tokens=self.minutes_max_tokens),
+                messages=messages,
+                temperature=0,
+                max_tokens=self.minutes_max_tokens,
+            ))
+            for section, messages in final_messages.items()
+        }
+
+    def abstract_summary_extraction(self, transcription):
+        return self.extract_minutes_section("abstract_summary", transcription)
+
+    def key_points_extraction(self, transcription):
+        return self.extract_minutes_section("key_points", transcription)
+
+    def action_item_extraction(self, transcription):
+        return self.extract_minutes_section("action_items", transcription)
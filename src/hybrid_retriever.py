@@ -0,0 +1,50 @@
+""" A python file to define the retriever which fuses the vector search of the FAISS store with its BM25 lexical search.
+    Embeddings blur exact words such as names, ticket numbers and dates, which the lexical search matches as they are.
+    Both searches return ranked candidates, fused with reciprocal rank fusion: a chunk scores the sum of 1 / (rrf_k + rank)
+    over the rankings it appears in, so that the scores of the two searches never have to be compared.
+"""
+
+from typing import ClassVar, Collection
+from langchain.schema.vectorstore import VectorStoreRetriever
+
+def reciprocal_rank_fusion(rankings: list, rrf_k: int=60) -> list:
+    """ A function to fuse rankings of documents into a single ranking, counting a chunk once per ranking.
+        Chunks with the same source and text are the same chunk, so duplicates are dropped before the LLM call.
+    """
+    scores = {}
+    documents = {}
+    for ranking in rankings:
+        seen = set()
+        for rank, document in enumerate(ranking, start=1):
+            key = (document.metadata.get("source"), document.page_content)
+            if key in seen:
+                continue
+            seen.add(key)
+            documents.setdefault(key, document)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+
+    # Ties keep the order in which the chunks were first ranked
+    return [documents[key] for key in sorted(scores, key=lambda key: -scores[key])]
+
+class HYBRID_RETRIEVER(VectorStoreRetriever):
+    """ A class to retrieve the k best chunks of the fused vector and lexical rankings of a FAISS_STORE.
+        Each search ranks `candidates` chunks, and lexical searches leave out words found in more than `max_term_ratio`
+        of the chunks, so that common words neither add weak candidates nor make the search read most of the index.
+    """
+
+    allowed_search_types: ClassVar[Collection[str]] = ("similarity", "mmr")
+    candidates: int = 20
+    rrf_k: int = 60
+    max_term_ratio: float = 0.2
+
+    def _get_relevant_documents(self, query: str, *, run_manager):
+        k = self.search_kwargs.get("k", 4)
+        search_kwargs = dict(self.search_kwargs, k=max(k, self.candidates))
+        if self.search_type == "mmr":
+            search_kwargs.setdefault("fetch_k", 2 * search_kwargs["k"])
+            vector_documents = self.vectorstore.max_marginal_relevance_search(query, **search_kwargs)
+        else:
+            vector_documents = self.vectorstore.similarity_search(query, **search_kwargs)
+        lexical_documents = self.vectorstore.lexical_search(query, k=search_kwargs["k"], max_term_ratio=self.max_term_ratio)
+
+        return reciprocal_rank_fusion([vector_documents, lexical_documents], rrf_k=self.rrf_k)[:k]
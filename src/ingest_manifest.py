@@ -0,0 +1,94 @@
+""" A python file to keep a persistent manifest of the files and text chunks that are already stored in the vector database.
+    Files and chunks are keyed by the content hash so that re-uploaded or refreshed transcripts are not embedded twice.
+"""
+
+import os
+import json
+import hashlib
+import datetime
+
+MANIFEST_FILE_NAME = "manifest.json"
+
+def content_hash(content) -> str:
+    """ A function to return the sha256 hex digest of a text or bytes content.
+    """
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.sha256(content).hexdigest()
+
+def file_hash(file_path: str, block_size: int=1024 * 1024) -> str:
+    """ A function to return the sha256 hex digest of a file, reading it in blocks.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class INGEST_MANIFEST:
+    """ A class to track the file and chunk hashes that are stored in a vector database.
+    """
+
+    def __init__(self, db_path: str) -> None:
+        self.manifest_path = os.path.join(db_path, MANIFEST_FILE_NAME)
+        self.files = {}
+        self.chunks = {}
+        self.load()
+
+    def load(self):
+        """ A method to load the manifest from the database directory if it exists.
+        """
+        if os.path.isfile(self.manifest_path):
+            with open(self.manifest_path, "r") as manifest_file:
+                manifest = json.load(manifest_file)
+            self.files = manifest.get("files", {})
+            self.chunks = manifest.get("chunks", {})
+
+    def save(self):
+        """ A method to atomically write the manifest next to the vector database.
+        """
+        os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+        temp_path = f"{self.manifest_path}.tmp"
+        with open(temp_path, "w") as manifest_file:
+            json.dump({"files": self.files, "chunks": self.chunks}, manifest_file)
+        os.replace(temp_path, self.manifest_path)
+
+    def reset(self):
+        """ A method to forget every file and chunk, used when the database is overwritten.
+        """
+        self.files = {}
+        self.chunks = {}
+
+    def has_file(self, file_digest: str) -> bool:
+        return file_digest in self.files
+
+    def has_chunk(self, chunk_digest: str) -> bool:
+        return chunk_digest in self.chunks
+
+    def add_file(self, file_digest: str, file_name: str, chunk_digests: list):
+        """ A method to record a file and the chunk hashes it contributed to the database.
+        """
+        self.files[file_digest] = {
+            "file_name": file_name,
+            "chunks": chunk_digests,
+            "ingested_at": datetime.datetime.now().isoformat(),
+        }
+        for chunk_digest in chunk_digests:
+            self.chunks.setdefault(chunk_digest, file_name)
+
+    def remove_files(self, file_names: list) -> set:
+        """ A method to forget the files with the given names and return the hashes of the chunks that no remaining file contributed.
+            Chunks shared with a remaining file are recorded under that file instead.
+        """
+        file_names = set(file_names)
+        removed_chunks = set()
+        for file_digest, file_info in list(self.files.items()):
+            if file_info["file_name"] in file_names:
+                removed_chunks.update(file_info["chunks"])
+                del self.files[file_digest]
+
+        self.chunks = {}
+        for file_info in self.files.values():
+            for chunk_digest in file_info["chunks"]:
+                self.chunks.setdefault(chunk_digest, file_info["file_name"])
+        return removed_chunks - self.chunks.keys()
@@ -0,0 +1,394 @@
+""" A python file to run ingestion and meeting minutes jobs on a local worker pool instead of the Streamlit script thread.
+    Jobs and their status, progress and results are persisted in SQLite, so that a browser refresh or a second session
+    only polls them, and identical jobs which are already queued or running are submitted only once.
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from gpt_utils import api_key_hash, get_gpt_utils, get_shared_gpt_utils
+from db_utils import VECTOR_DB_UTILS, knowledge_base_path
+from text_extraction import extract_text
+from ingest_manifest import content_hash, file_hash
+from blob_utils import BLOB_SYNC_UTILS, create_container_client
+
+# Get the absolute path to the project root directory
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Load the config.json file
+with open(f"{project_root}/config/config.json", "r") as config_file:
+    config = json.load(config_file)
+
+JOB_QUEUE_FILE = config["JOB_QUEUE_FILE"]  # Load name of the SQLite file holding the jobs
+JOB_WORKERS = config["JOB_WORKERS"]  # Load number of worker threads running jobs
+JOB_POLL_INTERVAL = config["JOB_POLL_INTERVAL"]  # Load seconds between checks for jobs submitted by other processes
+
+job_queue_path = f"{project_root}/{JOB_QUEUE_FILE}"
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+# Running jobs whose worker stopped sending heartbeats are queued again, up to MAX_JOB_ATTEMPTS runs in total
+HEARTBEAT_INTERVAL = 10
+STALE_JOB_SECONDS = 60
+MAX_JOB_ATTEMPTS = 3
+# Minimum seconds between two saves of the partial output of a job
+PARTIAL_OUTPUT_INTERVAL = 0.5
+
+# Finished jobs are kept for a week
+JOB_RETENTION_SECONDS = 7 * 24 * 3600
+
+_shared_job_queue = None
+_shared_job_queue_lock = threading.Lock()
+
+class JOB:
+    """ A class passed to a job handler to report the progress of its job.
+    """
+
+    def __init__(self, job_queue, job_id: str) -> None:
+        self.job_queue = job_queue
+        self.job_id = job_id
+
+    def progress(self, fraction: float, message: str=""):
+        self.job_queue.update_progress(self.job_id, fraction, message)
+
+    def partial(self, output):
+        self.job_queue.update_partial(self.job_id, output)
+
+class JOB_QUEUE:
+    """ A class to submit jobs of registered kinds, run them on a pool of worker threads and report their state.
+        Handlers are called as handler(job, **params) and return a JSON serialisable result.
+    """
+
+    def __init__(self, path: str=job_queue_path, max_workers: int=JOB_WORKERS, poll_interval: float=JOB_POLL_INTERVAL) -> None:
+        self.path = path
+        self.max_workers = max_workers
+        self.poll_interval = poll_interval
+        self.handlers = {}
+        self._running_jobs = set()
+        self._running_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._workers = []
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    dedup_key TEXT,
+                    status TEXT NOT NULL,
+                    progress REAL NOT NULL DEFAULT 0,
+                    message TEXT NOT NULL DEFAULT '',
+                    params TEXT NOT NULL,
+                    result TEXT,
+                    partial TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    heartbeat_at REAL,
+                    finished_at REAL
+                )"""
+            )
+            # Job queues created before jobs saved their partial output
+            if "partial" not in [column[1] for column in connection.execute("PRAGMA table_info(jobs)")]:
+                connection.execute("ALTER TABLE jobs ADD COLUMN partial TEXT")
+            connection.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+            # At most one queued or running job per deduplication key
+            connection.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_active_dedup_key ON jobs (dedup_key) WHERE status IN ('queued', 'running')"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def register(self, kind: str, handler):
+        """ A method to register the handler which runs the jobs of a kind.
+        """
+        self.handlers[kind] = handler
+
+    def start(self):
+        """ A method to start the worker threads and the heartbeat of their jobs once per queue.
+        """
+        if self._workers:
+            return
+        with self._connect() as connection:
+            connection.execute("DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                               (SUCCEEDED, FAILED, time.time() - JOB_RETENTION_SECONDS))
+        for worker_num in range(self.max_workers):
+            worker = threading.Thread(target=self._work, name=f"job-worker-{worker_num}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True).start()
+
+    def submit(self, kind: str, params: dict=None, dedup_key: str=None) -> str:
+        """ A method to queue a job and return its id. If a job with the same dedup_key is queued or running, its id is
+            returned instead and nothing is queued.
+        """
+        job_id = uuid.uuid4().hex
+        try:
+            with self._connect() as connection:
+                connection.execute(
+                    "INSERT INTO jobs (job_id, kind, dedup_key, status, params, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (job_id, kind, dedup_key, QUEUED, json.dumps(params or {}), time.time()),
+                )
+        except sqlite3.IntegrityError:
+            with self._connect() as connection:
+                row = connection.execute(
+                    "SELECT job_id FROM jobs WHERE dedup_key = ? AND status IN (?, ?)", (dedup_key, *ACTIVE_STATUSES)
+                ).fetchone()
+            if row is not None:
+                return row[0]
+            # The duplicate finished in the meantime
+            return self.submit(kind, params, dedup_key)
+
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id: str):
+        """ A method to return the state of a job as a dictionary, or None if it does not exist.
+        """
+        jobs = self.get_jobs([job_id])
+        return jobs[0] if jobs else None
+
+    def get_jobs(self, job_ids: list) -> list:
+        """ A method to return the state of the given jobs in the order of their ids, leaving out unknown ids.
+        """
+        if not job_ids:
+            return []
+        with self._connect() as connection:
+            connection.row_factory = sqlite3.Row
+            placeholders = ",".join("?" * len(job_ids))
+            rows = connection.execute(f"SELECT * FROM jobs WHERE job_id IN ({placeholders})", list(job_ids)).fetchall()
+
+        jobs = {}
+        for row in rows:
+            job = dict(row)
+            job["params"] = json.loads(job["params"])
+            job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+            job["partial"] = json.loads(job["partial"]) if job["partial"] is not None else None
+            jobs[job["job_id"]] = job
+        return [jobs[job_id] for job_id in job_ids if job_id in jobs]
+
+    def update_progress(self, job_id: str, fraction: float, message: str=""):
+        with self._connect() as connection:
+            connection.execute("UPDATE jobs SET progress = ?, message = ?, heartbeat_at = ? WHERE job_id = ?",
+                               (min(max(fraction, 0.0), 1.0), message, time.time(), job_id))
+
+    def update_partial(self, job_id: str, output):
+        """ A method to save the output a running job has generated so far, which pollers show before the job ends.
+        """
+        with self._connect() as connection:
+            connection.execute("UPDATE jobs SET partial = ?, heartbeat_at = ? WHERE job_id = ?",
+                               (json.dumps(output), time.time(), job_id))
+
+    def _claim(self):
+        """ A method to mark the oldest queued job of a registered kind as running and return its id, kind and params.
+            Stale running jobs of stopped workers are queued again first, or failed after MAX_JOB_ATTEMPTS.
+        """
+        now = time.time()
+        kinds = list(self.handlers)
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute(
+                "UPDATE jobs SET status = ?, error = 'The worker running the job stopped', finished_at = ? "
+                "WHERE status = ? AND heartbeat_at < ? AND attempts >= ?",
+                (FAILED, now, RUNNING, now - STALE_JOB_SECONDS, MAX_JOB_ATTEMPTS),
+            )
+            connection.execute("UPDATE jobs SET status = ? WHERE status = ? AND heartbeat_at < ?",
+                               (QUEUED, RUNNING, now - STALE_JOB_SECONDS))
+            if not kinds:
+                return None
+
+            placeholders = ",".join("?" * len(kinds))
+            row = connection.execute(
+                f"SELECT job_id, kind, params FROM jobs WHERE status = ? AND kind IN ({placeholders}) ORDER BY created_at LIMIT 1",
+                (QUEUED, *kinds),
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, started_at = ?, heartbeat_at = ? WHERE job_id = ?",
+                (RUNNING, now, now, row[0]),
+            )
+        return row[0], row[1], json.loads(row[2])
+
+    def _work(self):
+        """ A method to run queued jobs one at a time until the process exits.
+        """
+        while True:
+            try:
+                claimed = self._claim()
+            except sqlite3.Error as e:
+                print(f"An error occurred while claiming a job: {e}")
+                claimed = None
+
+            if claimed is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            job_id, kind, params = claimed
+            with self._running_lock:
+                self._running_jobs.add(job_id)
+            try:
+                result = self.handlers[kind](JOB(self, job_id), **params)
+                self._finish(job_id, SUCCEEDED, result=result)
+            except Exception as e:
+                print(f"Job {job_id} ({kind}) failed: {e}")
+                self._finish(job_id, FAILED, error=str(e))
+            finally:
+                with self._running_lock:
+                    self._running_jobs.discard(job_id)
+
+    def _finish(self, job_id: str, status: str, result=None, error: str=None):
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = ?, progress = ?, result = ?, error = ?, finished_at = ? WHERE job_id = ?",
+                (status, 1.0 if status == SUCCEEDED else 0.0, json.dumps(result) if result is not None else None,
+                 error, time.time(), job_id),
+            )
+
+    def _heartbeat(self):
+        """ A method to mark the jobs running in this process as alive, so that no other process takes them over.
+        """
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            with self._running_lock:
+                job_ids = list(self._running_jobs)
+            if not job_ids:
+                continue
+            try:
+                with self._connect() as connection:
+                    placeholders = ",".join("?" * len(job_ids))
+                    connection.execute(f"UPDATE jobs SET heartbeat_at = ? WHERE job_id IN ({placeholders})", (time.time(), *job_ids))
+            except sqlite3.Error as e:
+                print(f"An error occurred while updating the job heartbeat: {e}")
+
+def _job_gpt_utils(key_hash: str):
+    """ A function to return the GPT client of the API key a job was submitted with, without persisting the key itself.
+        Jobs recovered after a restart use the OPENAI_API_KEY environment variable if it is the same key.
+    """
+    gpt = get_shared_gpt_utils(key_hash)
+    environment_key = os.environ.get("OPENAI_API_KEY")
+    if gpt is None and environment_key and api_key_hash(environment_key) == key_hash:
+        gpt = get_gpt_utils(environment_key)
+    if gpt is None:
+        raise RuntimeError("The API key of the job is not configured in this process, please submit it again.")
+    return gpt
+
+def ingest_documents_job(job: JOB, key_hash: str, merge_with_existing_db: bool=True) -> dict:
+    """ A job to build the vector database from the documents of the knowledge base folder.
+    """
+    vector_db = VECTOR_DB_UTILS()
+    db, db_build_time = vector_db.run_db_build(input_type="documents",
+                                               embeddings=_job_gpt_utils(key_hash).embeddings,
+                                               merge_with_existing_db=merge_with_existing_db,
+                                               progress=job.progress)
+    return {"db_exist": db is not None, "build_time": db_build_time, "failures": vector_db.last_load_failures}
+
+def refresh_blobs_job(job: JOB, key_hash: str, ledger_path: str) -> dict:
+    """ A job to download the new transcripts of the blob container and build the database once for the whole batch.
+    """
+    container_client = create_container_client(os.environ.get("CONNECTION_STRING"))
+    blob_sync = BLOB_SYNC_UTILS(container_client=container_client, kb_path=knowledge_base_path, ledger_path=ledger_path)
+
+    ingest_result = {}
+    def ingest():
+        ingest_result.update(ingest_documents_job(job, key_hash, merge_with_existing_db=True))
+        return ingest_result["db_exist"]
+
+    def delete(file_names):
+        job.progress(0.08, f"Removing the previous version of {len(file_names)} changed transcripts")
+        VECTOR_DB_UTILS().delete_files(file_names, embeddings=_job_gpt_utils(key_hash).embeddings)
+
+    job.progress(0.05, "Downloading new transcripts")
+    sync_result = blob_sync.sync(ingest=ingest, delete=delete)
+    return {
+        "downloaded": sync_result["downloaded"],
+        "download_failures": sync_result["failures"],
+        "ingested": sync_result["ingested"],
+        "db_exist": ingest_result.get("db_exist"),
+        "failures": ingest_result.get("failures", []),
+    }
+
+def delete_transcripts_job(job: JOB, key_hash: str, file_names: list) -> dict:
+    """ A job to delete the chunks of transcripts from the vector database, waiting for a running build to finish first.
+    """
+    job.progress(0.1, f"Deleting {len(file_names)} transcripts")
+    deleted_chunks = VECTOR_DB_UTILS().delete_files(file_names, embeddings=_job_gpt_utils(key_hash).embeddings)
+    return {"deleted_chunks": deleted_chunks}
+
+def meeting_minutes_job(job: JOB, key_hash: str, file_path: str) -> dict:
+    """ A job to generate the meeting minutes of a transcript file.
+        The sections are saved as partial output while their tokens arrive, so that the page renders them as they are written.
+        The file is the upload of this job alone, so it is removed once the job ends.
+    """
+    try:
+        job.progress(0.1, "Reading the transcript")
+        transcription = extract_text(file_path)
+        job.progress(0.2, "Generating the meeting minutes")
+        minutes_streams = _job_gpt_utils(key_hash).stream_meeting_minutes(transcription)
+
+        minutes = {}
+        saved_at = 0.0
+        for section_num, (section, minutes_stream) in enumerate(minutes_streams.items()):
+            job.progress(0.2 + 0.8 * section_num / len(minutes_streams), f"Writing the {section.replace('_', ' ')}")
+            tokens = []
+            for token in minutes_stream:
+                tokens.append(token)
+                if time.time() - saved_at >= PARTIAL_OUTPUT_INTERVAL:
+                    job.partial({**minutes, section: "".join(tokens)})
+                    saved_at = time.time()
+            minutes[section] = "".join(tokens)
+            job.partial(minutes)
+        return minutes
+    finally:
+        remove_upload(file_path)
+
+def remove_upload(file_path: str):
+    """ A function to delete an uploaded file and its folder, if no other file is left in it.
+    """
+    try:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        upload_dir = os.path.dirname(file_path)
+        if os.path.isdir(upload_dir) and not os.listdir(upload_dir):
+            os.rmdir(upload_dir)
+    except OSError as e:
+        print(f"An error occurred while deleting the upload '{file_path}': {e}")
+
+def job_dedup_key(kind: str, key_hash: str, file_path: str=None, file_names: list=None) -> str:
+    """ A function to return the key merging a job with the queued or running jobs of the same input.
+        Meeting minutes are merged by transcript content, deletions by file names and builds by the content of the knowledge base folder.
+    """
+    if file_path is not None:
+        return f"{kind}:{key_hash}:{file_hash(file_path)}"
+    if file_names is not None:
+        return f"{kind}:{content_hash(','.join(sorted(file_names)))}"
+    folder_digests = []
+    if os.path.exists(knowledge_base_path):
+        folder_digests = sorted(file_hash(os.path.join(knowledge_base_path, file_name)) for file_name in os.listdir(knowledge_base_path))
+    return f"{kind}:{content_hash(','.join(folder_digests))}"
+
+JOB_HANDLERS = {
+    "ingest_documents": ingest_documents_job,
+    "refresh_blobs": refresh_blobs_job,
+    "delete_transcripts": delete_transcripts_job,
+    "meeting_minutes": meeting_minutes_job,
+}
+
+def get_job_queue() -> JOB_QUEUE:
+    """ A function to return the job queue of the process with the handlers of the app registered and its workers started.
+    """
+    global _shared_job_queue
+    with _shared_job_queue_lock:
+        if _shared_job_queue is None:
+            _shared_job_queue = JOB_QUEUE()
+            for kind, handler in JOB_HANDLERS.items():
+                _shared_job_queue.register(kind, handler)
+            _shared_job_queue.start()
+        return _shared_job_queue
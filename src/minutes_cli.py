@@ -0,0 +1,174 @@
+""" A command line entry point to generate the meeting minutes of many transcripts without the Streamlit app.
+    Transcripts are processed concurrently within the rate limits of the API key, and every finished transcript is
+    appended to a manifest in the output folder, so that an interrupted run resumes where it stopped.
+
+    Run from the project root directory:
+        python src/minutes_cli.py archive/ "more/**/*.pdf" --output-dir minutes_output --workers 8 --formats docx,json
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import threading
+import collections
+import concurrent.futures
+
+# Get the absolute path to the project root directory
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(project_root, "src"))
+
+from gpt_utils import get_gpt_utils
+from async_gpt_utils import close_async_gpt_utils
+from rate_limiter import RATE_LIMITER, OPENAI_RATE_LIMIT_RPM, OPENAI_RATE_LIMIT_TPM
+from text_extraction import extract_text, SUPPORTED_EXTENSIONS
+from ingest_manifest import file_hash
+from docx_utils import write_minutes_docx
+
+# Load the config.json file
+with open(f"{project_root}/config/config.json", "r") as config_file:
+    config = json.load(config_file)
+
+MINUTES_CLI_WORKERS = config["MINUTES_CLI_WORKERS"]  # Load number of transcripts processed concurrently
+MINUTES_CLI_OUTPUT_DIR = config["MINUTES_CLI_OUTPUT_DIR"]  # Load default folder of the generated minutes
+
+OUTPUT_FORMATS = ("docx", "json")
+MANIFEST_FILE_NAME = "manifest.jsonl"
+
+def find_transcripts(inputs: list) -> list:
+    """ A function to return the supported transcripts of directories, searched recursively, and glob patterns, sorted and without duplicates.
+    """
+    file_paths = set()
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "**", "*")
+        for file_path in glob.glob(pattern, recursive=True):
+            if os.path.isfile(file_path) and file_path.lower().endswith(SUPPORTED_EXTENSIONS):
+                file_paths.add(os.path.abspath(file_path))
+    return sorted(file_paths)
+
+class MINUTES_MANIFEST:
+    """ A class to record the transcripts of a batch by content hash in an append only JSON lines file.
+        A line is appended for every finished transcript, so that records survive an interrupted run without rewriting the file.
+    """
+
+    def __init__(self, manifest_path: str) -> None:
+        self.manifest_path = manifest_path
+        self.records = {}
+        self._lock = threading.Lock()
+        if os.path.isfile(manifest_path):
+            with open(manifest_path, "r") as manifest_file:
+                for line in manifest_file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A line cut off by an interrupted run
+                        continue
+                    self.records[record["file_hash"]] = record
+
+    def is_done(self, digest: str, output_paths: list) -> bool:
+        record = self.records.get(digest)
+        return record is not None and record["status"] == "done" and all(os.path.isfile(path) for path in output_paths)
+
+    def add(self, record: dict):
+        with self._lock:
+            self.records[record["file_hash"]] = record
+            with open(self.manifest_path, "a") as manifest_file:
+                manifest_file.write(json.dumps(record) + "\n")
+                manifest_file.flush()
+                os.fsync(manifest_file.fileno())
+
+def output_stems(file_paths: list, digests: dict) -> dict:
+    """ A function to return the output file name without extension of every transcript, which is the transcript name
+        unless several transcripts share it, then it is followed by the start of the content hash.
+    """
+    names = {file_path: os.path.splitext(os.path.basename(file_path))[0] for file_path in file_paths}
+    name_counts = collections.Counter(names.values())
+    return {
+        file_path: name if name_counts[name] == 1 else f"{name}-{digests[file_path][:8]}"
+        for file_path, name in names.items()
+    }
+
+def generate_minutes(gpt, file_path: str, output_base: str, formats: list) -> list:
+    """ A function to generate the meeting minutes of a transcript and write them in the given formats, returning the outputs.
+    """
+    transcription = extract_text(file_path)
+    if not transcription.strip():
+        raise ValueError("The transcript has no text")
+    minutes = gpt.generate_meeting_minutes(transcription)
+
+    output_paths = []
+    if "json" in formats:
+        temp_path = f"{output_base}.json.tmp"
+        with open(temp_path, "w") as json_file:
+            json.dump({"source": file_path, "minutes": minutes}, json_file, indent=2)
+        os.replace(temp_path, f"{output_base}.json")
+        output_paths.append(f"{output_base}.json")
+    if "docx" in formats:
+        write_minutes_docx(minutes, f"{output_base}.docx")
+        output_paths.append(f"{output_base}.docx")
+    return output_paths
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate meeting minutes for directories or glob patterns of transcripts.")
+    parser.add_argument("inputs", nargs="+", help="Directories, searched recursively, or glob patterns of .pdf and .docx transcripts")
+    parser.add_argument("--output-dir", default=os.path.join(project_root, MINUTES_CLI_OUTPUT_DIR), help="Folder of the minutes and the manifest")
+    parser.add_argument("--formats", default="docx,json", help="Comma separated output formats: docx, json")
+    parser.add_argument("--workers", type=int, default=MINUTES_CLI_WORKERS, help="Number of transcripts processed concurrently")
+    parser.add_argument("--rpm", type=int, default=OPENAI_RATE_LIMIT_RPM, help="Maximum OpenAI requests per minute")
+    parser.add_argument("--tpm", type=int, default=OPENAI_RATE_LIMIT_TPM, help="Maximum OpenAI tokens per minute")
+    parser.add_argument("--force", action="store_true", help="Generate the minutes again for transcripts done in an earlier run")
+    args = parser.parse_args()
+
+    formats = [output_format.strip() for output_format in args.formats.split(",") if output_format.strip()]
+    unknown_formats = set(formats) - set(OUTPUT_FORMATS)
+    if unknown_formats or not formats:
+        parser.error(f"Unknown output formats {', '.join(sorted(unknown_formats))}, expected docx and/or json")
+
+    api_key = os.environ.get("OPENAI_API_KEY")
+    if not api_key:
+        parser.error("Please set the OPENAI_API_KEY environment variable")
+    gpt = get_gpt_utils(api_key)
+    gpt.async_client.rate_limiter = RATE_LIMITER(requests_per_minute=args.rpm, tokens_per_minute=args.tpm)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    manifest = MINUTES_MANIFEST(os.path.join(args.output_dir, MANIFEST_FILE_NAME))
+
+    file_paths = find_transcripts(args.inputs)
+    digests = {file_path: file_hash(file_path) for file_path in file_paths}
+    stems = output_stems(file_paths, digests)
+    output_bases = {file_path: os.path.join(args.output_dir, stems[file_path]) for file_path in file_paths}
+
+    pending = [
+        file_path for file_path in file_paths
+        if args.force or not manifest.is_done(digests[file_path], [f"{output_bases[file_path]}.{output_format}" for output_format in formats])
+    ]
+    print(f"Found {len(file_paths)} transcripts, {len(file_paths) - len(pending)} already done, generating {len(pending)}. . .")
+
+    start_time = time.time()
+    failed = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {
+            executor.submit(generate_minutes, gpt, file_path, output_bases[file_path], formats): file_path
+            for file_path in pending
+        }
+        for done_count, future in enumerate(concurrent.futures.as_completed(futures), start=1):
+            file_path = futures[future]
+            record = {"file_hash": digests[file_path], "source": file_path, "finished_at": time.time()}
+            try:
+                record.update(status="done", outputs=future.result())
+            except Exception as e:
+                failed += 1
+                record.update(status="failed", error=str(e))
+                print(f"Failed to generate the minutes of '{file_path}': {e}")
+            manifest.add(record)
+            print(f"[{done_count}/{len(pending)}] {record['status']}: {os.path.basename(file_path)}")
+    close_async_gpt_utils()
+
+    print(f"Generated the minutes of {len(pending) - failed} transcripts in {time.time() - start_time:.1f} seconds, {failed} failed.")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,5 @@
 """ A python file to define prompts for various tasks with GPT models"""
+import functools
 from langchain.prompts import PromptTemplate
 
 def summarize_text(text_input: str, word_limit: int=250):    
@@ -17,8 +18,9 @@ def summarize_text(text_input: str, word_limit: int=250):
 
     return messages
 
+@functools.lru_cache(maxsize=None)
 def prompt_doc_qa():
-    """A prompt template to define a prompt template for Question and Answering of a document."""
+    """A prompt template to define a prompt template for Question and Answering of a document. It is built once and reused."""
 
     template = """Use the following pieces of context and answer the question at the end. \
         If you don't know the answer, just say you don't know. \
@@ -34,4 +36,94 @@ def prompt_doc_qa():
     
     qa_chain_prompt = PromptTemplate(input_variables=["context", "question"],template=template)
 
-    return qa_chain_prompt
\ No newline at end of file
+    return qa_chain_prompt
+
+# System messages used to extract each section of the meeting minutes from a transcript
+MINUTES_SECTION_PROMPTS = {
+    "abstract_summary": "You are a highly skilled AI trained in language comprehension and summarization. I would like you to read the following text and summarize it into a concise abstract paragraph. Aim to retain the most important points, providing a coherent and readable summary that could help a person understand the main points of the discussion without needing to read the entire text. Please avoid unnecessary details or tangential points.",
+    "key_points": "You are a proficient AI with a specialty in distilling information into key points. Based on the following text, identify and list the main points that were discussed or brought up. These should be the most important ideas, findings, or topics that are crucial to the essence of the discussion. Your goal is to provide a list that someone could read to quickly understand what was talked about.",
+    "action_items": "You are an AI expert in analyzing conversations and extracting action items. Please review the text and identify any tasks, assignments, or actions that were agreed upon or mentioned as needing to be done. These could be tasks assigned to specific individuals, or general actions that the group has decided to take. Please list these action items clearly and concisely.",
+}
+
+# System messages used to combine the partial sections extracted from consecutive transcript chunks
+MINUTES_REDUCE_PROMPTS = {
+    "abstract_summary": "You are a highly skilled AI trained in language comprehension and summarization. You are given partial summaries of consecutive parts of a single meeting, separated by #### characters. Combine them into one concise abstract paragraph for the whole meeting. Retain the most important points and avoid repeating the same information.",
+    "key_points": "You are a proficient AI with a specialty in distilling information into key points. You are given lists of key points extracted from consecutive parts of a single meeting, separated by #### characters. Merge them into one list of the main points of the whole meeting. Remove duplicates and keep the most important ideas, findings, or topics.",
+    "action_items": "You are an AI expert in analyzing conversations and extracting action items. You are given lists of action items extracted from consecutive parts of a single meeting, separated by #### characters. Merge them into one clear and concise list of action items for the whole meeting. Remove duplicates and keep the owner of each task where it is mentioned.",
+}
+
+def minutes_section_prompt(section: str, text: str):
+    """A prompt template to extract a section of the meeting minutes from the transcript text."""
+    messages = [
+        {"role": "system", "content": MINUTES_SECTION_PROMPTS[section]},
+        {"role": "user", "content": text},
+    ]
+
+    return messages
+
+def minutes_reduce_prompt(section: str, partial_results: list):
+    """A prompt template to combine partial meeting minutes sections into a single section."""
+    delimitter = "####"
+    messages = [
+        {"role": "system", "content": MINUTES_REDUCE_PROMPTS[section]},
+        {"role": "user", "content": f"\n{delimitter}\n".join(partial_results)},
+    ]
+
+    return messages
+
+# Function schema of the combined extraction, which returns every section of the meeting minutes in a single response
+MINUTES_FUNCTION = {
+    "name": "record_meeting_minutes",
+    "description": "Record the abstract summary, key points and action items of a meeting.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "abstract_summary": {
+                "type": "string",
+                "description": "A concise abstract paragraph which retains the most important points of the discussion.",
+            },
+            "key_points": {
+                "type": "array",
+                "description": "The main ideas, findings or topics that were discussed.",
+                "items": {"type": "string"},
+            },
+            "action_items": {
+                "type": "array",
+                "description": "The tasks, assignments or actions that were agreed upon or mentioned as needing to be done.",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "task": {"type": "string", "description": "The task to be done."},
+                        "owner": {"type": "string", "description": "The person or group responsible, or an empty string if not mentioned."},
+                        "due_date": {"type": "string", "description": "The due date as mentioned, or an empty string if not mentioned."},
+                    },
+                    "required": ["task", "owner", "due_date"],
+                },
+            },
+        },
+        "required": ["abstract_summary", "key_points", "action_items"],
+    },
+}
+
+COMBINED_MINUTES_PROMPT = "You are a highly skilled AI trained in language comprehension, summarization and analyzing conversations. Read the following meeting transcript and record its meeting minutes: a concise abstract summary paragraph that someone could read instead of the entire text, the list of main points that were discussed, and the action items that were agreed upon or mentioned as needing to be done, with the owner and due date of each where they are mentioned. Avoid unnecessary details or tangential points."
+
+COMBINED_MINUTES_REDUCE_PROMPT = "You are a highly skilled AI trained in language comprehension, summarization and analyzing conversations. You are given the meeting minutes of consecutive parts of a single meeting, separated by #### characters. Combine them into the meeting minutes of the whole meeting: one concise abstract summary paragraph, one list of the main points and one list of action items. Remove duplicates and keep the owner and due date of each action item where they are mentioned."
+
+def combined_minutes_prompt(text: str):
+    """A prompt template to extract every section of the meeting minutes from the transcript text in a single request."""
+    messages = [
+        {"role": "system", "content": COMBINED_MINUTES_PROMPT},
+        {"role": "user", "content": text},
+    ]
+
+    return messages
+
+def combined_minutes_reduce_prompt(partial_minutes: list):
+    """A prompt template to combine the meeting minutes of consecutive transcript parts, given as text, in a single request."""
+    delimitter = "####"
+    messages = [
+        {"role": "system", "content": COMBINED_MINUTES_REDUCE_PROMPT},
+        {"role": "user", "content": f"\n{delimitter}\n".join(partial_minutes)},
+    ]
+
+    return messages
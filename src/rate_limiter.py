@@ -0,0 +1,104 @@
+""" A python file to limit the request and token rate sent to the OpenAI API and to compute retry delays.
+    The limiter is a pair of token buckets refilled continuously, usable from threads and from asyncio code.
+"""
+
+import os
+import json
+import time
+import random
+import asyncio
+import threading
+
+# Get the absolute path to the project root directory
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Load the config.json file
+with open(f"{project_root}/config/config.json", "r") as config_file:
+    config = json.load(config_file)
+
+OPENAI_RATE_LIMIT_RPM = config["OPENAI_RATE_LIMIT_RPM"]  # Load maximum number of requests per minute
+OPENAI_RATE_LIMIT_TPM = config["OPENAI_RATE_LIMIT_TPM"]  # Load maximum number of tokens per minute
+OPENAI_BACKOFF_BASE = config["OPENAI_BACKOFF_BASE"]  # Load first retry delay in seconds
+OPENAI_BACKOFF_MAX = config["OPENAI_BACKOFF_MAX"]  # Load maximum retry delay in seconds
+
+def backoff_delay(attempt: int, base: float=OPENAI_BACKOFF_BASE, cap: float=OPENAI_BACKOFF_MAX, retry_after: float=None) -> float:
+    """ A function to return the delay before a retry, exponential in the attempt with full jitter.
+        A Retry-After value sent by the server is used as the lower bound.
+    """
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, min(cap, retry_after))
+    return delay
+
+class RATE_LIMITER:
+    """ A class to limit requests per minute and tokens per minute with two token buckets.
+    """
+
+    def __init__(self, requests_per_minute: int=OPENAI_RATE_LIMIT_RPM, tokens_per_minute: int=OPENAI_RATE_LIMIT_TPM) -> None:
+        self.request_capacity = requests_per_minute
+        self.token_capacity = tokens_per_minute
+        self.available_requests = float(requests_per_minute)
+        self.available_tokens = float(tokens_per_minute)
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed_minutes = (now - self.updated_at) / 60
+        self.available_requests = min(self.request_capacity, self.available_requests + elapsed_minutes * self.request_capacity)
+        self.available_tokens = min(self.token_capacity, self.available_tokens + elapsed_minutes * self.token_capacity)
+        self.updated_at = now
+
+    def _reserve(self, tokens: int) -> float:
+        """ A method to take one request and the given tokens if available, otherwise return the seconds to wait.
+        """
+        # A request larger than the bucket could never be admitted, so it waits for a full bucket instead
+        tokens = min(tokens, self.token_capacity)
+        with self._lock:
+            self._refill()
+            if self.available_requests >= 1 and self.available_tokens >= tokens:
+                self.available_requests -= 1
+                self.available_tokens -= tokens
+                return 0.0
+            request_wait = max(0.0, 1 - self.available_requests) * 60 / self.request_capacity
+            token_wait = max(0.0, tokens - self.available_tokens) * 60 / self.token_capacity
+            return max(request_wait, token_wait)
+
+    def acquire(self, tokens: int=0):
+        """ A method to block the calling thread until the request fits into both limits.
+        """
+        while True:
+            wait = self._reserve(tokens)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens: int=0):
+        """ A method to wait in the event loop until the request fits into both limits.
+        """
+        while True:
+            wait = self._reserve(tokens)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def consume(self, tokens: int):
+        """ A method to charge tokens used beyond the reserved estimate, for example the completion tokens reported by the API.
+            Negative tokens return the part of the estimate which was not used.
+        """
+        with self._lock:
+            self._refill()
+            self.available_tokens = min(self.token_capacity, self.available_tokens - tokens)
+
+_shared_limiters = {}
+_shared_limiters_lock = threading.Lock()
+
+def shared_rate_limiter(key_hash: str) -> RATE_LIMITER:
+    """ A function to return the process wide rate limiter of an API key hash, since rate limits apply per key.
+    """
+    with _shared_limiters_lock:
+        limiter = _shared_limiters.get(key_hash)
+        if limiter is None:
+            limiter = RATE_LIMITER()
+            _shared_limiters[key_hash] = limiter
+        return limiter
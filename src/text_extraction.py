@@ -0,0 +1,49 @@
+""" A python file to extract the text of transcripts page by page or paragraph by paragraph.
+    The same extraction serves meeting minutes generation and the documents loaded into the vector database.
+"""
+
+import PyPDF2
+from docx import Document as DocxDocument
+from langchain.docstore.document import Document
+from langchain.document_loaders.base import BaseLoader
+
+SUPPORTED_EXTENSIONS = ('.docx', '.pdf')
+
+def iter_docx_text(file_path: str):
+    """ A generator to yield the text of every paragraph of a docx file followed by a new line.
+    """
+    for paragraph in DocxDocument(file_path).paragraphs:
+        yield paragraph.text + "\n"
+
+def iter_pdf_text(file_path: str):
+    """ A generator to yield the text of every page of a pdf file, the file is closed as soon as the last page is read.
+    """
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        for page in pdf_reader.pages:
+            yield page.extract_text() or ""
+
+def iter_text(file_path: str):
+    """ A generator to yield the text of a supported transcript in reading order.
+    """
+    if file_path.endswith('.docx'):
+        return iter_docx_text(file_path)
+    elif file_path.endswith('.pdf'):
+        return iter_pdf_text(file_path)
+    else:
+        raise ValueError(f"Unsupported file format: {file_path}")
+
+def extract_text(file_path: str) -> str:
+    """ A function to return the full text of a supported transcript, joined once from the streamed parts.
+    """
+    return "".join(iter_text(file_path))
+
+class TRANSCRIPT_LOADER(BaseLoader):
+    """ A langchain loader returning a transcript as a single document using the streaming extractor.
+    """
+
+    def __init__(self, file_path: str) -> None:
+        self.file_path = file_path
+
+    def load(self) -> list:
+        return [Document(page_content=extract_text(self.file_path), metadata={"source": self.file_path})]